@@ -9,5 +9,17 @@ class Settings(BaseSettings):
 
     FASTAPI_DEBUG: bool = True
 
+    # threads running calculations and default number of concurrent requests per endpoint,
+    # CALCULATION_LIMITS overrides the latter for particular endpoints, e.g. {"get_provision": 1}
+    CALCULATION_WORKERS: int = 8
+    CALCULATION_CONCURRENCY: int = 2
+    CALCULATION_LIMITS: dict[str, int] = {}
+
+    JOBS_DIR: str = str(Path(__file__).resolve().parent.parent.parent / "jobs")
+    # finished jobs are deleted when they are older than JOBS_MAX_AGE seconds
+    # or are not among JOBS_MAX_NUMBER latest ones
+    JOBS_MAX_AGE: int = 7 * 24 * 3600
+    JOBS_MAX_NUMBER: int = 100
+
 
 settings = Settings()
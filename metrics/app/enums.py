@@ -84,6 +84,20 @@ class ProvisionGetInfoObjectTypeEnum(str, AutoName):
     service = auto()
 
 
+class VisibilityAnalysisBatchOutputEnum(str, AutoName):
+    zones = auto()
+    union = auto()
+    count = auto()
+
+
 class CoverageZonesMethodEnum(str, AutoName):
     radius = auto()
     isochrone = auto()
+
+
+class JobStatusEnum(str, AutoName):
+    queued = auto()
+    running = auto()
+    done = auto()
+    failed = auto()
+    interrupted = auto()
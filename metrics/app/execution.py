@@ -0,0 +1,94 @@
+import asyncio
+import time
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from app.core.config import settings
+
+
+class CalculationExecutor:
+    """
+    Runs blocking calculations off the event loop.
+
+    Calculations are dispatched to a bounded thread pool: methods share city models that
+    are too large to be copied into worker processes, and heavy parts (numpy, scipy,
+    networkit, distance matrix pool) do not hold the GIL. Every endpoint has its own
+    concurrency limit, so requests above it wait in the endpoint queue without taking
+    pool threads from other endpoints.
+    """
+
+    def __init__(self, max_workers: int, default_limit: int, limits: dict = None):
+        self.max_workers = max_workers
+        self.default_limit = default_limit
+        self.limits = limits or {}
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="calculation")
+        self.semaphores = {}
+        self.metrics = defaultdict(lambda: {
+            "queued": 0, "running": 0, "completed": 0, "failed": 0,
+            "wait_time": 0., "run_time": 0.
+            })
+
+    async def run(self, endpoint: str, func, *args, **kwargs):
+        if endpoint not in self.semaphores:
+            self.semaphores[endpoint] = asyncio.Semaphore(self.limits.get(endpoint, self.default_limit))
+        metrics = self.metrics[endpoint]
+
+        queued_at = time.perf_counter()
+        metrics["queued"] += 1
+        try:
+            await self.semaphores[endpoint].acquire()
+        finally:
+            metrics["queued"] -= 1
+
+        started_at = time.perf_counter()
+        metrics["wait_time"] += started_at - queued_at
+        metrics["running"] += 1
+        loop = asyncio.get_running_loop()
+        try:
+            future = self.pool.submit(partial(func, *args, **kwargs))
+        except BaseException:
+            self._finish(endpoint, started_at, None)
+            raise
+        # the slot is released when the calculation ends, not when the request is cancelled,
+        # so calculations left by disconnected clients still count against the limit
+        future.add_done_callback(lambda f: loop.call_soon_threadsafe(self._finish, endpoint, started_at, f))
+        return await asyncio.wrap_future(future)
+
+    def _finish(self, endpoint: str, started_at: float, future) -> None:
+        metrics = self.metrics[endpoint]
+        if future is None or future.cancelled() or future.exception() is not None:
+            metrics["failed"] += 1
+        else:
+            metrics["completed"] += 1
+        metrics["running"] -= 1
+        metrics["run_time"] += time.perf_counter() - started_at
+        self.semaphores[endpoint].release()
+
+    def get_metrics(self) -> dict:
+        endpoints = {}
+        for endpoint, metrics in self.metrics.items():
+            finished = max(metrics["completed"] + metrics["failed"], 1)
+            endpoints[endpoint] = {
+                "limit": self.limits.get(endpoint, self.default_limit),
+                "queued": metrics["queued"],
+                "running": metrics["running"],
+                "completed": metrics["completed"],
+                "failed": metrics["failed"],
+                "mean_wait_time": round(metrics["wait_time"] / finished, 3),
+                "mean_run_time": round(metrics["run_time"] / finished, 3)
+                }
+        running = sum(x["running"] for x in self.metrics.values())
+        return {
+            "workers": self.max_workers,
+            "busy_workers": min(running, self.max_workers),
+            "pool_queue_depth": max(running - self.max_workers, 0),
+            "endpoints_queue_depth": sum(x["queued"] for x in self.metrics.values()),
+            "endpoints": endpoints
+            }
+
+
+executor = CalculationExecutor(
+    settings.CALCULATION_WORKERS, settings.CALCULATION_CONCURRENCY, settings.CALCULATION_LIMITS
+    )
@@ -0,0 +1,221 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import socket
+import time
+import uuid
+
+from app import enums
+from app.core.config import settings
+from app.execution import executor
+from calculations import geojson_serializer
+from calculations.progress import progress_callback
+
+# running jobs save their status every HEARTBEAT_INTERVAL seconds, jobs of other worker processes
+# which missed a few heartbeats or whose process has exited are reported as interrupted
+HEARTBEAT_INTERVAL = 10
+HEARTBEAT_TIMEOUT = 3 * HEARTBEAT_INTERVAL
+
+
+class Job:
+
+    def __init__(self, job_id: str, job_type: str, key: str):
+        self.job_id = job_id
+        self.job_type = job_type
+        self.key = key
+        self.status = enums.JobStatusEnum.queued
+        self.progress = 0.
+        self.message = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.error = None
+        self.pid = os.getpid()
+        self.host = socket.gethostname()
+        self.heartbeat = None
+
+    def set_progress(self, progress: float, message: str = None) -> None:
+        self.progress = round(progress, 4)
+        self.message = message
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id, "job_type": self.job_type, "status": self.status,
+            "progress": self.progress, "message": self.message, "created": self.created,
+            "started": self.started, "finished": self.finished, "error": self.error
+            }
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        job = cls(data["job_id"], data["job_type"], None)
+        job.pid = job.host = None
+        for attr, value in data.items():
+            setattr(job, attr, value)
+        return job
+
+    def is_alive(self) -> bool:
+        if self.status not in (enums.JobStatusEnum.queued, enums.JobStatusEnum.running):
+            return False
+        if self.heartbeat is None or time.time() - self.heartbeat > HEARTBEAT_TIMEOUT:
+            return False
+        if self.host == socket.gethostname():
+            try:
+                os.kill(self.pid, 0)
+            except ProcessLookupError:
+                return False
+            except PermissionError:
+                pass
+        return True
+
+
+class JobManager:
+    """
+    Runs long calculations in background through the calculation executor.
+
+    Submitting returns a job at once, identical jobs that are queued or running are
+    shared instead of being started again. Statuses and JSON encoded results are stored
+    in jobs_dir, so jobs are available to all worker processes sharing it and finished jobs
+    are available after restart of the app. Status files keep the owner process and its
+    heartbeat, jobs are interrupted only if their owner is gone. Finished jobs older than
+    max_age seconds or beyond max_number latest ones are deleted on submit.
+    """
+
+    def __init__(self, jobs_dir: str, max_age: float, max_number: int):
+        self.jobs_dir = jobs_dir
+        self.max_age = max_age
+        self.max_number = max_number
+        self.jobs = {}
+        self.in_flight = {}
+        self.tasks = set()
+        self.heartbeat_task = None
+
+    def submit(self, job_type: str, params: dict, func) -> Job:
+        key = hashlib.sha1(json.dumps([job_type, params], sort_keys=True, default=str).encode()).hexdigest()
+        if key in self.in_flight:
+            return self.jobs[self.in_flight[key]]
+
+        stored_jobs = self._read_jobs()
+        for _, stored_job in stored_jobs:
+            # the same job is running in another worker process
+            if stored_job.key == key and stored_job.is_alive():
+                return stored_job
+        self._cleanup(stored_jobs)
+        if self.heartbeat_task is None:
+            self.heartbeat_task = asyncio.get_running_loop().create_task(self._heartbeat())
+        job = Job(uuid.uuid4().hex, job_type, key)
+        self.jobs[job.job_id] = job
+        self.in_flight[key] = job.job_id
+        self._save(job)
+
+        task = asyncio.get_running_loop().create_task(self._run(job, func))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return job
+
+    def get(self, job_id: str):
+        if job_id in self.jobs:
+            return self.jobs[job_id]
+        if not re.fullmatch("[0-9a-f]{32}", job_id):
+            return None
+        job = self._read_job(self._status_path(job_id))
+        if job is None:
+            return None
+        if job.status in (enums.JobStatusEnum.queued, enums.JobStatusEnum.running) and not job.is_alive():
+            job.status = enums.JobStatusEnum.interrupted
+        return job
+
+    def result_path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    async def _run(self, job: Job, func) -> None:
+        try:
+            await executor.run(f"jobs/{job.job_type}", self._execute, job, func)
+            job.status = enums.JobStatusEnum.done
+            job.set_progress(1.)
+        except Exception as e:
+            job.status = enums.JobStatusEnum.failed
+            job.error = f"{type(e).__name__}: {e}"
+        finally:
+            job.finished = time.time()
+            del self.in_flight[job.key]
+            self._save(job)
+
+    def _execute(self, job: Job, func) -> None:
+        job.status = enums.JobStatusEnum.running
+        job.started = time.time()
+        self._save(job)
+        with progress_callback(job.set_progress):
+            result = func()
+
+        path = self.result_path(job.job_id)
+        with open(path + ".tmp", "wb") as f:
+            for chunk in geojson_serializer.iter_json(result):
+                f.write(chunk)
+        os.replace(path + ".tmp", path)
+
+    async def _heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            for job_id in list(self.in_flight.values()):
+                self._save(self.jobs[job_id])
+
+    def _read_jobs(self) -> list:
+        # status files of finished jobs are saved last, so their mtime is the finish time
+        stored_jobs = []
+        try:
+            entries = list(os.scandir(self.jobs_dir))
+        except FileNotFoundError:
+            return stored_jobs
+        for entry in entries:
+            if not entry.name.endswith(".status.json"):
+                continue
+            try:
+                saved = entry.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            job = self._read_job(entry.path)
+            if job is not None:
+                stored_jobs.append((saved, job))
+        return stored_jobs
+
+    @staticmethod
+    def _read_job(path: str):
+        try:
+            with open(path) as f:
+                return Job.from_dict(json.load(f))
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _cleanup(self, stored_jobs: list) -> None:
+        in_flight = set(self.in_flight.values())
+        finished = sorted(
+            ((saved, job.job_id) for saved, job in stored_jobs if job.job_id not in in_flight and not job.is_alive()),
+            reverse=True
+            )
+        expired = time.time() - self.max_age
+        for i, (finished_time, job_id) in enumerate(finished):
+            if i < self.max_number and finished_time >= expired:
+                continue
+            self.jobs.pop(job_id, None)
+            for path in (self.result_path(job_id), self._status_path(job_id)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def _status_path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.status.json")
+
+    def _save(self, job: Job) -> None:
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        path = self._status_path(job.job_id)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        job.heartbeat = time.time()
+        with open(tmp_path, "w") as f:
+            json.dump(dict(job.to_dict(), key=job.key, pid=job.pid, host=job.host, heartbeat=job.heartbeat), f)
+        os.replace(tmp_path, path)
+
+
+jobs = JobManager(settings.JOBS_DIR, settings.JOBS_MAX_AGE, settings.JOBS_MAX_NUMBER)
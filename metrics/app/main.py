@@ -1,8 +1,10 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 
 from app.routers import router
 from app.core.config import settings
+from data.city_models import CityNotReadyError
 
 
 app = FastAPI(debug=settings.FASTAPI_DEBUG)
@@ -16,3 +18,11 @@ app.add_middleware(
 )
 
 app.include_router(router, prefix="/api/v2")
+
+
+@app.exception_handler(CityNotReadyError)
+async def city_not_ready_handler(request: Request, exc: CityNotReadyError):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": exc.message}, headers={"Retry-After": "60"}
+        )
@@ -1,16 +1,20 @@
 import faulthandler
 from fastapi import APIRouter, HTTPException, status, Body, Depends
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, FileResponse
 from geojson_pydantic import FeatureCollection
 
 from enum import auto
 from app import enums, schemas
+from app.execution import executor
+from app.jobs import jobs
 from data.city_models import city_models, city_names, cities
+from data.city_snapshot import get_snapshot_path, remove_city_snapshot
 from typing import Optional
 
 from data_update import InterfaceCityInformationModel as data_update 
 
-from calculations import utils, errors
+from calculations import utils, errors, geojson_serializer
+from calculations.coverage_zones_store import coverage_zones_store, DEPENDENT_LAYERS
 from calculations import (
     traffics_calculation, 
     mobility_analysis,
@@ -31,6 +35,8 @@ from calculations import (
 )
 router = APIRouter()
 faulthandler.enable()
+city_models.add_ready_callback(coverage_zones_store.start_precompute)
+city_models.add_ready_callback(blocks_accessibility.start_precompute)
 
 class Tags(str, enums.AutoName):
     def _generate_next_value_(name, start, count, last_values):
@@ -54,6 +60,8 @@ class Tags(str, enums.AutoName):
     city_values = auto()
     data_update = auto()
     blocks_accessibility = auto()
+    execution = auto()
+    jobs = auto()
 
 
 @router.get("/")
@@ -64,14 +72,26 @@ async def read_root():
 async def get_cities_names():
     return city_names
 
+@router.get("/cities/loading")
+async def get_cities_loading():
+    return city_models.get_report()
+
+@router.get("/execution/metrics", tags=[Tags.execution])
+async def get_execution_metrics():
+    return executor.get_metrics()
+
 @router.post(
     '/pedastrian_walk_traffics/pedastrian_walk_traffics_calculation',
     response_model=schemas.PedastrianWalkTrafficsCalculationOut, tags=[Tags.traffics_calculation]
 )
-def pedastrian_walk_traffics_calculation(query_params: schemas.PedastrianWalkTrafficsCalculationIn):
+async def pedastrian_walk_traffics_calculation(query_params: schemas.PedastrianWalkTrafficsCalculationIn):
     city_model = city_models[query_params.city]
     try:
-        result = traffics_calculation.TrafficCalculator(city_model).get_trafic_calculation(query_params.geojson.dict())
+        result = await executor.run(
+            "pedastrian_walk_traffics_calculation",
+            lambda: traffics_calculation.TrafficCalculator(city_model).get_trafic_calculation(
+                query_params.geojson.dict(), edge_flows=query_params.edge_flows)
+            )
         return result
     except errors.TerritorialSelectError:
         raise HTTPException(
@@ -89,8 +109,32 @@ async def get_visibility_analysis(query_params: schemas.VisibilityAnalisysQueryP
     request_points = [[query_params.x_from, query_params.y_from]]
     to_crs = city_models[query_params.city].city_crs
     request_point = utils.request_points_project(request_points, 4326, to_crs)[0]
-    return visibility_analysis.VisibilityAnalysis(city_model).get_visibility_result(
-        request_point, query_params.view_distance)
+    return await executor.run(
+        "get_visibility_analysis",
+        lambda: visibility_analysis.VisibilityAnalysis(city_model).get_visibility_result(
+            request_point, query_params.view_distance, query_params.angle_step)
+        )
+
+
+@router.post(
+    "/visibility_analysis/visibility_analysis_batch",
+    response_model=FeatureCollection, tags=[Tags.visibility_analysis]
+)
+async def get_visibility_analysis_batch(query_params: schemas.VisibilityAnalysisBatchIn):
+    city_model = city_models[query_params.city]
+    request_points = utils.request_points_project(query_params.points, 4326, city_model.city_crs)
+    try:
+        return await executor.run(
+            "get_visibility_analysis_batch",
+            lambda: visibility_analysis.VisibilityAnalysis(city_model).get_visibility_batch_result(
+                request_points, query_params.view_distance, query_params.angle_step, 
+                query_params.output.value, query_params.cell_size)
+            )
+    except errors.ImplementationError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=str(e)
+        )
 
 
 @router.post(
@@ -99,7 +143,10 @@ async def get_visibility_analysis(query_params: schemas.VisibilityAnalisysQueryP
 )
 async def wighted_voronoi_calculation(query_params: schemas.WeightedVoronoiCalculationIn):
     city_model = city_models[query_params.city]
-    return weighted_voronoi.WeightedVoronoi(city_model).get_weighted_voronoi_result(query_params.geojson.dict())
+    return await executor.run(
+        "wighted_voronoi_calculation",
+        lambda: weighted_voronoi.WeightedVoronoi(city_model).get_weighted_voronoi_result(query_params.geojson.dict())
+        )
 
 
 @router.post(
@@ -109,9 +156,12 @@ async def wighted_voronoi_calculation(query_params: schemas.WeightedVoronoiCalcu
 async def get_blocks_clusterization(query_params: schemas.BlocksClusterizationGetBlocks):
     city_model = city_models[query_params.city]
     geojson = query_params.geojson.dict() if query_params.geojson else None
-    return blocks_clusterization.BlocksClusterization(city_model).get_blocks(
-        query_params.service_types, query_params.clusters_number, 
-        query_params.area_type, query_params.area_id, geojson
+    return await executor.run(
+        "get_blocks_clusterization",
+        lambda: blocks_clusterization.BlocksClusterization(city_model).get_blocks(
+            query_params.service_types, query_params.clusters_number, 
+            query_params.area_type, query_params.area_id, geojson
+            )
         )
 
 
@@ -126,7 +176,10 @@ async def get_blocks_clusterization(query_params: schemas.BlocksClusterizationGe
 )
 async def get_blocks_clusterization_dendrogram(query_params: schemas.BlocksClusterizationGetBlocks):
     city_model = city_models[query_params.city]
-    result = blocks_clusterization.BlocksClusterization(city_model).get_dendrogram(query_params.service_types)
+    result = await executor.run(
+        "get_blocks_clusterization_dendrogram",
+        lambda: blocks_clusterization.BlocksClusterization(city_model).get_dendrogram(query_params.service_types)
+        )
     return StreamingResponse(content=result, media_type="image/png")
 
 
@@ -138,9 +191,12 @@ async def get_services_clusterization(query_params: schemas.ServicesClusterizati
     geojson = query_params.geojson.dict() if query_params.geojson else None
 
     try:
-        result = services_clusterization.ServicesClusterization(city_model).get_clusters_polygon(
-            query_params.service_types, query_params.area_type, query_params.area_id, geojson,
-            query_params.condition, query_params.condition_value, query_params.n_std
+        result = await executor.run(
+            "get_services_clusterization",
+            lambda: services_clusterization.ServicesClusterization(city_model).get_clusters_polygon(
+                query_params.service_types, query_params.area_type, query_params.area_id, geojson,
+                query_params.condition, query_params.condition_value, query_params.n_std
+                )
             )
         return result
     except errors.TerritorialSelectError as e:
@@ -158,8 +214,11 @@ async def get_spacematrix_indices(query_params: schemas.SpacematrixIn):
     city_model = city_models[query_params.city]
     geojson = query_params.geojson.dict() if query_params.geojson else None
     try:
-        return spacematrix.Spacematrix(city_model).get_morphotypes(
-            query_params.clusters_number, query_params.area_type, query_params.area_id, geojson
+        return await executor.run(
+            "get_spacematrix_indices",
+            lambda: spacematrix.Spacematrix(city_model).get_morphotypes(
+                query_params.clusters_number, query_params.area_type, query_params.area_id, geojson
+                )
             )
     except errors.SelectedValueError as e:
         raise HTTPException(
@@ -178,9 +237,12 @@ async def mobility_analysis_isochrones(query_params: schemas.MobilityAnalysisIso
     to_crs = city_models[query_params.city].city_crs
     x_from, y_from = utils.request_points_project(request_points, 4326, to_crs)[0]
     try:
-        result = mobility_analysis.AccessibilityIsochrones(city_model).get_accessibility_isochrone(
-            travel_type=query_params.travel_type, x_from=x_from, y_from=y_from,
-            weight_type=query_params.weight_type, weight_value=query_params.weight_value, routes=query_params.routes
+        result = await executor.run(
+            "mobility_analysis_isochrones",
+            lambda: mobility_analysis.AccessibilityIsochrones(city_model).get_accessibility_isochrone(
+                travel_type=query_params.travel_type, x_from=x_from, y_from=y_from,
+                weight_type=query_params.weight_type, weight_value=query_params.weight_value, routes=query_params.routes
+            )
         )
 
         return result
@@ -197,7 +259,9 @@ async def get_diversity(query_params: schemas.DiversityIn):  # todo validate ser
     city_model = city_models[query_params.city]
     geojson = query_params.geojson.dict() if query_params.geojson else None
     try:
-        result = diversity.Diversity(city_model).get_diversity(query_params.service_type, geojson)
+        result = await executor.run(
+            "get_diversity", lambda: diversity.Diversity(city_model).get_diversity(query_params.service_type, geojson)
+            )
         return result
     except (errors.TerritorialSelectError, errors.SelectedValueError) as e:
         raise HTTPException(
@@ -210,7 +274,10 @@ async def get_diversity(query_params: schemas.DiversityIn):  # todo validate ser
 async def get_buildings_diversity(query_params: schemas.DiversityGetBuildingsQueryParams = Depends()):
     city_model = city_models[query_params.city]
     try:
-        result = diversity.Diversity(city_model).get_houses(query_params.block_id, query_params.service_type)
+        result = await executor.run(
+            "get_buildings_diversity",
+            lambda: diversity.Diversity(city_model).get_houses(query_params.block_id, query_params.service_type)
+            )
         return result
     except (errors.TerritorialSelectError, errors.SelectedValueError) as e:
         raise HTTPException(
@@ -224,7 +291,10 @@ async def get_buildings_diversity(query_params: schemas.DiversityGetBuildingsQue
 async def get_diversity_info(query_params: schemas.DiversityGetInfoQueryParams = Depends()):
     city_model = city_models[query_params.city]
     try:
-        result = diversity.Diversity(city_model).get_info(query_params.house_id, query_params.service_type)
+        result = await executor.run(
+            "get_diversity_info",
+            lambda: diversity.Diversity(city_model).get_info(query_params.house_id, query_params.service_type)
+            )
         return result
     except (errors.TerritorialSelectError, errors.SelectedValueError) as e:
 
@@ -240,16 +310,17 @@ async def get_provision(
         user_request: schemas.ProvisionGetProvisionIn,
 ):
     city_model = city_models[user_request.city]
-    result = city_provision.CityProvision(
+    result = await executor.run("get_provision", lambda: city_provision.CityProvision(
         city_model, user_request.service_types,
         user_request.valuation_type, user_request.year,
         user_changes_buildings=None, user_changes_services=None,
         user_provisions=None, user_selection_zone=user_request.user_selection_zone,
         service_impotancy=user_request.service_impotancy,
         return_jsons=True,
-        calculation_type = user_request.calculation_type
-    ).get_provisions()
-    return result
+        calculation_type = user_request.calculation_type,
+        shown_links_only = user_request.shown_links_only
+    ).get_provisions())
+    return StreamingResponse(geojson_serializer.iter_json(result), media_type="application/json")
 
 
 @router.post("/provision/recalculate_provisions", response_model=schemas.ProvisionOutBase,
@@ -258,7 +329,7 @@ async def recalculate_provisions(
         user_request: schemas.ProvisionRecalculateProvisionsIn,
 ):
     city_model = city_models[user_request.city]
-    result = city_provision.CityProvision(
+    result = await executor.run("recalculate_provisions", lambda: city_provision.CityProvision(
         city_model, user_request.service_types,
         user_request.valuation_type, 
         user_request.year,
@@ -267,40 +338,43 @@ async def recalculate_provisions(
         user_provisions=user_request.user_provisions, 
         user_selection_zone=user_request.user_selection_zone,
         return_jsons=True,
-        service_impotancy=user_request.service_impotancy
-    ).recalculate_provisions()
-    return result
+        service_impotancy=user_request.service_impotancy,
+        calculation_type=user_request.calculation_type,
+        shown_links_only=user_request.shown_links_only,
+        incremental=user_request.incremental
+    ).recalculate_provisions())
+    return StreamingResponse(geojson_serializer.iter_json(result), media_type="application/json")
 
 
 @router.post(
     "/city_context/get_context",
     response_model=schemas.CityContextGetContextOut, tags=[Tags.city_provision_context],
 )
-def city_context_get_context(
+async def city_context_get_context(
         user_request: schemas.CityContextGetContextIn
 ):
     city_model = city_models[user_request.city]
-    return city_provision_context.CityProvisionContext(
+    return await executor.run("city_context_get_context", lambda: city_provision_context.CityProvisionContext(
         city_model, service_types=user_request.service_types,
         valuation_type=user_request.valuation_type,
         year=user_request.year,
         user_context_zone=user_request.user_selection_zone
-    ).get_context()
+    ).get_context())
 
 
 @router.post(
     "/city_values/get_values",
     response_model = schemas.CityValuestGetValuesOut, tags=[Tags.city_values],
 )
-def city_values_get_values(
+async def city_values_get_values(
         user_request: schemas.CityValuestGetValuesIn
 ):
     city_model = city_models[user_request.city]
-    return city_values.CityValues(
+    return await executor.run("city_values_get_values", lambda: city_values.CityValues(
         city_model,
         valuation_type=user_request.valuation_type,
         year=user_request.year
-    ).get_city_values()
+    ).get_city_values())
 
 
 @router.get(
@@ -309,49 +383,60 @@ def city_values_get_values(
 )
 async def get_collocation_matrix(query_params: schemas.CollocationMatrixQueryParams = Depends()):
     city_model = city_models[query_params.city]
-    return collocation_matrix.CollocationMatrix(city_model).get_collocation_matrix()
+    return await executor.run(
+        "get_collocation_matrix", lambda: collocation_matrix.CollocationMatrix(city_model).get_collocation_matrix()
+        )
 
 
 @router.get(
     "/urban_quality/get_urban_quality",
     response_model = FeatureCollection, tags=[Tags.urban_quality],
 )
-def urban_quality_get_urban_quality(city: enums.CitiesEnum):
+async def urban_quality_get_urban_quality(city: enums.CitiesEnum):
     city_model = city_models[city]
-    return urban_quality.UrbanQuality(city_model).get_urban_quality()
+    return await executor.run(
+        "urban_quality_get_urban_quality", lambda: urban_quality.UrbanQuality(city_model).get_urban_quality()
+        )
 
 @router.get(
     "/urban_quality/get_urban_quality_context",
     response_model = dict, tags=[Tags.urban_quality],
 )
-def urban_quality_get_urban_quality_context(city: enums.CitiesEnum):
+async def urban_quality_get_urban_quality_context(city: enums.CitiesEnum):
     city_model = city_models[city]
-    return urban_quality.UrbanQuality(city_model).get_urban_quality_context()
+    return await executor.run(
+        "urban_quality_get_urban_quality_context",
+        lambda: urban_quality.UrbanQuality(city_model).get_urban_quality_context()
+        )
 
 # Check during refactor
 @router.post(
     "/master_plan/get_master_plan",
     response_model=schemas.MasterPlanOut, tags=[Tags.master_plan],
 )
-def master_plan_get_master_plan(
+async def master_plan_get_master_plan(
         user_request: schemas.MasterPlanIn
 ):
     city_model = city_models[user_request.city]
     master_plan_params = user_request.dict(exclude={"city"})
-    master_plan = masterplan.Masterplan(city_model)
-    return master_plan.get_masterplan(**master_plan_params)
+    return await executor.run(
+        "master_plan_get_master_plan", lambda: masterplan.Masterplan(city_model).get_masterplan(**master_plan_params)
+        )
 
 # Check during refactor
 @router.get(
     "/coverage_zone/get_radius_zone",
     response_model=FeatureCollection, tags=[Tags.coverage_zone],
 )
-def coverage_zone_get_radius(
+async def coverage_zone_get_radius(
         user_request: schemas.CoverageZonesRadiusQueryParams=Depends()
 ):
     try:
         city_model = city_models[user_request.city]
-        return coverage_zones.CoverageZones(city_model).get_radius_zone(user_request.service_type, user_request.radius)
+        return await executor.run(
+            "coverage_zone_get_radius",
+            lambda: coverage_zones.CoverageZones(city_model).get_radius_zone(user_request.service_type, user_request.radius)
+            )
     except errors.NormativeError as e:
         raise HTTPException(
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
@@ -363,12 +448,15 @@ def coverage_zone_get_radius(
     "/coverage_zone/get_isochrone_zone",
     response_model=FeatureCollection, tags=[Tags.coverage_zone],
 )
-def coverage_zone_get_isochrone(
+async def coverage_zone_get_isochrone(
         user_request: schemas.CoverageZonesIsochroneQueryParams=Depends()
 ):
     city_model = city_models[user_request.city]
-    return coverage_zones.CoverageZones(city_model).get_isochrone_zone(
-        user_request.service_type, user_request.travel_type, user_request.weight_value
+    return await executor.run(
+        "coverage_zone_get_isochrone",
+        lambda: coverage_zones.CoverageZones(city_model).get_isochrone_zone(
+            user_request.service_type, user_request.travel_type, user_request.weight_value
+            )
         )
 
 @router.post("/data_update", 
@@ -376,28 +464,95 @@ def coverage_zone_get_isochrone(
 def updeate_data(user_request: schemas.DataUpdateIn):
 
     city = [city for city in cities if city['code'] == user_request.city_name][0]
+    city_model = city_models[user_request.city_name]
 
-    setattr(city_models[user_request.city_name], 
+    setattr(city_model, 
             user_request.attr_name,
             next(data_update.DataQueryInterface(city_name = city['code'], 
                                                 city_crs = city['local_crs'], 
                                                 city_db_id = city['id']).attr_names[user_request.attr_name]))
+    if user_request.attr_name == "MobilityGraph":
+        city_model.get_supplementary_graphs()
+    if user_request.attr_name in DEPENDENT_LAYERS:
+        coverage_zones_store.invalidate(city_model)
+    if user_request.attr_name in ("Blocks", "MobilityGraph"):
+        blocks_accessibility.start_precompute(city_model)
+    # the snapshot holds the previous data, workers and restarts load the city from the RPYC server again
+    remove_city_snapshot(get_snapshot_path(user_request.city_name))
     return f"{user_request.city_name} - {user_request.attr_name}, updated"
 
 @router.post("/data_update_check", 
              tags = [Tags.data_update])
 def updeate_data_check(user_request: schemas.DataUpdateIn):
 
-    return eval(getattr(city_models[user_request.city_name],
-                        user_request.attr_name).to_json().replace('true', 'True').replace('null', 'None').replace('false', 'False'))
+    layer = getattr(city_models[user_request.city_name], user_request.attr_name)
+    return StreamingResponse(geojson_serializer.iter_json(layer), media_type="application/json")
 
 # Check during refactor
 @router.get(
     "/blocks_accessibility/get_accessibility",
     response_model=FeatureCollection, tags=[Tags.blocks_accessibility],
 )
-def blocks_accessibility_get_blocks_accessibility(
+async def blocks_accessibility_get_blocks_accessibility(
         user_request: schemas.BlocksAccessibilityIn=Depends()
 ):
     city_model = city_models[user_request.city]
-    return blocks_accessibility.Blocks_accessibility(city_model).get_accessibility(user_request.block_id)
\ No newline at end of file
+    return await executor.run(
+        "blocks_accessibility_get_blocks_accessibility",
+        lambda: blocks_accessibility.Blocks_accessibility(city_model).get_accessibility(user_request.block_id)
+        )
+
+
+@router.post("/jobs/provision/get_provision", response_model=schemas.JobOut, tags=[Tags.jobs])
+async def submit_provision_job(user_request: schemas.ProvisionGetProvisionIn):
+    city_model = city_models[user_request.city]
+    job = jobs.submit("provision", user_request.dict(), lambda: city_provision.CityProvision(
+        city_model, user_request.service_types,
+        user_request.valuation_type, user_request.year,
+        user_changes_buildings=None, user_changes_services=None,
+        user_provisions=None, user_selection_zone=user_request.user_selection_zone,
+        service_impotancy=user_request.service_impotancy,
+        return_jsons=True,
+        calculation_type = user_request.calculation_type,
+        shown_links_only = user_request.shown_links_only
+    ).get_provisions())
+    return job.to_dict()
+
+
+@router.post("/jobs/city_values/get_values", response_model=schemas.JobOut, tags=[Tags.jobs])
+async def submit_city_values_job(user_request: schemas.CityValuestGetValuesIn):
+    city_model = city_models[user_request.city]
+    job = jobs.submit("city_values", user_request.dict(), lambda: city_values.CityValues(
+        city_model,
+        valuation_type=user_request.valuation_type,
+        year=user_request.year
+    ).get_city_values())
+    return job.to_dict()
+
+
+@router.post("/jobs/urban_quality/get_urban_quality", response_model=schemas.JobOut, tags=[Tags.jobs])
+async def submit_urban_quality_job(city: enums.CitiesEnum):
+    city_model = city_models[city]
+    job = jobs.submit("urban_quality", {"city": city}, lambda: urban_quality.UrbanQuality(city_model).get_urban_quality())
+    return job.to_dict()
+
+
+@router.get("/jobs/{job_id}", response_model=schemas.JobOut, tags=[Tags.jobs])
+async def get_job_status(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return job.to_dict()
+
+
+@router.get("/jobs/{job_id}/result", tags=[Tags.jobs])
+async def get_job_result(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    if job.status != enums.JobStatusEnum.done:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Job is {enums.JobStatusEnum(job.status).value}" + (f": {job.error}" if job.error else "")
+        )
+    return FileResponse(jobs.result_path(job_id), media_type="application/json")
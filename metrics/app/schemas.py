@@ -33,6 +33,7 @@ class FeatureCollectionWithCRS(FeatureCollection):
 class PedastrianWalkTrafficsCalculationIn(BaseModel):
     city: enums.CitiesEnum
     geojson: FeatureCollectionWithCRS
+    edge_flows: bool = False
 
     class Config:
         schema_extra = {
@@ -58,7 +59,8 @@ class PedastrianWalkTrafficsCalculationIn(BaseModel):
 class PedastrianWalkTrafficsCalculationOut(BaseModel):
     buildings: FeatureCollection
     stops: FeatureCollection
-    routes: FeatureCollection
+    routes: Optional[FeatureCollection]
+    edges: Optional[FeatureCollection]
 
 
 # /mobility_analysis/isochrones
@@ -121,11 +123,34 @@ class VisibilityAnalisysQueryParams:
                  x_from: float = Query(..., example=59.944548),
                  y_from: float = Query(..., example=30.304617),
                  view_distance: int = Query(..., example=700),
+                 angle_step: confloat(gt=0, le=90) = Query(360 / 64, description="Angle between rays in degrees"),
                  ):
         self.x_from = x_from
         self.y_from = y_from
         self.city = city
         self.view_distance = view_distance
+        self.angle_step = angle_step
+
+
+# /visibility_analysis/visibility_analysis_batch
+class VisibilityAnalysisBatchIn(BaseModel):
+    city: enums.CitiesEnum
+    points: conlist(conlist(float, min_items=2, max_items=2), min_items=1, max_items=1000)  # latitude, longitude
+    view_distance: conint(ge=1)
+    angle_step: confloat(gt=0, le=90) = 360 / 64
+    output: enums.VisibilityAnalysisBatchOutputEnum = enums.VisibilityAnalysisBatchOutputEnum.zones
+    cell_size: confloat(ge=1) = 10
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "city": "saint-petersburg",
+                "points": [[59.944548, 30.304617], [59.945310, 30.307281]],
+                "view_distance": 700,
+                "output": "count",
+                "cell_size": 10
+            }
+        }
 
 
 # /voronoi/Weighted_voronoi_calculation
@@ -331,6 +356,8 @@ class ProvisionInBase(BaseModel):
 
 
 class ProvisionGetProvisionIn(ProvisionInBase):
+    shown_links_only: bool = False
+
     class Config:
         schema_extra = {
             "example": {
@@ -346,6 +373,8 @@ class ProvisionRecalculateProvisionsIn(ProvisionInBase):
     user_provisions: dict
     user_changes_buildings: Optional[dict] = None
     user_changes_services: Optional[dict] = None
+    shown_links_only: bool = False
+    incremental: bool = False
 
 
 class ProvisionOutBase(BaseModel):
@@ -571,3 +600,16 @@ class BlocksAccessibilityIn:
      def __init__(self, city: enums.CitiesEnum, block_id: int):
          self.city = city
          self.block_id = block_id
+
+
+# /jobs
+class JobOut(BaseModel):
+    job_id: str
+    job_type: str
+    status: enums.JobStatusEnum
+    progress: float
+    message: Optional[str] = None
+    created: float
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    error: Optional[str] = None
@@ -1,10 +1,35 @@
-import networkx as nx
-import pandas as pd
-import geopandas as gpd
+import os
+import threading
+import traceback
 import networkit as nk
+import numpy as np
 import json
+
+from concurrent.futures import ThreadPoolExecutor
 from .base_method import BaseMethod
-import requests
+from .distance_matrix import get_distance_matrix
+from .provision_cache import provision_cache
+
+# median accessibility of all blocks is calculated in background when a city is loaded or its
+# blocks or graph are updated, so requests take it from the cache
+PRECOMPUTE = os.environ.get("BLOCKS_ACCESSIBILITY_PRECOMPUTE", "1") == "1"
+_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="blocks_accessibility")
+_building = {}
+_building_lock = threading.Lock()
+
+
+def start_precompute(city_model) -> None:
+    if PRECOMPUTE:
+        _pool.submit(precompute, city_model)
+
+
+def precompute(city_model) -> None:
+    try:
+        Blocks_accessibility(city_model).get_median_accessibility()
+    except Exception:
+        print(f"{city_model.city_name} blocks accessibility is not precomputed")
+        traceback.print_exc()
+
 
 class Blocks_accessibility(BaseMethod):
 
@@ -13,9 +38,10 @@ class Blocks_accessibility(BaseMethod):
         super().validation("blocks_accessibility")
         self.blocks = city_model.Blocks.copy()
         self.graph_nk_time =  self.city_model.graph_nk_time
-        self.mobility_graph = self.city_model.MobilityGraph.copy()
+        self.graph_csr_time = self.city_model.graph_csr_time
+        self.graph_version = self.city_model.graph_version
+        self.snap_index = self.city_model.mode_graphs["public_transport"].snap_index
         self.city_name = city_model.city_name
-        self.file_server = "http://10.32.1.60:8090/"
     
     def get_accessibility(self, target_block: int = None) -> json:
 
@@ -32,23 +58,13 @@ class Blocks_accessibility(BaseMethod):
         """
 
         if not target_block:
-            self.blocks = requests.get(f'{self.file_server}blocks_accessibility/median_accs_{self.city_name}.geojson').json()
-
-            return self.blocks
+            self.blocks = self.get_median_accessibility()
+            return json.loads(self.blocks.to_json())
 
         else:
-            edges_to_remove = list(((u, v) for u,v,e in self.mobility_graph.edges(data=True) if e['type'] == 'car'))
-            self.mobility_graph.remove_edges_from(edges_to_remove)
-
-            self.mobility_graph = nx.convert_node_labels_to_integers(self.mobility_graph)
-            graph_df = pd.DataFrame.from_dict(dict(self.mobility_graph.nodes(data=True)), orient='index')
-            graph_gdf = gpd.GeoDataFrame(graph_df, geometry =gpd.points_from_xy(graph_df['x'], graph_df['y']),
-                                        crs = self.city_crs)
-
-            self.blocks['nearest_node'] = graph_gdf['geometry'].sindex.nearest(self.blocks['geometry'], return_distance = False, 
-                                                            return_all = False)[1]
+            self.blocks['nearest_node'] = self.snap_index.nearest(self.blocks['geometry'])[1]
             
-            target_node = self.blocks[self.blocks['id'] == target_block]['nearest_node']
+            target_node = int(self.blocks[self.blocks['id'] == target_block]['nearest_node'].iloc[0])
 
             nk_dists = nk.distance.SPSP(G = self.graph_nk_time, sources = [target_node]).run()
 
@@ -57,4 +73,47 @@ class Blocks_accessibility(BaseMethod):
             
             self.blocks.rename(columns={'nearest_node': 'median_time'}, inplace=True)
 
-            return json.loads(self.blocks.to_json())
\ No newline at end of file
+            return json.loads(self.blocks.to_json())
+
+    def get_median_accessibility(self):
+
+        """
+        Returns blocks with median travel time from the cache or calculates them once,
+        concurrent calls for the same data wait for the first one.
+        """
+
+        cache_key = provision_cache.make_key(self.city_name, "blocks_accessibility", self.graph_version, 
+                                             provision_cache.hash_data(self.blocks[["id", "geometry"]]))
+        with _building_lock:
+            key_lock = _building.setdefault(cache_key, threading.Lock())
+        try:
+            with key_lock:
+                cached = provision_cache.get(cache_key)
+                if cached is not None:
+                    return cached["blocks"]
+                blocks = self._get_median_accessibility(self.blocks)
+                try:
+                    provision_cache.put(cache_key, tables={"blocks": blocks})
+                except Exception as e:
+                    print("blocks accessibility not cached: " + str(e))
+                return blocks
+        finally:
+            with _building_lock:
+                _building.pop(cache_key, None)
+
+    def _get_median_accessibility(self, blocks, chunk_size=1024):
+
+        """
+        Calculates median travel time from every block to other city blocks by intermodal graph.
+        """
+
+        blocks = blocks.copy()
+        _, nodes = self.snap_index.nearest(blocks['geometry'])
+        median_time = []
+        for start in range(0, len(nodes), chunk_size):
+            distances = get_distance_matrix(self.graph_csr_time, nodes[start:start + chunk_size], nodes)
+            distances[np.isinf(distances)] = np.nan
+            median_time.append(np.nanmedian(distances, axis=1))
+
+        blocks['median_time'] = np.concatenate(median_time).round(0) if median_time else []
+        return blocks
@@ -1,19 +1,23 @@
-import requests
 import os
 import geopandas as gpd
 import shapely
 import pandas as pd
 import numpy as np
 import shapely.wkt
-import io
-import networkit as nk
-import pulp
 
+from scipy import sparse
 from typing import Any, Optional
 from .base_method import BaseMethod
+from .provision_engine import gravity_provision, linear_provision
+from .distance_matrix import get_distance_matrix, get_sparse_distance_matrix
+from .provision_cache import provision_cache
+from . import progress
 
 class CityProvision(BaseMethod): 
 
+    # calculation types that work on sparse distance matrices bounded by distance_cutoff_factor * normative
+    sparse_calculation_types = ['gravity_vectorized', 'linear_vectorized']
+
     def __init__(self, city_model: Any, service_types: list, valuation_type: str, year: int,
                  user_provisions: Optional[dict[str, dict]] = None, 
                  user_changes_buildings: Optional[dict] = None,
@@ -21,7 +25,11 @@ class CityProvision(BaseMethod):
                  user_selection_zone: Optional[dict] = None,
                  service_impotancy: Optional[list] = None,
                  return_jsons: bool = False,
-                 calculation_type:str = 'gravity'
+                 calculation_type:str = 'gravity',
+                 distance_cutoff_factor: Optional[float] = 4,
+                 shown_links_only: bool = False,
+                 incremental: bool = False,
+                 buildings_by_service_type: bool = False
                  ):
         '''
         >>> 
@@ -40,18 +48,25 @@ class CityProvision(BaseMethod):
         self.return_jsons = return_jsons
         self.graph_nk_length = city_model.graph_nk_length
         self.graph_nk_time =  city_model.graph_nk_time
-        self.nx_graph =  city_model.MobilityGraph
+        self.graph_csr_length = city_model.graph_csr_length
+        self.graph_csr_time = city_model.graph_csr_time
+        self.snap_index = city_model.mode_graphs["public_transport"].snap_index
         self.buildings = city_model.Buildings.copy(deep = True)
         self.buildings = self.buildings.dropna(subset = 'functional_object_id')
         self.buildings['functional_object_id'] = self.buildings['functional_object_id'].astype(int)
         self.buildings.index = self.buildings['functional_object_id'].values
         self.calculation_type = calculation_type
+        self.distance_cutoff_factor = distance_cutoff_factor
+        self.shown_links_only = shown_links_only
+        self.incremental = incremental
+        # buildings without demand of a service type are dropped from this service type only,
+        # otherwise buildings without demand of any service type are dropped from all of them
+        self.buildings_by_service_type = buildings_by_service_type
         
         self.services = city_model.Services[city_model.Services['service_code'].isin(service_types)].copy(deep = True)
         self.services.index = self.services['id'].values.astype(int)
 
-        self.file_server = "http://10.32.1.60:8090/"
-        #self.file_server = os.environ['PROVISIONS_DATA_FILE_SERVER']
+        self.graph_version = city_model.graph_version
 
         try:
             self.services_impotancy = dict(zip(service_types, service_impotancy))
@@ -75,7 +90,11 @@ class CityProvision(BaseMethod):
             #self.errors.append(service_type)
         for service_type in service_types:
             self.buildings[f'{service_type}_service_demand_left_value_{self.valuation_type}'] = self.buildings[f'{service_type}_service_demand_value_{self.valuation_type}']
-            self.buildings = self.buildings.dropna(subset = f'{service_type}_service_demand_value_{self.valuation_type}')
+            if not self.buildings_by_service_type:
+                self.buildings = self.buildings.dropna(subset = f'{service_type}_service_demand_value_{self.valuation_type}')
+        if self.buildings_by_service_type:
+            self.buildings = self.buildings.dropna(subset = [f'{service_type}_service_demand_value_{self.valuation_type}' 
+                                                             for service_type in service_types], how = 'all')
             
         self.service_types= [x for x in service_types if x not in self.errors]
         self.buildings.index = self.buildings['functional_object_id'].values.astype(int)
@@ -85,13 +104,15 @@ class CityProvision(BaseMethod):
                                          'normative_distance':None,
                                          'buildings':None,
                                          'services': None,
-                                         'selected_graph':None} for service_type in service_types}
+                                         'selected_graph':None,
+                                         'selected_csr_graph':None} for service_type in service_types}
         self.new_Provisions = {service_type:{'destination_matrix': None, 
                                             'distance_matrix': None,
                                             'normative_distance':None,
                                             'buildings':None,
                                             'services': None,
-                                            'selected_graph':None} for service_type in service_types}
+                                            'selected_graph':None,
+                                            'selected_csr_graph':None} for service_type in service_types}
         #Bad interface , raise error must be 
         if user_changes_services:
             self.user_changes_services = gpd.GeoDataFrame.from_features(user_changes_services['features']).set_crs(4326).to_crs(self.city_crs)
@@ -138,34 +159,9 @@ class CityProvision(BaseMethod):
 
     def get_provisions(self, ):
         
-        for service_type in self.service_types:
-            normative_distance = self.service_types_normatives.loc[service_type].dropna().copy(deep = True)
-            try:
-                self.Provisions[service_type]['normative_distance'] = normative_distance['walking_radius_normative']
-                self.Provisions[service_type]['selected_graph'] = self.graph_nk_length
-            except:
-                self.Provisions[service_type]['normative_distance'] = normative_distance['public_transport_time_normative']
-                self.Provisions[service_type]['selected_graph'] = self.graph_nk_time
-            
-            try:
-                self.Provisions[service_type]['services'] = pd.read_pickle(io.BytesIO(requests.get(f'{self.file_server}provision_1/{self.city_name}_{service_type}_{self.year}_{self.valuation_type}_services').content))
-                self.Provisions[service_type]['buildings'] = pd.read_pickle(io.BytesIO(requests.get(f'{self.file_server}provision_1/{self.city_name}_{service_type}_{self.year}_{self.valuation_type}_buildings').content))
-                self.Provisions[service_type]['distance_matrix'] = pd.read_pickle(io.BytesIO(requests.get(f'{self.file_server}provision_1/{self.city_name}_{service_type}_{self.year}_{self.valuation_type}_distance_matrix').content))
-                self.Provisions[service_type]['destination_matrix'] = pd.read_pickle(io.BytesIO(requests.get(f'{self.file_server}provision_1/{self.city_name}_{service_type}_{self.year}_{self.valuation_type}_destination_matrix').content))
-                print(service_type + ' loaded')
-            except:
-                print(service_type + ' not loaded')
-                self.Provisions[service_type]['buildings'] = self.buildings.copy(deep = True)
-                self.Provisions[service_type]['services'] = self.services[self.services['service_code'] == service_type].copy(deep = True)    
-                self.Provisions[service_type] =  self._calculate_provisions(self.Provisions[service_type], service_type, calculation_type = self.calculation_type)
-                self.Provisions[service_type]['buildings'], self.Provisions[service_type]['services'] = self._additional_options(self.Provisions[service_type]['buildings'].copy(), 
-                                                                                                                                    self.Provisions[service_type]['services'].copy(),
-                                                                                                                                        self.Provisions[service_type]['distance_matrix'].copy(),
-                                                                                                                                        self.Provisions[service_type]['destination_matrix'].copy(),
-                                                                                                                                        self.Provisions[service_type]['normative_distance'],
-                                                                                                                                        service_type,
-                                                                                                                                        self.user_selection_zone,
-                                                                                                                                        self.valuation_type)
+        self._calculate_shared_distance_matrices()
+        for service_type in progress.iterate(self.service_types, "provision"):
+            self._get_service_type_provisions(service_type)
         cols_to_drop = [x for x in self.buildings.columns for service_type in self.service_types if service_type in x]
         self.buildings = self.buildings.drop(columns = cols_to_drop)
         for service_type in self.service_types: 
@@ -186,14 +182,128 @@ class CityProvision(BaseMethod):
         self.services = self.services.to_crs(4326)
         self.buildings = self.buildings.to_crs(4326)
         if self.return_jsons == True:  
-            return {"houses": eval(self.buildings.to_json().replace('true', 'True').replace('null', 'None').replace('false', 'False')), 
-                    "services": eval(self.services.to_json().replace('true', 'True').replace('null', 'None').replace('false', 'False')), 
-                    "provisions": {service_type: eval(self._provision_matrix_transform(self.Provisions[service_type]['destination_matrix'], 
-                                                                                       self.services[self.services['is_shown'] == True],
-                                                                                       self.buildings[self.buildings['is_shown'] == True]).to_json().replace('null', 'None')) for service_type in self.service_types}}
+            # GeoDataFrames are encoded by geojson_serializer, so responses can be streamed
+            return {"houses": self.buildings, 
+                    "services": self.services, 
+                    "provisions": {service_type: self._provision_matrix_transform(self.Provisions[service_type]['destination_matrix'], 
+                                                                                  self.services[self.services['is_shown'] == True],
+                                                                                  self.buildings[self.buildings['is_shown'] == True],
+                                                                                  self.Provisions[service_type]['services'].index,
+                                                                                  self.Provisions[service_type]['buildings'].index,
+                                                                                  self.shown_links_only) for service_type in self.service_types}}
         else:
             return self
 
+    def _set_normative(self, service_type):
+        normative_distance = self.service_types_normatives.loc[service_type].dropna().copy(deep = True)
+        try:
+            self.Provisions[service_type]['normative_distance'] = normative_distance['walking_radius_normative']
+            self.Provisions[service_type]['selected_graph'] = self.graph_nk_length
+            self.Provisions[service_type]['selected_csr_graph'] = self.graph_csr_length
+        except:
+            self.Provisions[service_type]['normative_distance'] = normative_distance['public_transport_time_normative']
+            self.Provisions[service_type]['selected_graph'] = self.graph_nk_time
+            self.Provisions[service_type]['selected_csr_graph'] = self.graph_csr_time
+
+    def _calculate_shared_distance_matrices(self):
+        """
+        Multi-service mode of get_provisions. Distance matrices of service types which are not
+        in the cache are calculated together: buildings are snapped once and shortest paths are
+        searched once per graph from the union of services nodes, matrices of service types
+        are slices of the shared result by their services rows and buildings columns. Only sparse
+        calculation types share the traversal, dense matrices of all service types would be kept
+        in memory together.
+        """
+
+        if self.calculation_type not in self.sparse_calculation_types:
+            return
+        missing = []
+        for service_type in self.service_types:
+            self._set_normative(service_type)
+            self.Provisions[service_type]['cache_key'] = self._get_cache_key(service_type)
+            if not provision_cache.contains(self.Provisions[service_type]['cache_key']):
+                missing.append(service_type)
+        if len(missing) < 2:
+            return
+
+        _, buildings_nodes = self.snap_index.nearest(self.buildings['geometry'])
+        graphs = {}
+        for service_type in missing:
+            graphs.setdefault(id(self.Provisions[service_type]['selected_csr_graph']), []).append(service_type)
+
+        for service_types in graphs.values():
+            csr_graph = self.Provisions[service_types[0]]['selected_csr_graph']
+            services = [self.services[self.services['service_code'] == x] for x in service_types]
+            _, services_nodes = self.snap_index.nearest(pd.concat(services)['geometry'])
+            bounds = np.cumsum([0] + [len(x) for x in services])
+            cutoffs = [self._get_distance_cutoff(self.Provisions[x]['normative_distance'], self.calculation_type) 
+                       for x in service_types]
+            distance_matrix = self._get_distance_matrix(csr_graph, services_nodes, buildings_nodes, 
+                                                        max(cutoffs), self.calculation_type)
+
+            for service_type, start, end, cutoff in zip(service_types, bounds[:-1], bounds[1:], cutoffs):
+                buildings_cols = np.flatnonzero(self.buildings.index.isin(self._get_buildings(service_type).index))
+                # pairs of buildings of the service type within its cutoff, explicit zeros are kept
+                matrix = distance_matrix[start:end].tocoo()
+                new_cols = np.full(len(self.buildings), -1)
+                new_cols[buildings_cols] = np.arange(len(buildings_cols))
+                within = (matrix.data <= cutoff) & (new_cols[matrix.col] >= 0)
+                matrix = sparse.csr_matrix((matrix.data[within], (matrix.row[within], new_cols[matrix.col[within]])), 
+                                           shape = (end - start, len(buildings_cols)))
+                self.Provisions[service_type]['shared_distance_matrix'] = matrix
+            progress.report(0, f"{', '.join(service_types)}: shared distance matrix")
+
+    def _get_buildings(self, service_type):
+        return self.buildings[self.buildings[f'{service_type}_service_demand_value_{self.valuation_type}'].notna()]
+
+    def _get_distance_cutoff(self, normative_distance, calculation_type):
+        # sparse distances are searched up to a multiple of the normative, pairs beyond it are never stored
+        if calculation_type in self.sparse_calculation_types and self.distance_cutoff_factor:
+            return normative_distance * self.distance_cutoff_factor
+        return np.inf
+
+    def _get_distance_matrix(self, csr_graph, services_nodes, buildings_nodes, cutoff, calculation_type):
+        if calculation_type in self.sparse_calculation_types:
+            return get_sparse_distance_matrix(csr_graph, services_nodes, buildings_nodes, cutoff)
+        return get_distance_matrix(csr_graph, services_nodes, buildings_nodes)
+
+    def _get_service_type_provisions(self, service_type):
+        self._set_normative(service_type)
+        cache_key = self.Provisions[service_type].pop('cache_key', None) or self._get_cache_key(service_type)
+        cached = provision_cache.get(cache_key)
+        if cached is not None:
+            self.Provisions[service_type].pop('shared_distance_matrix', None)
+            self.Provisions[service_type].update(cached)
+            print(service_type + ' loaded')
+        else:
+            print(service_type + ' not loaded')
+            self.Provisions[service_type]['buildings'] = self._get_buildings(service_type).copy(deep = True)
+            self.Provisions[service_type]['services'] = self.services[self.services['service_code'] == service_type].copy(deep = True)    
+            self.Provisions[service_type] =  self._calculate_provisions(self.Provisions[service_type], service_type, calculation_type = self.calculation_type)
+            self.Provisions[service_type]['buildings'], self.Provisions[service_type]['services'] = self._additional_options(self.Provisions[service_type]['buildings'].copy(), 
+                                                                                                                                self.Provisions[service_type]['services'].copy(),
+                                                                                                                                    self.Provisions[service_type]['distance_matrix'].copy(),
+                                                                                                                                    self.Provisions[service_type]['destination_matrix'].copy(),
+                                                                                                                                    self.Provisions[service_type]['normative_distance'],
+                                                                                                                                    service_type,
+                                                                                                                                    self.user_selection_zone,
+                                                                                                                                    self.valuation_type)
+            try:
+                provision_cache.put(cache_key, 
+                                    tables = {x: self.Provisions[service_type][x] for x in ['services', 'buildings']},
+                                    matrices = {x: self.Provisions[service_type][x] for x in ['distance_matrix', 'destination_matrix']})
+            except Exception as e:
+                print(service_type + ' not cached: ' + str(e))
+
+    def _get_cache_key(self, service_type):
+        data_version = provision_cache.hash_data(
+            self._get_buildings(service_type)[['functional_object_id', f'{service_type}_service_demand_value_{self.valuation_type}', 'geometry']],
+            self.services[self.services['service_code'] == service_type][['capacity', 'geometry']],
+            self.Provisions[service_type]['normative_distance'], self.user_selection_zone,
+            self.calculation_type, self.distance_cutoff_factor)
+        return provision_cache.make_key(self.city_name, service_type, self.year, self.valuation_type, 
+                                        self.graph_version, data_version)
+
     def _provisions_impotancy(self, buildings):
         provision_value_columns = [service_type + '_provison_value' for service_type in self.service_types]
         if self.services_impotancy:
@@ -212,7 +322,13 @@ class CityProvision(BaseMethod):
             a = buildings['is_shown'].copy() 
             t = []
             for service_type in self.service_types:
-                t.append(Provisions[service_type]['destination_matrix'][a[a].index.values].apply(lambda x: len(x[x > 0])>0, axis = 1))
+                destination_matrix = Provisions[service_type]['destination_matrix']
+                if sparse.issparse(destination_matrix):
+                    shown_buildings = Provisions[service_type]['buildings'].index.isin(a[a].index.values)
+                    shown = (destination_matrix.tocsc()[:, shown_buildings] > 0).getnnz(axis = 1) > 0
+                    t.append(pd.Series(shown, index = Provisions[service_type]['services'].index))
+                else:
+                    t.append(destination_matrix[a[a].index.values].apply(lambda x: len(x[x > 0])>0, axis = 1))
             services['is_shown'] = pd.concat([a[a] for a in t])
         else:
             buildings['is_shown'] = True
@@ -220,26 +336,18 @@ class CityProvision(BaseMethod):
         return buildings, services
 
     def _calculate_provisions(self, Provisions, service_type, calculation_type):
-        df = pd.DataFrame.from_dict(dict(self.nx_graph.nodes(data=True)), orient='index')
-        self.graph_gdf = gpd.GeoDataFrame(df, geometry = df['geometry'], crs = self.city_crs)
-        from_houses = self.graph_gdf['geometry'].sindex.nearest(Provisions['buildings']['geometry'], 
-                                                                return_distance = True, 
-                                                                return_all = False) 
-        to_services = self.graph_gdf['geometry'].sindex.nearest(Provisions['services']['geometry'], 
-                                                                return_distance = True, 
-                                                                return_all = False)
-        Provisions['distance_matrix'] = pd.DataFrame(0, index = to_services[0][1], 
-                                                        columns = from_houses[0][1])
-
-        splited_matrix = np.array_split(Provisions['distance_matrix'].copy(deep = True), int(len(Provisions['distance_matrix']) / 1000) + 1)
-        
-        for i in range(len(splited_matrix)):
-            r = nk.distance.SPSP(G = Provisions['selected_graph'], 
-                                sources = splited_matrix[i].index.values).run()
-            splited_matrix[i] = splited_matrix[i].apply(lambda x: self._get_nk_distances(r,x), axis =1)
-            del r
-        Provisions['distance_matrix'] = pd.concat(splited_matrix)
-        del splited_matrix
+        distance_matrix = Provisions.pop('shared_distance_matrix', None)
+        if distance_matrix is None:
+            _, houses_nodes = self.snap_index.nearest(Provisions['buildings']['geometry'])
+            _, services_nodes = self.snap_index.nearest(Provisions['services']['geometry'])
+            distance_matrix = self._get_distance_matrix(Provisions['selected_csr_graph'], services_nodes, houses_nodes, 
+                                                        self._get_distance_cutoff(Provisions['normative_distance'], calculation_type),
+                                                        calculation_type)
+        if calculation_type in self.sparse_calculation_types:
+            return self._calculate_sparse_provisions(Provisions, service_type, calculation_type, distance_matrix)
+
+        Provisions['distance_matrix'] = pd.DataFrame(distance_matrix)
+        progress.report(0.5, f"{service_type}: distance matrix")
 
         Provisions['distance_matrix'].index = Provisions['services'].index
         Provisions['distance_matrix'].columns = Provisions['buildings'].index
@@ -266,6 +374,137 @@ class CityProvision(BaseMethod):
                                                                     service_type )
         return Provisions        
 
+    def _calculate_sparse_provisions(self, Provisions, service_type, calculation_type, distance_matrix):
+        Provisions['distance_matrix'] = distance_matrix
+        progress.report(0.5, f"{service_type}: distance matrix")
+        print(Provisions['buildings'][f'{service_type}_service_demand_left_value_{self.valuation_type}'].sum(), 
+              Provisions['services']['capacity_left'].sum(), 
+              Provisions['normative_distance'], 
+              Provisions['distance_matrix'].nnz)
+
+        if calculation_type == 'gravity_vectorized':
+            Provisions['destination_matrix'] = self._provision_loop_gravity_vectorized(Provisions['buildings'], 
+                                                        Provisions['services'], 
+                                                        Provisions['distance_matrix'], 
+                                                        Provisions['normative_distance'], 
+                                                        service_type)
+        elif calculation_type == 'linear_vectorized':
+            Provisions['destination_matrix'] = self._provision_loop_linear_vectorized(Provisions['buildings'], 
+                                                        Provisions['services'], 
+                                                        Provisions['distance_matrix'], 
+                                                        Provisions['normative_distance'], 
+                                                        service_type)
+        return Provisions
+
+    def _calculate_incremental_provisions(self, Provisions, service_type):
+        """
+        Recalculates provisions around user changes only. Baseline matrices of get_provisions are
+        taken from the cache (and calculated once if they are not there), distances are searched
+        for new, moved (snapped to another node) and changed services and buildings only. The
+        distribution is run again for changed objects, buildings within the normative of changed
+        services or supplied by them and services within the normative of these buildings, 
+        flows between the other pairs are kept from the baseline.
+        """
+
+        self._get_service_type_provisions(service_type)
+        baseline = self.Provisions[service_type]
+        buildings, services = Provisions['buildings'], Provisions['services']
+        normative_distance = Provisions['normative_distance']
+        demand_column = f'{service_type}_service_demand_value_{self.valuation_type}'
+        base_buildings = self.buildings.reindex(baseline['buildings'].index)
+        base_services = baseline['services']
+
+        _, buildings_nodes = self.snap_index.nearest(buildings['geometry'])
+        _, services_nodes = self.snap_index.nearest(services['geometry'])
+        _, base_buildings_nodes = self.snap_index.nearest(base_buildings['geometry'])
+        _, base_services_nodes = self.snap_index.nearest(base_services['geometry'])
+
+        # positions of baseline objects, -1 for new ones
+        buildings_base = base_buildings.index.get_indexer(buildings.index)
+        services_base = base_services.index.get_indexer(services.index)
+        demand = buildings[demand_column].fillna(0).to_numpy(dtype = float)
+        capacity = services['capacity'].fillna(0).to_numpy(dtype = float)
+        changed_buildings = (buildings_base < 0) | (base_buildings_nodes[buildings_base] != buildings_nodes) \
+            | (base_buildings[demand_column].fillna(0).to_numpy(dtype = float)[buildings_base] != demand)
+        changed_services = (services_base < 0) | (base_services_nodes[services_base] != services_nodes) \
+            | (base_services['capacity'].fillna(0).to_numpy(dtype = float)[services_base] != capacity)
+        print(service_type, 'changed services:', changed_services.sum(), 'changed buildings:', changed_buildings.sum())
+
+        def to_new_positions(base_positions, mask, size):
+            positions = np.full(size, -1)
+            positions[base_positions[mask]] = np.flatnonzero(mask)
+            return positions
+
+        # baseline matrices are moved to positions of user changes, pairs of changed objects are dropped
+        unchanged_services = to_new_positions(services_base, ~changed_services, len(base_services))
+        unchanged_buildings = to_new_positions(buildings_base, ~changed_buildings, len(base_buildings))
+        def move_matrix(matrix):
+            matrix = sparse.coo_matrix(matrix)
+            rows, cols = unchanged_services[matrix.row], unchanged_buildings[matrix.col]
+            kept = (rows >= 0) & (cols >= 0)
+            return rows[kept], cols[kept], matrix.data[kept]
+
+        cutoff = self._get_distance_cutoff(normative_distance, self.calculation_type)
+        csr_graph = Provisions['selected_csr_graph']
+        changed_services_rows = np.flatnonzero(changed_services)
+        changed_buildings_cols = np.flatnonzero(changed_buildings)
+        unchanged_services_rows = np.flatnonzero(~changed_services)
+        services_distance = get_sparse_distance_matrix(csr_graph, services_nodes[changed_services_rows], 
+                                                       buildings_nodes, cutoff).tocoo()
+        # distances from services to changed buildings are searched from the buildings on the reversed graph
+        buildings_distance = get_sparse_distance_matrix(csr_graph.T.tocsr(), buildings_nodes[changed_buildings_cols], 
+                                                        services_nodes[unchanged_services_rows], cutoff).tocoo()
+        rows, cols, data = move_matrix(baseline['distance_matrix'])
+        distance_matrix = sparse.csr_matrix(
+            (np.r_[data, services_distance.data, buildings_distance.data], 
+             (np.r_[rows, changed_services_rows[services_distance.row], unchanged_services_rows[buildings_distance.col]], 
+              np.r_[cols, services_distance.col, changed_buildings_cols[buildings_distance.row]])), 
+            shape = (len(services), len(buildings)))
+
+        # changed objects with their neighbourhood within the normative are distributed again
+        base_flows = sparse.coo_matrix(baseline['destination_matrix'])
+        all_buildings = to_new_positions(buildings_base, buildings_base >= 0, len(base_buildings))
+        all_services = to_new_positions(services_base, services_base >= 0, len(base_services))
+        flow_services, flow_buildings = all_services[base_flows.row], all_buildings[base_flows.col]
+        affected_buildings = changed_buildings.copy()
+        near = distance_matrix[changed_services_rows]
+        affected_buildings[near.indices[near.data <= normative_distance]] = True
+        from_changed = (flow_services >= 0) & (flow_buildings >= 0)
+        from_changed[from_changed] = changed_services[flow_services[from_changed]]
+        affected_buildings[flow_buildings[from_changed]] = True
+
+        affected_services = changed_services.copy()
+        near = distance_matrix.tocsc()[:, np.flatnonzero(affected_buildings)]
+        affected_services[near.indices[near.data <= normative_distance]] = True
+        to_changed = (flow_services >= 0) & (flow_buildings >= 0)
+        to_changed[to_changed] = changed_buildings[flow_buildings[to_changed]]
+        affected_services[flow_services[to_changed]] = True
+
+        rows, cols, flows = move_matrix(base_flows)
+        fixed = ~(affected_services[rows] & affected_buildings[cols])
+        rows, cols, flows = rows[fixed], cols[fixed], flows[fixed]
+        capacity_left = np.maximum(capacity - np.bincount(rows, flows, minlength = len(services)), 0)
+        demand_left = np.maximum(demand - np.bincount(cols, flows, minlength = len(buildings)), 0)
+
+        affected_services_rows, affected_buildings_cols = np.flatnonzero(affected_services), np.flatnonzero(affected_buildings)
+        cost_matrix = distance_matrix[affected_services_rows][:, affected_buildings_cols]
+        # the affected area is solved by the same model as the baseline
+        if self.calculation_type == 'linear_vectorized':
+            new_flows = linear_provision(cost_matrix, capacity_left[affected_services_rows],
+                                         demand_left[affected_buildings_cols], normative_distance)
+        else:
+            cost_matrix.data += 1
+            new_flows = gravity_provision(cost_matrix, capacity_left[affected_services_rows],
+                                         demand_left[affected_buildings_cols], normative_distance)
+        new_flows = sparse.coo_matrix(new_flows)
+        Provisions['distance_matrix'] = distance_matrix
+        Provisions['destination_matrix'] = sparse.csr_matrix(
+            (np.r_[flows, new_flows.data], 
+             (np.r_[rows, affected_services_rows[new_flows.row]], np.r_[cols, affected_buildings_cols[new_flows.col]])), 
+            shape = (len(services), len(buildings)))
+        print(service_type, 'recalculated services:', len(affected_services_rows), 'recalculated buildings:', len(affected_buildings_cols))
+        return Provisions
+
     @staticmethod
     def _restore_user_provisions(user_provisions):
         restored_user_provisions = user_provisions[['service_id','house_id','demand']].groupby(['service_id','house_id']).first().unstack().droplevel(level = 0, axis = 1).fillna(0)
@@ -276,63 +515,71 @@ class CityProvision(BaseMethod):
 
     @staticmethod
     def _additional_options(buildings, services, Matrix, destination_matrix, normative_distance, service_type, selection_zone, valuation_type): 
-        #clear matrix same size as buildings and services if user sent sth new
-        cols_to_drop = list(set(set(Matrix.columns.values) - set(buildings.index.values)))
-        rows_to_drop = list(set(set(Matrix.index.values) - set(services.index.values)))
-        Matrix = Matrix.drop(index=rows_to_drop, 
-                                columns=cols_to_drop, 
-                                errors = 'irgonre')
-        destination_matrix = destination_matrix.drop(index=rows_to_drop, 
-                                    columns=cols_to_drop, 
-                                    errors = 'irgonre')                             
-        #bad performance 
-        #bad code
-        #rewrite to vector operations [for col in ****]
-        buildings[f'{service_type}_service_demand_left_value_{valuation_type}'] = buildings[f'{service_type}_service_demand_value_{valuation_type}'] 
-        buildings[f'{service_type}_supplyed_demands_within'] = 0
-        buildings[f'{service_type}_supplyed_demands_without'] = 0
-        services['capacity_left'] = services['capacity']
-        services['carried_capacity_within'] = 0
-        services['carried_capacity_without'] = 0
-        for i in range(len(destination_matrix)):
-            loc = destination_matrix.iloc[i]
-            s = Matrix.loc[loc.name] <= normative_distance
-            within = loc[s]
-            without = loc[~s]
-            within = within[within > 0]
-            without = without[without > 0]
-            buildings[f'{service_type}_service_demand_left_value_{valuation_type}'] = buildings[f'{service_type}_service_demand_left_value_{valuation_type}'].sub(within.add(without, fill_value= 0), fill_value = 0)
-            buildings[f'{service_type}_supplyed_demands_within'] = buildings[f'{service_type}_supplyed_demands_within'].add(within, fill_value = 0)
-            buildings[f'{service_type}_supplyed_demands_without'] = buildings[f'{service_type}_supplyed_demands_without'].add(without, fill_value = 0)
-            services.at[loc.name,'capacity_left'] = services.at[loc.name,'capacity_left'] - within.add(without, fill_value= 0).sum()
-            services.at[loc.name,'carried_capacity_within'] = services.at[loc.name,'carried_capacity_within'] + within.sum()
-            services.at[loc.name,'carried_capacity_without'] = services.at[loc.name,'carried_capacity_without'] + without.sum()
+        if sparse.issparse(destination_matrix):
+            # sparse matrices are aligned with buildings and services by position
+            destination_matrix = sparse.coo_matrix(destination_matrix)
+            positive = destination_matrix.data > 0
+            rows, cols = destination_matrix.row[positive], destination_matrix.col[positive]
+            flows = destination_matrix.data[positive]
+            distances = np.asarray(sparse.csr_matrix(Matrix)[rows, cols]).ravel()
+        else:
+            # dense matrices are aligned by labels, rows and columns of buildings and services 
+            # which are not sent by user are skipped
+            destination_matrix = destination_matrix.loc[destination_matrix.index.isin(services.index), 
+                                                        destination_matrix.columns.isin(buildings.index)]
+            Matrix = Matrix.reindex(index = destination_matrix.index, columns = destination_matrix.columns)
+            flows = destination_matrix.to_numpy()
+            matrix_rows, matrix_cols = np.nonzero(flows > 0)
+            flows = flows[matrix_rows, matrix_cols]
+            distances = Matrix.to_numpy()[matrix_rows, matrix_cols]
+            rows = services.index.get_indexer(destination_matrix.index)[matrix_rows]
+            cols = buildings.index.get_indexer(destination_matrix.columns)[matrix_cols]
+
+        # flows are split by normative once and summed up for every building and service
+        flows = flows.astype(float)
+        within = np.where(distances <= normative_distance, flows, 0)
+        without = flows - within
+        n_services, n_buildings = len(services), len(buildings)
+
+        buildings[f'{service_type}_supplyed_demands_within'] = np.bincount(cols, within, minlength = n_buildings)
+        buildings[f'{service_type}_supplyed_demands_without'] = np.bincount(cols, without, minlength = n_buildings)
+        buildings[f'{service_type}_service_demand_left_value_{valuation_type}'] = buildings[f'{service_type}_service_demand_value_{valuation_type}'] \
+            - buildings[f'{service_type}_supplyed_demands_within'] - buildings[f'{service_type}_supplyed_demands_without']
+        services['carried_capacity_within'] = np.bincount(rows, within, minlength = n_services)
+        services['carried_capacity_without'] = np.bincount(rows, without, minlength = n_services)
+        services['capacity_left'] = services['capacity'] - services['carried_capacity_within'] - services['carried_capacity_without']
         buildings[f'{service_type}_provison_value'] = buildings[f'{service_type}_supplyed_demands_within'] / buildings[f'{service_type}_service_demand_value_{valuation_type}']
         services['service_load'] = services['capacity'] - services['capacity_left']
 
         buildings = buildings[[x for x in buildings.columns if service_type in x] + ['functional_object_id']]
-        return buildings, services 
+        return buildings, services
 
     def recalculate_provisions(self, ):
         
-        for service_type in self.service_types:
+        for service_type in progress.iterate(self.service_types, "recalculation"):
             print(service_type)
             normative_distance = self.service_types_normatives.loc[service_type].dropna().copy(deep = True)
             try:
                 self.new_Provisions[service_type]['normative_distance'] = normative_distance['walking_radius_normative']
                 self.new_Provisions[service_type]['selected_graph'] = self.graph_nk_length
+                self.new_Provisions[service_type]['selected_csr_graph'] = self.graph_csr_length
                 print('walking_radius_normative')
             except:
                 self.new_Provisions[service_type]['normative_distance'] = normative_distance['public_transport_time_normative']
                 self.new_Provisions[service_type]['selected_graph'] = self.graph_nk_time
+                self.new_Provisions[service_type]['selected_csr_graph'] = self.graph_csr_time
                 print('public_transport_time_normative')
             
             self.new_Provisions[service_type]['buildings'] = self.user_changes_buildings.copy(deep = True)
             self.new_Provisions[service_type]['services'] = self.user_changes_services[self.user_changes_services['service_code'] == service_type].copy(deep = True)
 
-            self.new_Provisions[service_type] =  self._calculate_provisions(self.new_Provisions[service_type], 
-                                                                            service_type, 
-                                                                            calculation_type=self.calculation_type)
+            if self.incremental and self.calculation_type in self.sparse_calculation_types:
+                self.new_Provisions[service_type] = self._calculate_incremental_provisions(self.new_Provisions[service_type], 
+                                                                                          service_type)
+            else:
+                self.new_Provisions[service_type] =  self._calculate_provisions(self.new_Provisions[service_type], 
+                                                                                service_type, 
+                                                                                calculation_type=self.calculation_type)
             self.new_Provisions[service_type]['buildings'], self.new_Provisions[service_type]['services'] = self._additional_options(self.new_Provisions[service_type]['buildings'].copy(), 
                                                                                                                                      self.new_Provisions[service_type]['services'].copy(),
                                                                                                                                      self.new_Provisions[service_type]['distance_matrix'].copy(),
@@ -364,11 +611,15 @@ class CityProvision(BaseMethod):
         self.user_changes_buildings = self.user_changes_buildings.to_crs(4326)
 
         if self.return_jsons == True:  
-            return {"houses": eval(self.user_changes_buildings.to_json().replace('true', 'True').replace('null', 'None').replace('false', 'False')), 
-                    "services": eval(self.user_changes_services.to_json().replace('true', 'True').replace('null', 'None').replace('false', 'False')), 
-                    "provisions": {service_type: eval(self._provision_matrix_transform(self.new_Provisions[service_type]['destination_matrix'], 
-                                                                                       self.user_changes_services[self.user_changes_services['is_shown'] == True],
-                                                                                       self.user_changes_buildings[self.user_changes_buildings['is_shown'] == True]).to_json().replace('null', 'None')) for service_type in self.service_types}}
+            # GeoDataFrames are encoded by geojson_serializer, so responses can be streamed
+            return {"houses": self.user_changes_buildings, 
+                    "services": self.user_changes_services, 
+                    "provisions": {service_type: self._provision_matrix_transform(self.new_Provisions[service_type]['destination_matrix'], 
+                                                                                  self.user_changes_services[self.user_changes_services['is_shown'] == True],
+                                                                                  self.user_changes_buildings[self.user_changes_buildings['is_shown'] == True],
+                                                                                  self.new_Provisions[service_type]['services'].index,
+                                                                                  self.new_Provisions[service_type]['buildings'].index,
+                                                                                  self.shown_links_only) for service_type in self.service_types}}
         else:
             return self
 
@@ -394,106 +645,55 @@ class CityProvision(BaseMethod):
                 self.new_Provisions[service_type]['services'][col] = d
         return self.new_Provisions[service_type]['buildings'], self.new_Provisions[service_type]['services'] 
     
-    @staticmethod
-    def _get_nk_distances(nk_dists, loc):
-        target_nodes = loc.index
-        source_node = loc.name
-        distances = [nk_dists.getDistance(source_node, node) for node in target_nodes]
-
-        return pd.Series(data = distances, index = target_nodes)
-    
-    def _declare_varables(self, loc):
-        name = loc.name
-        nans = loc.isna()
-        index = nans[~nans].index
-        t = pd.Series([pulp.LpVariable(name = f"route_{name}_{I}", lowBound=0, cat = "Integer") for I in index], index)
-        loc[~nans] = t
-        return loc
-
     @staticmethod
     def _provision_matrix_transform(destination_matrix, 
                                     services, 
-                                    buildings):
-        def subfunc(loc):
-            try:
-                return [{"house_id":int(k),"demand":int(v), "service_id": int(loc.name)} for k,v in loc.to_dict().items()]
-            except:
-                return np.NaN
-        def subfunc_geom(loc):
-            return shapely.geometry.LineString((buildings['geometry'][loc['house_id']],services['geometry'][loc['service_id']]))
-
-        buildings.geometry = buildings.centroid
-        services.geometry = services.centroid
-        flat_matrix = destination_matrix.transpose().apply(lambda x: subfunc(x[x>0]), result_type = "reduce")
-        distribution_links = gpd.GeoDataFrame(data = [item for sublist in list(flat_matrix) for item in sublist])
-        sel = distribution_links['house_id'].isin(buildings.index.values) & distribution_links['service_id'].isin(services.index.values)
-        sel = distribution_links.loc[sel[sel].index.values]
-        distribution_links['geometry'] = sel.apply(lambda x: subfunc_geom(x), axis = 1)
-        return distribution_links
+                                    buildings,
+                                    services_index = None,
+                                    buildings_index = None,
+                                    shown_only = False):
+        """
+        Exports nonzero flows of destination matrix as links (house_id, demand, service_id) ordered
+        by service and house. Links between given (shown) buildings and services get lines between
+        their centroids, the other links have no geometry or are skipped if shown_only is True.
+        """
+
+        if sparse.issparse(destination_matrix):
+            # rows and columns of a sparse matrix are labeled by services_index and buildings_index
+            links = sparse.csr_matrix(destination_matrix)
+            links.sort_indices()
+            links = links.tocoo()
+            flows, service_ids, house_ids = links.data, np.asarray(services_index)[links.row], np.asarray(buildings_index)[links.col]
+        else:
+            flows = destination_matrix.to_numpy()
+            rows, cols = np.nonzero(flows > 0)
+            flows, service_ids, house_ids = flows[rows, cols], destination_matrix.index.to_numpy()[rows], destination_matrix.columns.to_numpy()[cols]
+        positive = flows > 0
+        flows, service_ids, house_ids = flows[positive], service_ids[positive].astype(int), house_ids[positive].astype(int)
+
+        shown = np.isin(house_ids, buildings.index.values) & np.isin(service_ids, services.index.values)
+        if shown_only:
+            flows, service_ids, house_ids, shown = flows[shown], service_ids[shown], house_ids[shown], shown[shown]
+
+        houses_coords = shapely.get_coordinates(shapely.centroid(buildings.geometry.values[buildings.index.get_indexer(house_ids[shown])]))
+        services_coords = shapely.get_coordinates(shapely.centroid(services.geometry.values[services.index.get_indexer(service_ids[shown])]))
+        geometry = np.full(len(flows), None, dtype = object)
+        geometry[shown] = shapely.linestrings(np.stack([houses_coords, services_coords], axis = 1))
+        return gpd.GeoDataFrame(data = {"house_id": house_ids, "demand": flows.astype(int), "service_id": service_ids}, 
+                                geometry = geometry)
 
     def _provision_loop_linear(self, houses_table, services_table, distance_matrix, selection_range, destination_matrix, service_type): 
-        select = distance_matrix[distance_matrix.iloc[:] <= selection_range]
-        select = select.apply(lambda x: 1/(x+1), axis = 1)
-
-        select = select.loc[:, ~select.columns.duplicated()].copy(deep = True)
-        select = select.loc[~select.index.duplicated(),: ].copy(deep = True) 
-
-        variables = select.apply(lambda x: self._declare_varables(x), axis = 1)
-
-        prob = pulp.LpProblem("problem", pulp.LpMaximize)
-        for col in variables.columns:
-            t = variables[col].dropna().values
-            if len(t) > 0: 
-                prob +=(pulp.lpSum(t) <= houses_table[f'{service_type}_service_demand_left_value_{self.valuation_type}'][col],
-                        f"sum_of_capacities_{col}")
-            else: pass
-
-        for index in variables.index:
-            t = variables.loc[index].dropna().values
-            if len(t) > 0:
-                prob +=(pulp.lpSum(t) <= services_table['capacity_left'][index],
-                        f"sum_of_demands_{index}")
-            else:pass
-        costs = []
-        for index in variables.index:
-            t = variables.loc[index].dropna()
-            t = t * select.loc[index].dropna()
-            costs.extend(t)
-        prob +=(pulp.lpSum(costs),
-                "Sum_of_Transporting_Costs" )
-        prob.solve(pulp.PULP_CBC_CMD(msg=False))
-        to_df = {}
-        for var in prob.variables():
-            t = var.name.split('_')
-            try:
-                to_df[int(t[1])].update({int(t[2]): var.value()})
-            except ValueError: 
-                print(t)
-                pass
-            except:
-                to_df[int(t[1])] = {int(t[2]): var.value()}
-                
-        result = pd.DataFrame(to_df).transpose()
-        result = result.join(pd.DataFrame(0,
-                                          columns = list(set(set(destination_matrix.columns) - set(result.columns))),
-                                          index = destination_matrix.index), how = 'outer')
-        result = result.fillna(0)
-        destination_matrix = destination_matrix + result
-        axis_1 = destination_matrix.sum(axis = 1)
-        axis_0 = destination_matrix.sum(axis = 0)
-        services_table['capacity_left'] = services_table['capacity'].subtract(axis_1,fill_value = 0)
-        houses_table[f'{service_type}_service_demand_left_value_{self.valuation_type}'] = houses_table[f'{service_type}_service_demand_value_{self.valuation_type}'].subtract(axis_0,fill_value = 0)
-
-        distance_matrix = distance_matrix.drop(index = services_table[services_table['capacity_left'] == 0].index.values,
-                                        columns = houses_table[houses_table[f'{service_type}_service_demand_left_value_{self.valuation_type}'] == 0].index.values,
-                                        errors = 'ignore')
-        
-        selection_range += selection_range
-        if len(distance_matrix.columns) > 0 and len(distance_matrix.index) > 0:
-            return self._provision_loop_linear(houses_table, services_table, distance_matrix, selection_range, destination_matrix, service_type)
-        else: 
-            print(houses_table[f'{service_type}_service_demand_left_value_{self.valuation_type}'].sum(), services_table['capacity_left'].sum(),selection_range)
-            return destination_matrix
+        # the integer program is solved as a sparse transportation problem on the matrix arrays
+        demand_column = f'{service_type}_service_demand_left_value_{self.valuation_type}'
+        timings = {}
+        flows = linear_provision(distance_matrix.to_numpy(dtype = float), 
+                                 services_table['capacity_left'].reindex(distance_matrix.index).to_numpy(dtype = float), 
+                                 houses_table[demand_column].reindex(distance_matrix.columns).to_numpy(dtype = float), 
+                                 selection_range, timings)
+        destination_matrix = destination_matrix + pd.DataFrame(flows, index = distance_matrix.index, columns = distance_matrix.columns)
+        print(houses_table[demand_column].sum() - flows.sum(), services_table['capacity_left'].sum() - flows.sum(), 
+              'build time:', round(timings['build'], 3), 'solve time:', round(timings['solve'], 3))
+        return destination_matrix
 
     def _provision_loop_gravity(self, houses_table, services_table, distance_matrix, selection_range, destination_matrix, service_type, temp_destination_matrix = None):
         def _calculate_flows_y(loc):
@@ -548,3 +748,25 @@ class CityProvision(BaseMethod):
             print(houses_table[f'{service_type}_service_demand_left_value_{self.valuation_type}'].sum(), services_table['capacity_left'].sum(),selection_range)
             return destination_matrix
 
+    def _provision_loop_gravity_vectorized(self, houses_table, services_table, distance_matrix, selection_range, service_type):
+        # the same distribution as _provision_loop_gravity computed on arrays in one iterative pass
+        cost_matrix = distance_matrix.copy()
+        cost_matrix.data += 1
+        destination_matrix = gravity_provision(cost_matrix, 
+                                               services_table['capacity_left'].to_numpy(dtype = float), 
+                                               houses_table[f'{service_type}_service_demand_left_value_{self.valuation_type}'].to_numpy(dtype = float), 
+                                               selection_range)
+        print(houses_table[f'{service_type}_service_demand_left_value_{self.valuation_type}'].sum() - destination_matrix.sum(), 
+              services_table['capacity_left'].sum() - destination_matrix.sum())
+        return destination_matrix
+
+    def _provision_loop_linear_vectorized(self, houses_table, services_table, distance_matrix, selection_range, service_type):
+        timings = {}
+        destination_matrix = linear_provision(distance_matrix, 
+                                              services_table['capacity_left'].to_numpy(dtype = float), 
+                                              houses_table[f'{service_type}_service_demand_left_value_{self.valuation_type}'].to_numpy(dtype = float), 
+                                              selection_range, timings)
+        print(houses_table[f'{service_type}_service_demand_left_value_{self.valuation_type}'].sum() - destination_matrix.sum(), 
+              services_table['capacity_left'].sum() - destination_matrix.sum(), 
+              'build time:', round(timings['build'], 3), 'solve time:', round(timings['solve'], 3))
+        return destination_matrix
@@ -9,6 +9,7 @@ import networkit as nk
 
 from typing import Any, Optional
 from .city_provision import CityProvision
+from .geojson_serializer import to_python
 
 class CityProvisionContext(CityProvision): 
     def __init__(self, city_model: Any, service_types: list, 
@@ -34,12 +35,12 @@ class CityProvisionContext(CityProvision):
             self.user_context_zone = None
     @staticmethod
     def _extras(buildings, services, extras, service_types):
-        extras['top_10_services'] = {s_t: eval(services.get_group(s_t).sort_values(by = 'service_load').tail(10).to_json().replace('true', 'True').replace('null', 'None').replace('false', 'False')) for s_t in service_types}
-        extras['bottom_10_services'] = {s_t: eval(services.get_group(s_t).sort_values(by = 'service_load').head(10).to_json().replace('true', 'True').replace('null', 'None').replace('false', 'False')) for s_t in service_types}
-        extras['top_10_houses'] = {s_t: eval(buildings.sort_values(by = s_t + '_provison_value').tail(10).to_json().replace('true', 'True').replace('null', 'None').replace('false', 'False')) for s_t in service_types}
-        extras['bottom_10_houses'] = {s_t: eval(buildings.sort_values(by = s_t + '_provison_value').head(10).to_json().replace('true', 'True').replace('null', 'None').replace('false', 'False')) for s_t in service_types}
-        extras['top_10_houses_total'] = eval(buildings.sort_values(by = 'total_provision_assessment').tail(10).to_json().replace('true', 'True').replace('null', 'None').replace('false', 'False'))
-        extras['bottom_10_houses_total'] = eval(buildings.sort_values(by = 'total_provision_assessment').head(10).to_json().replace('true', 'True').replace('null', 'None').replace('false', 'False'))
+        extras['top_10_services'] = {s_t: to_python(services.get_group(s_t).sort_values(by = 'service_load').tail(10)) for s_t in service_types}
+        extras['bottom_10_services'] = {s_t: to_python(services.get_group(s_t).sort_values(by = 'service_load').head(10)) for s_t in service_types}
+        extras['top_10_houses'] = {s_t: to_python(buildings.sort_values(by = s_t + '_provison_value').tail(10)) for s_t in service_types}
+        extras['bottom_10_houses'] = {s_t: to_python(buildings.sort_values(by = s_t + '_provison_value').head(10)) for s_t in service_types}
+        extras['top_10_houses_total'] = to_python(buildings.sort_values(by = 'total_provision_assessment').tail(10))
+        extras['bottom_10_houses_total'] = to_python(buildings.sort_values(by = 'total_provision_assessment').head(10))
         
         return extras 
 
@@ -73,7 +74,7 @@ class CityProvisionContext(CityProvision):
             extras = self._extras(selection_buildings, services_grouped, extras, self.service_types)
             self.zone_context = self.zone_context.to_crs(4326)
             self.zone_context = self.zone_context.drop(columns = [x for x in self.zone_context.columns if x.split('_')[0] in self.service_types if not '_provison_value' in x])
-            return {"context_unit": eval(self.zone_context.to_json().replace('true', 'True').replace('null', 'None').replace('false', 'False')),
+            return {"context_unit": to_python(self.zone_context),
                     "additional_data": extras}
         else:
             grouped_buildings = self.buildings.groupby(by = 'administrative_unit_id')
@@ -94,7 +95,7 @@ class CityProvisionContext(CityProvision):
             extras = self._extras(self.buildings, services_grouped, extras, self.service_types)
             self.AdministrativeUnits = self.AdministrativeUnits.to_crs(4326)
             self.AdministrativeUnits = self.AdministrativeUnits.drop(columns = [x for x in self.AdministrativeUnits.columns if x.split('_')[0] in self.service_types if not '_provison_value' in x])
-            return {"context_unit": eval(self.AdministrativeUnits.to_json().replace('true', 'True').replace('null', 'None').replace('false', 'False')),
+            return {"context_unit": to_python(self.AdministrativeUnits),
                     "additional_data": extras}
 
 
@@ -7,6 +7,7 @@ import json
 from typing import Any, Optional
 from .base_method import BaseMethod
 from .city_provision import CityProvision
+from .geojson_serializer import to_python
 
 
 class CityValues(BaseMethod):
@@ -46,7 +47,7 @@ class CityValues(BaseMethod):
         services_unique_list = set(self.SocialGroupsValueTypesLivingSituations['city_service_type_id'].dropna().sum())
         self.ServiceTypes = self.ServiceTypes.loc[services_unique_list]
         self.ServiceTypes.index = self.ServiceTypes['code']
-        self.ServiceTypes['city_provision_value'] = self.ServiceTypes.apply(lambda x: self._get_city_provissions_value(x), axis = 1)
+        self.ServiceTypes['city_provision_value'] = self._get_city_provissions_value(self.ServiceTypes.index.tolist())
         self.ServiceTypes['city_provision_value'] = self.ServiceTypes['city_provision_value'].round(2) 
 
         index = self.SocialGroupsValueTypesLivingSituations[['value_group_id','value_type_id']].drop_duplicates()
@@ -61,17 +62,20 @@ class CityValues(BaseMethod):
         self.city_values.index = self.city_values.index.set_levels(self.ValueTypes.loc[self.city_values.index.levels[1].values]['value_type'].drop_duplicates().values, level=1)
     
     
-    def _get_city_provissions_value (self, s_t_loc):
+    def _get_city_provissions_value (self, service_types):
 
+        # all service types are calculated in one multi-service run sharing graph traversals,
+        # every service type keeps its own buildings as in a single-service run
         r = CityProvision(city_model = self.city_model, 
-                                service_types = [s_t_loc.name],
+                                service_types = service_types,
                                 valuation_type = self.valuation_type, 
                                 year = self.year,
-                                service_impotancy = [1],
+                                service_impotancy = [1] * len(service_types),
                                 return_jsons = False,
-                                calculation_type = 'gravity').get_provisions()
+                                calculation_type = 'gravity_vectorized',
+                                buildings_by_service_type = True).get_provisions()
 
-        return r.Provisions[s_t_loc.name]['buildings'][f'{s_t_loc.name}_provison_value'].mean() 
+        return [r.Provisions[x]['buildings'][f'{x}_provison_value'].mean() for x in service_types]
             
     def _assign_provisions_to_values(self, loc):
         value_type_id = loc.name[1]
@@ -94,5 +98,5 @@ class CityValues(BaseMethod):
     def get_city_values(self, ):
         _json = {}
         for value_group_id, part in self.city_values.groupby(level=0):
-            _json[value_group_id] = eval(part.droplevel(level = 0).to_json(orient = 'index').replace('null', 'None'))
+            _json[value_group_id] = to_python(part.droplevel(level = 0).to_dict(orient = 'index'))
         return {'city_values': _json}
\ No newline at end of file
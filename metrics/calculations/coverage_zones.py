@@ -4,6 +4,7 @@ import json
 from .errors import NormativeError
 from .base_method import BaseMethod
 from .mobility_analysis import AccessibilityIsochrones_v2
+from .coverage_zones_store import coverage_zones_store
 
 
 class CoverageZones(BaseMethod):
@@ -17,6 +18,8 @@ class CoverageZones(BaseMethod):
     city_model
             City Information Model
 
+    Zones are kept in coverage_zones_store until services, service types or the mobility graph are updated.
+
     Methods
     ------
     get_radius_zone(service_type, radius)
@@ -28,6 +31,7 @@ class CoverageZones(BaseMethod):
     def __init__(self, city_model):
         BaseMethod.__init__(self, city_model)
         super().validation("coverage_zones")
+        self.data_version = coverage_zones_store.get_data_version(city_model)
         self.service_types = self.city_model.ServiceTypes.copy()
         self.services = self.city_model.Services.copy()
         self.walk_speed = 4 * 1000 / 60
@@ -58,6 +62,13 @@ class CoverageZones(BaseMethod):
             CityMetricsMethods.Coverage_Zones(city_model).get_radius_zone(service_type='schools', radius=50)
         """
 
+        return coverage_zones_store.get(
+            self.city_model, self.data_version, ("radius", service_type, radius),
+            lambda: self._get_radius_zone(service_type, radius)
+            )
+
+    def _get_radius_zone(self, service_type, radius):
+
         service_types  = self.service_types
         services = self.services[self.services['service_code'] == service_type].reset_index(drop=True)
 
@@ -103,6 +114,14 @@ class CoverageZones(BaseMethod):
                 service_type='dentists', travel_type='walk', weight_value = 10)
         """
 
+        travel_type = getattr(travel_type, "value", travel_type)
+        return coverage_zones_store.get(
+            self.city_model, self.data_version, ("isochrone", service_type, travel_type, weight_value),
+            lambda: self._get_isochrone_zone(service_type, travel_type, weight_value)
+            )
+
+    def _get_isochrone_zone(self, service_type, travel_type, weight_value):
+
         services = self.services[self.services['service_code'] == service_type].reset_index(drop=True)
 
         x_from = services['geometry'].x
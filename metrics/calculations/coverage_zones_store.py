@@ -0,0 +1,109 @@
+import os
+import threading
+import traceback
+import numpy as np
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# In-memory store of coverage zones served by CoverageZones. Zones only change when services
+# or the mobility graph are updated, so they are kept until /data_update invalidates the city.
+# Least recently used zones are dropped once the store holds more than COVERAGE_ZONES_STORE_SIZE.
+STORE_SIZE = int(os.environ.get("COVERAGE_ZONES_STORE_SIZE", 512))
+# zones for service types normatives are built in background when a city is loaded or updated
+PRECOMPUTE = os.environ.get("COVERAGE_ZONES_PRECOMPUTE", "1") == "1"
+# layers zones depend on, updates of the other layers keep the store
+DEPENDENT_LAYERS = ["Services", "ServiceTypes", "MobilityGraph"]
+
+
+class CoverageZonesStore:
+
+    def __init__(self, max_size: int = STORE_SIZE):
+        self.max_size = max_size
+        self.zones = OrderedDict()
+        self.versions = {}
+        self.building = {}
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="coverage_zones")
+
+    def get_data_version(self, city_model) -> tuple:
+        return self.versions.get(city_model.city_name, 0), getattr(city_model, "graph_version", None)
+
+    def get(self, city_model, data_version: tuple, params: tuple, build):
+        """
+        Returns zones stored under the data version and params or builds them once,
+        concurrent requests for the same zones wait for the first one. The data version
+        must be taken before layers are read by the build function.
+        """
+
+        key = (city_model.city_name, data_version, *params)
+        with self.lock:
+            if key in self.zones:
+                self.zones.move_to_end(key)
+                return self.zones[key]
+            key_lock = self.building.setdefault(key, threading.Lock())
+
+        with key_lock:
+            try:
+                with self.lock:
+                    if key in self.zones:
+                        return self.zones[key]
+                zones = build()
+                with self.lock:
+                    if key[1] == self.get_data_version(city_model):
+                        self.zones[key] = zones
+                        while len(self.zones) > self.max_size:
+                            self.zones.popitem(last=False)
+            finally:
+                # the key lock is dropped even if build fails, the next request builds zones again
+                with self.lock:
+                    self.building.pop(key, None)
+        return zones
+
+    def invalidate(self, city_model) -> None:
+        """
+        Drops zones of the city and bumps its data version. Zones which are being built
+        for the previous version are returned to their requests but are not stored.
+        """
+
+        city = city_model.city_name
+        with self.lock:
+            self.versions[city] = self.versions.get(city, 0) + 1
+            for key in [key for key in self.zones if key[0] == city]:
+                del self.zones[key]
+        self.start_precompute(city_model)
+
+    def start_precompute(self, city_model) -> None:
+        if PRECOMPUTE:
+            self.pool.submit(self.precompute, city_model)
+
+    def precompute(self, city_model) -> None:
+        """
+        Builds radius and isochrone zones of service types normatives for all service types of the city.
+        """
+
+        from .coverage_zones import CoverageZones
+
+        try:
+            coverage_zones = CoverageZones(city_model)
+            service_codes = set(coverage_zones.services["service_code"])
+            service_types = coverage_zones.service_types[coverage_zones.service_types["code"].isin(service_codes)]
+            for _, service_type in service_types.iterrows():
+                if coverage_zones.data_version != self.get_data_version(city_model):
+                    return
+                params = []
+                if service_type.notna()["walking_radius_normative"]:
+                    walk_time = int(np.ceil(service_type["walking_radius_normative"] / coverage_zones.walk_speed))
+                    params.append(("walk", walk_time))
+                if service_type.notna()["public_transport_time_normative"]:
+                    params.append(("public_transport", int(service_type["public_transport_time_normative"])))
+                if params:
+                    coverage_zones.get_radius_zone(service_type["code"], None)
+                for travel_type, weight_value in params:
+                    coverage_zones.get_isochrone_zone(service_type["code"], travel_type, weight_value)
+        except Exception:
+            print(f"{city_model.city_name} coverage zones are not precomputed")
+            traceback.print_exc()
+
+
+coverage_zones_store = CoverageZonesStore()
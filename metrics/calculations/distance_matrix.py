@@ -0,0 +1,284 @@
+import os
+import threading
+import weakref
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context, shared_memory
+from scipy import sparse
+from scipy.sparse import csgraph
+
+# Shortest paths are sharded by sources across a pool of processes. Graphs are placed
+# into shared memory once, so every task carries only node ids and shared block names.
+WORKERS = int(os.environ.get("DISTANCE_MATRIX_WORKERS", min(os.cpu_count() or 1, 4)))
+# Dijkstra returns distances to all graph nodes, sources of a task are searched in batches
+# of at most this number of sources x nodes cells and only target columns are kept
+BATCH_CELLS = int(os.environ.get("DISTANCE_MATRIX_BATCH_CELLS", 4_000_000))
+
+_executor = None
+_executor_workers = None
+_executor_lock = threading.Lock()
+_shared_graphs = {}
+_attached_graphs = {}
+
+
+def get_distance_matrix(csr_graph, sources, targets, cutoff=np.inf, workers=None, chunk_size=64):
+    """
+    Calculates shortest path distances from source nodes to target nodes.
+
+    Parameters
+    ----------
+    csr_graph: scipy.sparse.csr_matrix
+        Weighted adjacency matrix of the routing graph (see data_transform.convert_nk2csr).
+    sources: array-like
+        Graph node ids of matrix rows. Repeated nodes get identical rows.
+    targets: array-like
+        Graph node ids of matrix columns.
+    cutoff: float
+        Maximum distance to search for.
+    workers: int, optional
+        Number of processes to shard sources across. Defaults to DISTANCE_MATRIX_WORKERS
+        environment variable or the number of cores.
+    chunk_size: int
+        Number of source nodes in one task.
+
+    Returns
+    -------
+    np.ndarray
+        Sources x targets matrix of distances, np.inf for pairs unreachable within the cutoff.
+    """
+
+    sources, targets, unique_sources, source_rows = _prepare_nodes(sources, targets)
+    order = np.argsort(source_rows, kind="stable")
+    bounds = np.searchsorted(source_rows[order], np.arange(0, len(unique_sources) + chunk_size, chunk_size))
+
+    matrix = np.full((len(sources), len(targets)), np.inf)
+    for start, distances in _run_chunks(csr_graph, unique_sources, targets, cutoff, workers, chunk_size, False):
+        chunk = order[bounds[start // chunk_size]:bounds[start // chunk_size + 1]]
+        matrix[chunk] = distances[source_rows[chunk] - start]
+
+    return matrix
+
+
+def get_reachable_nodes(csr_graph, source, cutoff=np.inf):
+    """
+    Runs Dijkstra from one source node in the calling process and stops at the cutoff.
+
+    Returns
+    -------
+    tuple of np.ndarray
+        Ids of nodes reachable within the cutoff (the source included) and distances to them.
+    """
+
+    distances = csgraph.dijkstra(csr_graph, indices=int(source), limit=max(cutoff, 0))
+    nodes = np.flatnonzero(np.isfinite(distances))
+    return nodes, distances[nodes]
+
+
+def get_paths_to_targets(csr_graph, sources, targets, return_paths=True):
+    """
+    Finds shortest paths from every source node to its own target node in the calling process.
+
+    Sources are grouped by targets and one shortest path tree is built per unique target
+    on the reversed graph, paths of all sources of the target are reconstructed from
+    its predecessors at once.
+
+    Returns
+    -------
+    distances: np.ndarray
+        Path lengths, np.inf for unreachable targets.
+    paths: tuple of np.ndarray or None
+        Positions of sources and start and end nodes of path edges. Edges of every
+        path are ordered from the source to the target.
+    """
+
+    sources = np.asarray(sources, dtype=np.int64).ravel()
+    targets = np.asarray(targets, dtype=np.int64).ravel()
+    unique_targets, target_rows = np.unique(targets, return_inverse=True)
+    target_rows = target_rows.ravel()
+    reversed_graph = csr_graph.T.tocsr()
+
+    distances = np.full(len(sources), np.inf)
+    positions, starts, ends = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+    for i, target in enumerate(unique_targets):
+        rows = np.flatnonzero(target_rows == i)
+        tree_distances, predecessors = csgraph.dijkstra(
+            reversed_graph, directed=True, indices=int(target), return_predecessors=True)
+        distances[rows] = tree_distances[sources[rows]]
+        if not return_paths:
+            continue
+
+        # predecessors in the reversed tree are next nodes on paths to the target
+        rows = rows[np.isfinite(distances[rows])]
+        nodes = sources[rows]
+        while len(nodes):
+            next_nodes = predecessors[nodes]
+            on_path = next_nodes >= 0
+            rows, nodes, next_nodes = rows[on_path], nodes[on_path], next_nodes[on_path]
+            positions.append(rows)
+            starts.append(nodes)
+            ends.append(next_nodes.astype(np.int64))
+            nodes = next_nodes
+
+    if not return_paths:
+        return distances, None
+    positions, starts, ends = np.concatenate(positions), np.concatenate(starts), np.concatenate(ends)
+    order = np.argsort(positions, kind="stable")
+    return distances, (positions[order], starts[order], ends[order])
+
+
+def get_sparse_distance_matrix(csr_graph, sources, targets, cutoff=np.inf, workers=None, chunk_size=64):
+    """
+    Calculates shortest path distances from source nodes to target nodes
+    and keeps only pairs that are reachable within the cutoff.
+
+    Dijkstra runs from every unique source node and stops at the cutoff, so memory
+    is proportional to the number of reachable pairs rather than to sources x targets.
+    Parameters are the same as in get_distance_matrix.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        Sources x targets matrix of distances. Pairs at zero distance are stored
+        as explicit zeros, so arithmetic on distances should be done through .data.
+    """
+
+    sources, targets, unique_sources, source_rows = _prepare_nodes(sources, targets)
+
+    rows, cols, data = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)], [np.zeros(0)]
+    for start, (chunk_rows, chunk_cols, chunk_data) in _run_chunks(
+            csr_graph, unique_sources, targets, cutoff, workers, chunk_size, True):
+        rows.append(chunk_rows + start)
+        cols.append(chunk_cols)
+        data.append(chunk_data)
+
+    rows, cols, data = np.concatenate(rows), np.concatenate(cols), np.concatenate(data)
+    order = np.lexsort((cols, rows))
+    unique_indptr = np.r_[0, np.cumsum(np.bincount(rows, minlength=len(unique_sources)))]
+
+    return _expand_rows(unique_indptr, cols[order], data[order], source_rows, len(targets))
+
+
+def _prepare_nodes(sources, targets):
+    sources = np.asarray(sources, dtype=np.int64).ravel()
+    targets = np.asarray(targets, dtype=np.int64).ravel()
+    unique_sources, source_rows = np.unique(sources, return_inverse=True)
+    return sources, targets, unique_sources, source_rows.ravel()
+
+
+def _expand_rows(indptr, indices, data, rows, n_cols):
+    # csr row selection that keeps explicit zeros
+    counts = (indptr[1:] - indptr[:-1])[rows]
+    new_indptr = np.r_[0, np.cumsum(counts)]
+    positions = np.repeat(indptr[:-1][rows] - new_indptr[:-1], counts) + np.arange(new_indptr[-1])
+    return sparse.csr_matrix(
+        (data[positions], indices[positions], new_indptr), shape=(len(rows), n_cols))
+
+
+def _run_chunks(csr_graph, sources, targets, cutoff, workers, chunk_size, as_sparse):
+    workers = workers or WORKERS
+    starts = range(0, len(sources), chunk_size)
+
+    if workers <= 1 or len(starts) <= 1:
+        for start in starts:
+            yield start, _dijkstra_chunk(csr_graph, sources[start:start + chunk_size], targets, cutoff, as_sparse)
+        return
+
+    graph = _share_graph(csr_graph)
+    executor = _get_executor(workers)
+    try:
+        futures = {
+            executor.submit(_dijkstra_chunk, graph, sources[start:start + chunk_size], targets, cutoff, as_sparse): start
+            for start in starts
+            }
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    except BrokenProcessPool:
+        _reset_executor()
+        raise
+
+
+def _dijkstra_chunk(graph, sources, targets, cutoff, as_sparse):
+    if not sparse.issparse(graph):
+        graph = _attach_graph(graph)
+    batch_size = max(1, BATCH_CELLS // max(graph.shape[0], 1))
+    batches = []
+    for start in range(0, len(sources), batch_size):
+        distances = csgraph.dijkstra(graph, directed=True, indices=sources[start:start + batch_size], limit=cutoff)
+        distances = distances[:, targets]
+        if as_sparse:
+            rows, cols = np.nonzero(np.isfinite(distances) & (distances <= cutoff))
+            distances = (rows + start, cols, distances[rows, cols])
+        batches.append(distances)
+
+    if not as_sparse:
+        return np.concatenate(batches) if batches else np.zeros((0, len(targets)))
+    return tuple(np.concatenate(x) for x in zip(*batches)) if batches else (
+        np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0))
+
+
+def _get_executor(workers):
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers != workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"))
+            _executor_workers = workers
+        return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        _executor = None
+
+
+def _share_graph(csr_graph):
+    key = id(csr_graph)
+    with _executor_lock:
+        entry = _shared_graphs.get(key)
+        if entry is not None and entry[0]() is csr_graph:
+            return entry[1]
+
+        blocks, arrays = [], []
+        for array in (csr_graph.data, csr_graph.indices, csr_graph.indptr):
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+            blocks.append(block)
+            arrays.append((block.name, array.dtype.str, array.shape))
+
+        descriptor = (csr_graph.shape, tuple(arrays))
+        _shared_graphs[key] = (weakref.ref(csr_graph), descriptor)
+        weakref.finalize(csr_graph, _release_graph, key, blocks)
+        return descriptor
+
+
+def _release_graph(key, blocks):
+    entry = _shared_graphs.get(key)
+    if entry is not None and entry[0]() is None:
+        del _shared_graphs[key]
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+
+def _attach_graph(descriptor, max_graphs=4):
+    # runs in worker processes, attached graphs are reused by subsequent tasks
+    shape, arrays = descriptor
+    key = arrays[0][0]
+    if key not in _attached_graphs:
+        while len(_attached_graphs) >= max_graphs:
+            old_blocks, _ = _attached_graphs.pop(next(iter(_attached_graphs)))
+            for block in old_blocks:
+                block.close()
+        blocks = [shared_memory.SharedMemory(name=name) for name, _, _ in arrays]
+        data, indices, indptr = (
+            np.ndarray(array_shape, dtype=dtype, buffer=block.buf)
+            for (_, dtype, array_shape), block in zip(arrays, blocks)
+            )
+        _attached_graphs[key] = (blocks, sparse.csr_matrix((data, indices, indptr), shape=shape, copy=False))
+    return _attached_graphs[key][1]
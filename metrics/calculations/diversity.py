@@ -1,21 +1,18 @@
 import pandas as pd
 import json
 import numpy as np
-import networkit as nk
 
-from scipy import spatial
 from .errors import SelectedValueError, TerritorialSelectError
 from .base_method import BaseMethod
 from .mobility_analysis import AccessibilityIsochrones
+from .distance_matrix import get_distance_matrix
 
 
 class Diversity(BaseMethod):
     def __init__(self, city_model):
         BaseMethod.__init__(self, city_model)
         super().validation("diversity")
-        self.mobility_graph_length = self.city_model.graph_nk_length
-        self.mobility_graph_time = self.city_model.graph_nk_time
-        self.graph_attrs = self.city_model.nk_attrs.copy()
+        self.mode_graphs = self.city_model.mode_graphs
         self.services = self.city_model.Services.copy()
         self.service_types = self.city_model.ServiceTypes.copy()
         self.municipalities = self.city_model.Municipalities.copy()
@@ -35,7 +32,7 @@ class Diversity(BaseMethod):
         if len(houses) == 0: raise TerritorialSelectError("houses") 
 
         travel_type, weigth, limit_value, graph = self._define_service_normative(service_type)
-        dist_matrix = self._get_distance_matrix(houses, services_select, graph, limit_value)
+        dist_matrix = self._get_distance_matrix(houses, services_select, graph, weigth, limit_value)
         houses = self._calculate_diversity(houses, dist_matrix)
 
         blocks = self.blocks.dropna(subset=["municipality_id"]) # TEMPORARY
@@ -56,7 +53,7 @@ class Diversity(BaseMethod):
             services = self.services[self.services["service_code"] == service_type]
             if len(services) == 0:
                 raise SelectedValueError("services", service_type, "service_code")
-            travel_type, weigth, limit_value, graph = self.define_service_normative(service_type)
+            travel_type, weigth, limit_value, graph = self._define_service_normative(service_type)
 
         if valuation_type == 'custom':
             if type(service_type) == str:
@@ -68,14 +65,14 @@ class Diversity(BaseMethod):
                 raise SelectedValueError("services", service_type, "service_code")
             if travel_type == "walk":
                 weigth = "length_meter"
-                graph = self.mobility_graph_length
+                graph = self.mode_graphs[travel_type]
             elif travel_type == 'public_transport':
                 weigth = "time_min"
-                graph = self.mobility_graph_time
+                graph = self.mode_graphs[travel_type]
             else:
                 raise ValueError("Not valid type of travel")
             
-        dist_matrix = self._get_distance_matrix(houses, services, graph, limit_value)
+        dist_matrix = self._get_distance_matrix(houses, services, graph, weigth, limit_value)
         houses = self._calculate_diversity(houses, dist_matrix)
 
         blocks = self.blocks.dropna(subset=["municipality_id"]) # TEMPORARY
@@ -105,7 +102,7 @@ class Diversity(BaseMethod):
             raise TerritorialSelectError("living buildings")
 
         travel_type, weigth, limit_value, graph = self._define_service_normative(service_type)
-        dist_matrix = self._get_distance_matrix(houses_in_block, services, graph, limit_value)
+        dist_matrix = self._get_distance_matrix(houses_in_block, services, graph, weigth, limit_value)
         houses_in_block = self._calculate_diversity(houses_in_block, dist_matrix)
 
         return json.loads(houses_in_block.to_crs(4326).to_json())
@@ -122,7 +119,7 @@ class Diversity(BaseMethod):
             
         house_x, house_y = house[["x", "y"]].values[0]
         travel_type, weigth, limit_value, graph = self._define_service_normative(service_type)
-        dist_matrix = self._get_distance_matrix(house, services, graph, limit_value)
+        dist_matrix = self._get_distance_matrix(house, services, graph, weigth, limit_value)
         house = self._calculate_diversity(house, np.vstack(dist_matrix[0]))
         selected_services = services[dist_matrix[:, 0] == 1]
         isochrone = AccessibilityIsochrones(self.city_model).get_accessibility_isochrone(
@@ -141,37 +138,35 @@ class Diversity(BaseMethod):
             travel_type = "walk"
             weigth = "length_meter"
             limit_value = service_type_info["walking_radius_normative"].values[0]
-            graph = self.mobility_graph_length
+            graph = self.mode_graphs[travel_type]
         elif service_type_info["public_transport_time_normative"].notna().values:
             travel_type = "public_transport"
             weigth = "time_min"
             limit_value = service_type_info["public_transport_time_normative"].values[0]
-            graph = self.mobility_graph_time
+            graph = self.mode_graphs[travel_type]
         else:
             raise ValueError("Any service type normative is None.")
 
         return travel_type, weigth, limit_value, graph
         
-    def _get_distance_matrix(self, houses, services, graph, limit_value):
+    def _get_distance_matrix(self, houses, services, graph, weigth, limit_value):
 
-        houses_distance, houses_nodes = spatial.cKDTree(self.graph_attrs).query([houses[["x", "y"]]])
-        services_distance, services_nodes = spatial.cKDTree(self.graph_attrs).query([services[["x", "y"]]])
+        houses_distance, houses_nodes = graph.snap_index.query(houses[["x", "y"]])
+        services_distance, services_nodes = graph.snap_index.query(services[["x", "y"]])
 
-        if len(services_nodes[0]) < len(houses_nodes[0]):
+        if len(services_nodes) < len(houses_nodes):
             source, target = services_nodes, houses_nodes
             source_dist, target_dist = services_distance, houses_distance
         else:
             source, target = houses_nodes, services_nodes
             source_dist, target_dist = houses_distance, services_distance
 
-        dijkstra = nk.distance.SPSP(graph, source[0])
-        dijkstra = dijkstra.run()
-        dist_matrix = dijkstra.getDistances(asarray=True)
-        dist_matrix = dist_matrix[:, target[0]] + target_dist[0] + np.vstack(np.array(source_dist[0]))
+        dist_matrix = get_distance_matrix(graph.csr[weigth], source, target, cutoff=limit_value)
+        dist_matrix = dist_matrix + target_dist + np.vstack(source_dist)
         dist_matrix = np.where(dist_matrix > limit_value, dist_matrix, 1)
         dist_matrix = np.where(dist_matrix <= limit_value, dist_matrix, 0)
     
-        return dist_matrix if len(services_nodes[0]) < len(houses_nodes[0]) else dist_matrix.T
+        return dist_matrix if len(services_nodes) < len(houses_nodes) else dist_matrix.T
 
     @staticmethod
     def _calculate_diversity(houses, dist_matrix):
@@ -0,0 +1,85 @@
+import orjson
+import shapely
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+# Encodes results of methods straight into JSON bytes. GeoDataFrames are written as GeoJSON
+# feature collections: geometries are encoded at once by shapely and embedded as ready fragments,
+# properties are dumped by orjson in chunks, so large layers can be streamed by FastAPI.
+JSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def iter_json(obj, chunk_size: int = 10000):
+    """
+    Yields JSON encoded obj in bytes chunks. Dicts and lists may contain
+    GeoDataFrames (encoded as GeoJSON), DataFrames and Series (encoded as in
+    DataFrame.to_json with default orient) along with plain JSON values.
+    """
+
+    if isinstance(obj, gpd.GeoDataFrame):
+        yield from iter_geojson(obj, chunk_size)
+    elif isinstance(obj, dict):
+        yield b"{"
+        for i, (key, value) in enumerate(obj.items()):
+            yield (b"," if i else b"") + orjson.dumps(str(key)) + b":"
+            yield from iter_json(value, chunk_size)
+        yield b"}"
+    elif isinstance(obj, (list, tuple)):
+        yield b"["
+        for i, value in enumerate(obj):
+            if i:
+                yield b","
+            yield from iter_json(value, chunk_size)
+        yield b"]"
+    elif isinstance(obj, (pd.DataFrame, pd.Series)):
+        yield orjson.dumps(obj.to_dict(), default=_default, option=JSON_OPTIONS)
+    else:
+        yield orjson.dumps(obj, default=_default, option=JSON_OPTIONS)
+
+
+def iter_geojson(gdf: gpd.GeoDataFrame, chunk_size: int = 10000):
+    """
+    Yields GeoJSON feature collection of gdf in bytes chunks. Features have
+    the same layout as in GeoDataFrame.to_json.
+    """
+
+    geometry = np.asarray(gdf.geometry.values, dtype=object)
+    properties = pd.DataFrame(gdf.drop(columns=gdf.geometry.name))
+    ids = gdf.index.astype(str)
+
+    yield b'{"type":"FeatureCollection","features":['
+    for start in range(0, len(gdf), chunk_size):
+        end = start + chunk_size
+        geojson = shapely.to_geojson(geometry[start:end])
+        features = [
+            {"id": i, "type": "Feature", "properties": props,
+             "geometry": orjson.Fragment(geom) if geom is not None else None}
+            for i, props, geom in zip(ids[start:end], properties.iloc[start:end].to_dict("records"), geojson)
+            ]
+        yield (b"," if start else b"") + orjson.dumps(features, default=_default, option=JSON_OPTIONS)[1:-1]
+    yield b"]}"
+
+
+def dumps(obj) -> bytes:
+    return b"".join(iter_json(obj))
+
+
+def to_python(obj):
+    """
+    Returns JSON-compatible python objects of obj, e.g. GeoJSON dict of a GeoDataFrame.
+    """
+
+    return orjson.loads(dumps(obj))
+
+
+def _default(obj):
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, pd.Timestamp):
+        return obj.isoformat()
+    if isinstance(obj, shapely.Geometry):
+        return orjson.Fragment(shapely.to_geojson(obj))
+    if obj is pd.NaT or obj is pd.NA:
+        return None
+    raise TypeError
@@ -1,21 +1,21 @@
+import numpy as np
 import geopandas as gpd
 import shapely
 import pandas as pd
 import json
 import shapely.wkt
-import networkx as nx
-import networkit as nk
 
-from scipy import spatial
 from .errors import ImplementationError
 from .base_method import BaseMethod
+from .distance_matrix import get_reachable_nodes, get_sparse_distance_matrix
 
 
 class AccessibilityIsochrones(BaseMethod):
     def __init__(self, city_model):
         BaseMethod.__init__(self, city_model)
         super().validation("mobility_analysis")
-        self.mobility_graph = self.city_model.MobilityGraph.copy()
+        self.mobility_graph = self.city_model.MobilityGraph
+        self.mode_graphs = self.city_model.mode_graphs
         self.walk_speed = 4 * 1000 / 60
         self.edge_types = {
             "public_transport": ["subway", "bus", "tram", "trolleybus", "walk"],
@@ -30,41 +30,32 @@ class AccessibilityIsochrones(BaseMethod):
     
     def get_accessibility_isochrone(self, travel_type, x_from, y_from, weight_value, weight_type, routes=False):
         
-        mobility_graph = self.mobility_graph.edge_subgraph(
-            [(u, v, k) for u, v, k, d in self.mobility_graph.edges(data=True, keys=True) 
-            if d["type"] in self.edge_types[travel_type]]
-            )
-        nodes_data = pd.DataFrame.from_records(
-            [d for u, d in mobility_graph.nodes(data=True)], index=list(mobility_graph.nodes())
-            ).sort_index()
-
-        distance, start_node = spatial.KDTree(nodes_data[["x", "y"]]).query([x_from, y_from])
-        start_node = nodes_data.iloc[start_node].name
+        mode_graph = self.mode_graphs[travel_type]
+        distance, start_node = mode_graph.snap_index.query([x_from, y_from])
+        distance, start_node = distance[0], start_node[0]
         margin_weight = distance / self.walk_speed if weight_type == "time_min" else distance
         weight_value_remain = weight_value - margin_weight
 
-        weights_sum = nx.single_source_dijkstra_path_length(
-            mobility_graph, start_node, cutoff=weight_value_remain, weight=weight_type)
-        nodes_data = nodes_data.loc[list(weights_sum.keys())].reset_index()
-        nodes_data = gpd.GeoDataFrame(nodes_data, crs=self.city_crs)
+        nodes, weights_sum = get_reachable_nodes(mode_graph.csr[weight_type], start_node, weight_value_remain)
+        points = shapely.points(mode_graph.snap_index.coords[nodes])
 
         if travel_type == "public_transport" and weight_type == "time_min":
             # 0.8 is routes curvature coefficient 
-            distance = dict((k, (weight_value_remain - v) * self.walk_speed * 0.8) for k, v in weights_sum.items())
-            nodes_data["left_distance"] = distance.values()
-            isochrone_geom = nodes_data["geometry"].buffer(nodes_data["left_distance"])
-            isochrone_geom = isochrone_geom.unary_union
+            left_distance = (weight_value_remain - weights_sum) * self.walk_speed * 0.8
+            isochrone_geom = shapely.union_all(shapely.buffer(points, left_distance, quad_segs=16))
         
         else:
-            distance = dict((k, (weight_value_remain - v)) for k, v in weights_sum.items())
-            nodes_data["left_distance"] = distance.values()
-            isochrone_geom = shapely.geometry.MultiPoint(nodes_data["geometry"].tolist()).convex_hull
+            isochrone_geom = shapely.convex_hull(shapely.multipoints(points))
 
         isochrone = gpd.GeoDataFrame(
                 {"travel_type": [self.travel_names[travel_type]], "weight_type": [weight_type], 
                 "weight_value": [weight_value], "geometry": [isochrone_geom]}).set_crs(self.city_crs).to_crs(4326)
  
-        routes, stops = self._get_routes(nodes_data, travel_type, weight_type) if routes else (None, None)
+        if routes:
+            nodes_data = mode_graph.nodes.iloc[nodes].rename(columns={"nodeID": "index"}).reset_index(drop=True)
+            routes, stops = self._get_routes(nodes_data, travel_type, weight_type)
+        else:
+            routes, stops = None, None
         return {"isochrone": json.loads(isochrone.to_json()), "routes": routes, "stops": stops}
 
 
@@ -104,9 +95,8 @@ class AccessibilityIsochrones_v2(BaseMethod):
     def __init__(self, city_model):
         BaseMethod.__init__(self, city_model)
         super().validation("mobility_analysis")
-        self.mobility_graph = self.city_model.MobilityGraph.copy()
-        self.graph_nk_time =  self.city_model.graph_nk_time
-        self.graph_nk_length = self.city_model.graph_nk_length
+        self.mobility_graph = self.city_model.MobilityGraph
+        self.mode_graphs = self.city_model.mode_graphs
         self.walk_speed = 4 * 1000 / 60
         self.edge_types = {
             "public_transport": ["subway", "bus", "tram", "trolleybus", "walk"],
@@ -121,64 +111,56 @@ class AccessibilityIsochrones_v2(BaseMethod):
 
     def get_isochrone(self, travel_type, x_from:list, y_from:list, weight_value:int, weight_type, routes=False):
 
-        def _get_nk_distances(nk_dists, loc):
-            target_nodes = loc.index.astype('int')
-            source_node = loc.name
-            distances = [nk_dists.getDistance(source_node, node) for node in target_nodes]
-            return pd.Series(data = distances, index = target_nodes)
-        
-        source = pd.DataFrame(data = list(zip(range(len(x_from)), x_from, y_from)), columns = ['id', 'x', 'y'])
-        source = gpd.GeoDataFrame(source, geometry = gpd.points_from_xy(source['x'], source['y'], crs=self.city_crs))
-        
-        mobility_graph = self.mobility_graph.edge_subgraph(
-            [(u, v, k) for u, v, k, d in self.mobility_graph.edges(data=True, keys=True) 
-            if d["type"] in self.edge_types[travel_type]
-            ])
-
-        mobility_graph = nx.convert_node_labels_to_integers(mobility_graph)
-        graph_df = pd.DataFrame.from_dict(dict(mobility_graph.nodes(data=True)), orient='index')
-        graph_gdf = gpd.GeoDataFrame(graph_df, geometry = gpd.points_from_xy(graph_df['x'], graph_df['y'])).set_crs(self.city_crs)
-
-        from_services = graph_gdf['geometry'].sindex.nearest(source['geometry'], return_distance = True, return_all = False)
-
-        distances = pd.DataFrame(0, index = from_services[0][1], columns = list(mobility_graph.nodes()))
-        
-        if weight_type == 'time_min':
-            nk_graph = self.graph_nk_time
-        elif weight_type == 'length_meter':
-            nk_graph = self.graph_nk_length
-
-        nk_dists = nk.distance.SPSP(G = nk_graph, sources = distances.index.values).run()
-        distances =  distances.apply(lambda x:_get_nk_distances(nk_dists, x), axis = 1)
+        # nodes are indexed by ids of the csr graphs
+        mode_graph = self.mode_graphs[travel_type]
+        source_dist, source_nodes = mode_graph.snap_index.query(np.column_stack([x_from, y_from]))
+        source_weight = source_dist / self.walk_speed if weight_type == 'time_min' else source_dist
 
-        dist_nearest = pd.DataFrame(data = from_services[1], index = from_services[0][1], columns = ['dist'])
-
-        dist_nearest = dist_nearest / self.walk_speed if weight_type == 'time_min' else dist_nearest
-        distances = distances.add(dist_nearest.dist, axis = 0)
-        
-        cols = distances.columns.to_numpy()
-        source['isochrone_nodes'] = [cols[x].tolist() for x in distances.le(weight_value).to_numpy()]
-
-        for x, y in list(zip(from_services[0][1], source['isochrone_nodes'])):
-            y.extend([x])
-        
-        source['isochrone_geometry'] = source['isochrone_nodes'].apply(lambda x: [graph_gdf['geometry'].loc[[y for y in x]]])
-        source['isochrone_geometry'] = [list(x[0].geometry) for x in source['isochrone_geometry']]
-        source['isochrone_geometry'] = [[y.buffer(.01) for y in x] for x in source['isochrone_geometry']]
-        source['isochrone_geometry'] = source['isochrone_geometry'].apply(lambda x: shapely.ops.cascaded_union(x).convex_hull)
-        source['isochrone_geometry'] = gpd.GeoSeries(source['isochrone_geometry'], crs=self.city_crs)
-
-        isochrones = [gpd.GeoDataFrame(
-                {"travel_type": [self.travel_names[travel_type]], "weight_type": [weight_type], 
-                "weight_value": [weight_value], "geometry": [x]}, geometry = [x], crs = self.city_crs).to_crs(4326) 
-                for x in source['isochrone_geometry']]
+        geometries, isochrone_nodes = self._get_isochrones(
+            mode_graph, source_nodes, source_weight, weight_type, weight_value, return_nodes=routes
+            )
+        isochrones = gpd.GeoDataFrame(
+                {"travel_type": self.travel_names[travel_type], "weight_type": weight_type, 
+                "weight_value": weight_value}, index=range(len(geometries)), geometry=geometries, crs=self.city_crs
+                ).to_crs(4326)
 
-        isochrones = pd.concat([x for x in isochrones])
-        
-        stops, routes = self.get_routes(graph_gdf, source['isochrone_nodes'], travel_type, weight_type) if routes else ([None], [None])
+        graph_gdf = mode_graph.nodes
+        stops, routes = self.get_routes(graph_gdf, isochrone_nodes, travel_type, weight_type) if routes else ([None], [None])
         
         return {"isochrone": json.loads(isochrones.to_json()), "routes": routes, "stops": stops}
 
+    @staticmethod
+    def _get_isochrones(mode_graph, source_nodes, source_weight, weight_type, weight_value, 
+                        return_nodes=False, batch_size=512):
+        """
+        Builds isochrones of many sources batch by batch. Searches are bounded by weight_value and
+        run in the distance matrix pool, only reached nodes are kept, so memory does not depend 
+        on the number of sources.
+        """
+
+        geometries, isochrone_nodes = [], []
+        coords = mode_graph.snap_index.coords
+        for start in range(0, len(source_nodes), batch_size):
+            nodes = source_nodes[start:start + batch_size]
+            distances = get_sparse_distance_matrix(
+                mode_graph.csr[weight_type], nodes, np.arange(len(coords)), cutoff=weight_value, chunk_size=8
+                ).tocoo()
+            reached = distances.data + source_weight[start:start + batch_size][distances.row] <= weight_value
+
+            # the nearest node of a source always belongs to its isochrone
+            rows = np.r_[distances.row[reached], np.arange(len(nodes))]
+            cols = np.r_[distances.col[reached], nodes]
+            order = np.argsort(rows, kind="stable")
+            rows, cols = rows[order], cols[order]
+
+            points = shapely.multipoints(shapely.points(coords[cols]), indices=rows)
+            geometries.extend(shapely.buffer(shapely.convex_hull(points), .01))
+            if return_nodes:
+                bounds = np.searchsorted(rows, np.arange(len(nodes) + 1))
+                isochrone_nodes.extend(np.unique(cols[i:j]).tolist() for i, j in zip(bounds[:-1], bounds[1:]))
+
+        return geometries, isochrone_nodes
+
     def get_routes(self, graph_gdf, selected_nodes, travel_type, weight_type):
         
         if travel_type == 'public_transport' and weight_type == 'time_min':
@@ -187,7 +169,7 @@ class AccessibilityIsochrones_v2(BaseMethod):
                     lambda x: pd.Series({t: True for t in x.split(", ")}
                     ), type).fillna(False)
             stops = stops.join(stop_types)
-            stops_result = [stops.loc[stops['nodeID'].isin(x)].to_crs(4326) for x in selected_nodes]
+            stops_result = [stops.loc[stops.index.isin(x)].to_crs(4326) for x in selected_nodes]
             
             nodes = [x['nodeID'] for x in stops_result]
             subgraph = [self.mobility_graph.subgraph(x) for x in nodes]
@@ -0,0 +1,47 @@
+import threading
+
+from contextlib import contextmanager
+
+# Progress of a calculation running in the current thread. A callback receives the done share
+# (0..1) and a message; iterate calls are nested, so a loop inside an iteration of an outer
+# loop reports progress within the share of that iteration. Without a callback nothing is done.
+_state = threading.local()
+
+
+@contextmanager
+def progress_callback(callback):
+    _state.callback = callback
+    _state.segments = [(0., 1.)]
+    try:
+        yield
+    finally:
+        _state.callback = None
+        _state.segments = None
+
+
+def report(done: float, message: str = None) -> None:
+    callback = getattr(_state, "callback", None)
+    if callback is not None:
+        start, width = _state.segments[-1]
+        callback(start + width * min(max(done, 0.), 1.), message)
+
+
+def iterate(items, name: str = None):
+    """
+    Yields items and reports the share of done items before each of them.
+    """
+
+    items = list(items)
+    if getattr(_state, "callback", None) is None:
+        yield from items
+        return
+
+    start, width = _state.segments[-1]
+    for i, item in enumerate(items):
+        report(i / len(items), f"{name}: {item}" if name else str(item))
+        _state.segments.append((start + width * i / len(items), width / len(items)))
+        try:
+            yield item
+        finally:
+            _state.segments.pop()
+    report(1., name)
@@ -0,0 +1,172 @@
+import os
+import json
+import shutil
+import hashlib
+import uuid
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+from pyarrow import feather
+from scipy import sparse
+
+# Local content-addressed store of precalculated results. Every entry is a directory named by
+# the hash of its key: tables are written as uncompressed Arrow IPC (feather) files and matrices
+# as .npy arrays that are memory-mapped on read. Least recently used entries are evicted
+# once the directory grows over the size limit.
+CACHE_DIR = os.environ.get("PROVISION_CACHE_DIR", os.path.join(os.getcwd(), "cache", "provisions"))
+CACHE_SIZE = float(os.environ.get("PROVISION_CACHE_SIZE_GB", 20)) * 1024 ** 3
+# part of every key, bump it when calculations change results for the same inputs
+CACHE_VERSION = 2
+
+
+class ProvisionCache:
+
+    def __init__(self, cache_dir: str = CACHE_DIR, max_size: float = CACHE_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        return hashlib.sha1(json.dumps([str(part) for part in (CACHE_VERSION, *parts)]).encode()).hexdigest()
+
+    @staticmethod
+    def hash_data(*objects) -> str:
+        """
+        Hashes content of DataFrames, GeoDataFrames, arrays and scalars. Use it to get a data
+        version of the inputs a result depends on.
+        """
+
+        digest = hashlib.sha1()
+        for obj in objects:
+            if isinstance(obj, (pd.DataFrame, pd.Series)):
+                if isinstance(obj, gpd.GeoDataFrame):
+                    digest.update(np.asarray(obj.geometry.to_wkb()).astype(bytes).tobytes())
+                    obj = obj.drop(columns=obj.geometry.name)
+                columns = obj.columns if isinstance(obj, pd.DataFrame) else [obj.name]
+                digest.update(json.dumps([str(c) for c in columns]).encode())
+                digest.update(pd.util.hash_pandas_object(obj, index=True).values.tobytes())
+            elif isinstance(obj, np.ndarray):
+                digest.update(np.ascontiguousarray(obj).tobytes())
+            else:
+                digest.update(str(obj).encode())
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        """
+        Returns a dict of cached tables and matrices or None if the key is not in the cache.
+        """
+
+        path = os.path.join(self.cache_dir, key)
+        meta_path = os.path.join(path, "meta.json")
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            result = {name: self._read_table(path, name, index) for name, index in meta["tables"].items()}
+            result.update({name: self._read_matrix(path, name, kind) for name, kind in meta["matrices"].items()})
+            os.utime(meta_path)
+        except (FileNotFoundError, KeyError, ValueError, OSError):
+            return None
+        return result
+
+    def contains(self, key: str) -> bool:
+        return os.path.exists(os.path.join(self.cache_dir, key, "meta.json"))
+
+    def put(self, key: str, tables: dict = None, matrices: dict = None) -> None:
+        """
+        Stores tables (DataFrame or GeoDataFrame) and matrices (np.ndarray, DataFrame
+        or scipy.sparse matrix) under the key and evicts least recently used entries.
+        """
+
+        tables, matrices = tables or {}, matrices or {}
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = os.path.join(self.cache_dir, key)
+        tmp_path = os.path.join(self.cache_dir, f".{key}.{uuid.uuid4().hex}")
+        os.makedirs(tmp_path)
+        try:
+            meta = {"tables": {}, "matrices": {}}
+            for name, table in tables.items():
+                meta["tables"][name] = self._write_table(tmp_path, name, table)
+            for name, matrix in matrices.items():
+                meta["matrices"][name] = self._write_matrix(tmp_path, name, matrix)
+            with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+                json.dump(meta, f)
+            shutil.rmtree(path, ignore_errors=True)
+            os.rename(tmp_path, path)
+        except OSError:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        self._evict(keep=key)
+
+    def clear(self) -> None:
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    @staticmethod
+    def _write_table(path, name, table):
+        index_names = [x if x is not None else f"__index_level_{i}__" for i, x in enumerate(table.index.names)]
+        table = table.rename_axis(index_names).reset_index()
+        table.columns = table.columns.astype(str)
+        table.to_feather(os.path.join(path, f"{name}.feather"), compression="uncompressed")
+        return index_names
+
+    @staticmethod
+    def _read_table(path, name, index_names):
+        file_path = os.path.join(path, f"{name}.feather")
+        try:
+            table = gpd.read_feather(file_path, memory_map=True)
+        except ValueError:
+            table = feather.read_table(file_path, memory_map=True).to_pandas()
+        table = table.set_index(index_names)
+        return table.rename_axis([None if x.startswith("__index_level_") else x for x in index_names])
+
+    @staticmethod
+    def _write_matrix(path, name, matrix):
+        if sparse.issparse(matrix):
+            matrix = sparse.csr_matrix(matrix)
+            arrays = {"data": matrix.data, "indices": matrix.indices, "indptr": matrix.indptr,
+                      "shape": np.array(matrix.shape)}
+            kind = "csr"
+        elif isinstance(matrix, pd.DataFrame):
+            arrays = {"data": matrix.to_numpy(), "index": matrix.index.to_numpy(), "columns": matrix.columns.to_numpy()}
+            kind = "frame"
+        else:
+            arrays = {"data": np.asarray(matrix)}
+            kind = "array"
+        for array_name, array in arrays.items():
+            np.save(os.path.join(path, f"{name}.{array_name}.npy"), array, allow_pickle=False)
+        return kind
+
+    @staticmethod
+    def _read_matrix(path, name, kind):
+        # copy-on-write mapping, so callers may modify results without touching the cache
+        def load(array_name):
+            return np.load(os.path.join(path, f"{name}.{array_name}.npy"), mmap_mode="c")
+
+        if kind == "csr":
+            return sparse.csr_matrix((load("data"), load("indices"), load("indptr")), shape=tuple(load("shape")))
+        elif kind == "frame":
+            return pd.DataFrame(load("data"), index=np.asarray(load("index")), columns=np.asarray(load("columns")))
+        return load("data")
+
+    def _evict(self, keep):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_dir() or entry.name.startswith("."):
+                continue
+            try:
+                size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                used = os.stat(os.path.join(entry.path, "meta.json")).st_mtime
+            except OSError:
+                continue
+            entries.append((used, size, entry.path, entry.name))
+
+        total = sum(size for _, size, _, _ in entries)
+        for _, size, path, name in sorted(entries):
+            if total <= self.max_size:
+                break
+            if name != keep:
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+
+
+provision_cache = ProvisionCache()
@@ -0,0 +1,228 @@
+import time
+import numpy as np
+
+from scipy import optimize, sparse
+
+# networkit returns the largest double as a distance between disconnected nodes
+UNREACHABLE = np.finfo(np.float64).max
+
+
+def gravity_provision(cost_matrix, capacity, demand, selection_range):
+    """
+    Distributes capacity of services among demand of buildings with the gravity model.
+
+    This is an array counterpart of CityProvision._provision_loop_gravity. On every step
+    each service draws int(capacity_left) visitors among buildings within selection_range
+    with probabilities proportional to demand_left / cost, the drawn flows are balanced
+    to int(demand_left) of each building and the range is doubled. As in the original loop,
+    every draw is made by a generator seeded with 0, so all services and buildings share
+    one sequence of uniform samples and results are the same as per-row sampling.
+
+    Parameters
+    ----------
+    cost_matrix: np.ndarray or scipy.sparse matrix
+        Services x buildings travel costs (distance + 1). Non-finite values and
+        missing entries of a sparse matrix are treated as unreachable pairs.
+    capacity: array-like
+        Capacity of services (rows of cost_matrix).
+    demand: array-like
+        Demand of buildings (columns of cost_matrix).
+    selection_range: float
+        Initial range within which buildings are chosen.
+
+    Returns
+    -------
+    np.ndarray or scipy.sparse.csr_matrix
+        Services x buildings matrix of distributed demand of the same kind as cost_matrix.
+    """
+
+    is_sparse = sparse.issparse(cost_matrix)
+    if is_sparse:
+        cost_matrix = sparse.csr_matrix(cost_matrix)
+        cost_matrix.sort_indices()
+        cost_matrix = cost_matrix.tocoo()
+        reachable = np.isfinite(cost_matrix.data) & (cost_matrix.data < UNREACHABLE)
+        pair_rows = cost_matrix.row[reachable]
+        pair_cols = cost_matrix.col[reachable]
+        pair_costs = cost_matrix.data[reachable]
+        max_cost = pair_costs.max(initial=0)
+        pair_flows = np.zeros(len(pair_costs))
+    else:
+        cost_matrix = np.asarray(cost_matrix, dtype=np.float64)
+        max_cost = np.max(cost_matrix, where=cost_matrix < UNREACHABLE, initial=0)
+        destination = np.zeros(cost_matrix.shape)
+
+    capacity_left = np.nan_to_num(np.asarray(capacity, dtype=np.float64))
+    demand_left = np.nan_to_num(np.asarray(demand, dtype=np.float64))
+    max_draws = int(max(capacity_left.max(initial=0), demand_left.max(initial=0)))
+    uniform = np.random.default_rng(seed=0).random(max_draws)
+
+    while (capacity_left != 0).any() and (demand_left != 0).any():
+        row_active, col_active = capacity_left != 0, demand_left != 0
+        if is_sparse:
+            within = np.flatnonzero(
+                (pair_costs <= selection_range) & row_active[pair_rows] & col_active[pair_cols])
+            rows, cols, costs = pair_rows[within], pair_cols[within], pair_costs[within]
+        else:
+            mask = cost_matrix <= selection_range
+            mask &= row_active[:, None]
+            mask &= col_active[None, :]
+            rows, cols = np.nonzero(mask)
+            costs = cost_matrix[rows, cols]
+            del mask
+
+        flows = _draw_by_groups(rows, demand_left[cols] / costs, capacity_left, uniform)
+        drawn = np.flatnonzero(flows)
+        by_building = drawn[np.argsort(cols[drawn], kind="stable")]
+        balanced = _draw_by_groups(cols[by_building], flows[by_building], demand_left, uniform)
+        flows[by_building] = np.minimum(flows[by_building], balanced)
+
+        if is_sparse:
+            pair_flows[within] += flows
+        else:
+            destination[rows, cols] += flows
+        capacity_left -= np.bincount(rows, flows, minlength=len(capacity_left))
+        demand_left -= np.bincount(cols, flows, minlength=len(demand_left))
+
+        # Unlike the recursive loop, stop once every reachable pair is in range and nothing moves,
+        # e.g. when the remaining capacity or demand is fractional or unreachable.
+        if selection_range >= max_cost and not flows.any():
+            break
+        selection_range = min(selection_range + selection_range, max_cost)
+
+    if is_sparse:
+        assigned = pair_flows > 0
+        return sparse.csr_matrix(
+            (pair_flows[assigned], (pair_rows[assigned], pair_cols[assigned])), shape=cost_matrix.shape)
+    return destination
+
+
+def linear_provision(distance_matrix, capacity, demand, selection_range, timings=None):
+    """
+    Distributes capacity of services among demand of buildings by linear programming.
+
+    This is a sparse counterpart of CityProvision._provision_loop_linear. On every step
+    flows between services and buildings within selection_range are found as a transportation
+    problem maximizing the sum of flows weighted by 1 / (distance + 1), with capacity_left
+    and demand_left as supplies and demands, and the range is doubled. The problem is built
+    only from in-range pairs of services and buildings which are not exhausted and solved
+    by HiGHS. Supplies and demands are rounded down, so flows are integer as in the original
+    integer program.
+
+    Parameters
+    ----------
+    distance_matrix: np.ndarray or scipy.sparse matrix
+        Services x buildings distances. Non-finite values and missing entries
+        of a sparse matrix are treated as unreachable pairs.
+    capacity: array-like
+        Capacity of services (rows of distance_matrix).
+    demand: array-like
+        Demand of buildings (columns of distance_matrix).
+    selection_range: float
+        Initial range within which buildings are chosen.
+    timings: dict, optional
+        Filled with total "build" and "solve" times of all steps in seconds.
+
+    Returns
+    -------
+    np.ndarray or scipy.sparse.csr_matrix
+        Services x buildings matrix of distributed demand of the same kind as distance_matrix.
+    """
+
+    is_sparse = sparse.issparse(distance_matrix)
+    if is_sparse:
+        distance_matrix = sparse.coo_matrix(distance_matrix)
+        pair_rows, pair_cols, pair_distances = distance_matrix.row, distance_matrix.col, distance_matrix.data
+    else:
+        distance_matrix = np.asarray(distance_matrix, dtype=np.float64)
+        pair_rows, pair_cols = np.nonzero(np.isfinite(distance_matrix))
+        pair_distances = distance_matrix[pair_rows, pair_cols]
+    reachable = np.isfinite(pair_distances) & (pair_distances < UNREACHABLE)
+    pair_rows, pair_cols, pair_distances = pair_rows[reachable], pair_cols[reachable], pair_distances[reachable]
+    max_distance = pair_distances.max(initial=0)
+    pair_flows = np.zeros(len(pair_distances))
+
+    capacity_left = np.floor(np.nan_to_num(np.asarray(capacity, dtype=np.float64)))
+    demand_left = np.floor(np.nan_to_num(np.asarray(demand, dtype=np.float64)))
+    timings = {} if timings is None else timings
+    timings.update(build=0., solve=0.)
+
+    while (capacity_left > 0).any() and (demand_left > 0).any():
+        started_at = time.perf_counter()
+        within = np.flatnonzero(
+            (pair_distances <= selection_range) & (capacity_left[pair_rows] > 0) & (demand_left[pair_cols] > 0))
+        rows, row_ids = np.unique(pair_rows[within], return_inverse=True)
+        cols, col_ids = np.unique(pair_cols[within], return_inverse=True)
+        # one constraint per service and per building, one variable per pair
+        constraints = sparse.csr_matrix(
+            (np.ones(2 * len(within)), (np.r_[row_ids, len(rows) + col_ids], np.r_[np.arange(len(within)), np.arange(len(within))])),
+            shape=(len(rows) + len(cols), len(within)))
+        bounds = np.r_[capacity_left[rows], demand_left[cols]]
+        weights = -1 / (pair_distances[within] + 1)
+        timings["build"] += time.perf_counter() - started_at
+
+        flows = np.zeros(len(within))
+        if len(within) > 0:
+            started_at = time.perf_counter()
+            result = optimize.linprog(weights, A_ub=constraints, b_ub=bounds, bounds=(0, None), method="highs")
+            timings["solve"] += time.perf_counter() - started_at
+            if not result.success:
+                raise ValueError(f"Linear provision is not solved: {result.message}")
+            flows = np.round(result.x)
+
+        pair_flows[within] += flows
+        capacity_left -= np.bincount(pair_rows[within], flows, minlength=len(capacity_left))
+        demand_left -= np.bincount(pair_cols[within], flows, minlength=len(demand_left))
+
+        if selection_range >= max_distance and not flows.any():
+            break
+        selection_range = min(selection_range + selection_range, max_distance)
+
+    assigned = pair_flows > 0
+    if is_sparse:
+        return sparse.csr_matrix(
+            (pair_flows[assigned], (pair_rows[assigned], pair_cols[assigned])), shape=distance_matrix.shape)
+    destination = np.zeros(distance_matrix.shape)
+    destination[pair_rows[assigned], pair_cols[assigned]] = pair_flows[assigned]
+    return destination
+
+
+def _draw_by_groups(groups, weights, draws, uniform):
+    """
+    Batched np.random.Generator.choice with replacement for many groups of items.
+
+    Items must be sorted by group. For each group g int(draws[g]) items are drawn with
+    probabilities proportional to their weights using the first samples of uniform,
+    which equals a separate choice call with a freshly seeded generator per group.
+    Returns the number of times each item was drawn.
+    """
+
+    counts = np.zeros(len(groups))
+    if len(groups) == 0:
+        return counts
+
+    totals = np.bincount(groups, weights, minlength=len(draws))
+    n_draws = np.floor(draws).astype(np.int64)
+    valid = (totals > 0) & (n_draws > 0)
+    take = np.flatnonzero(valid[groups])
+    if len(take) == 0:
+        return counts
+
+    groups, weights = groups[take], weights[take] / totals[groups[take]]
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    ends = np.r_[starts[1:], len(groups)] - 1
+
+    cumulative = np.cumsum(weights)
+    sizes = np.diff(np.r_[starts, len(groups)])
+    cumulative -= np.repeat(cumulative[starts] - weights[starts], sizes)
+    cumulative /= np.repeat(cumulative[ends], sizes)
+    cumulative += np.repeat(np.arange(len(starts)), sizes)
+
+    group_draws = n_draws[groups[starts]]
+    draw_group = np.repeat(np.arange(len(starts)), group_draws)
+    draw_order = np.arange(len(draw_group)) - np.repeat(np.cumsum(group_draws) - group_draws, group_draws)
+    hits = np.searchsorted(cumulative, draw_group + uniform[draw_order], side="right")
+    hits = np.minimum(hits, ends[draw_group])
+
+    counts[take] = np.bincount(hits, minlength=len(take))
+    return counts
@@ -1,7 +1,10 @@
 import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
 import json
 
-from .utils import nk_routes_between_two_points
+from .distance_matrix import get_paths_to_targets
 from .errors import TerritorialSelectError
 from .base_method import BaseMethod
 
@@ -14,10 +17,10 @@ class TrafficCalculator(BaseMethod):
         super().validation("traffic_calculator")
         self.stops = self.city_model.PublicTransportStops.copy()
         self.buildings = self.city_model.Buildings.copy()
-        self.mobility_graph = self.city_model.graph_nk_length
-        self.mobility_graph_attrs = self.city_model.nk_attrs.copy()
+        self.csr_graph = self.city_model.mode_graphs["public_transport"].csr["length_meter"]
+        self.snap_index = self.city_model.mode_graphs["public_transport"].snap_index
 
-    def get_trafic_calculation(self, request_area_geojson):
+    def get_trafic_calculation(self, request_area_geojson, exact_geometry=False, edge_flows=False):
 
         living_buildings = self.buildings[self.buildings['population'] > 0]
         living_buildings = living_buildings.loc[:, ('id', 'population', 'geometry')]
@@ -27,13 +30,10 @@ class TrafficCalculator(BaseMethod):
             raise TerritorialSelectError("living buildings")
         
         stops = self.stops.set_index("id")
-        selected_buildings.loc[:, 'nearest_stop_id'] = selected_buildings.apply(
-            lambda x: stops.loc[:, 'geometry'].distance(x['geometry']).idxmin(), axis=1)
+        selected_buildings.loc[:, 'nearest_stop_id'] = self._get_nearest_stops(selected_buildings, stops)
         nearest_stops = stops.loc[list(selected_buildings.loc[:, 'nearest_stop_id'])]
-        path_info = selected_buildings.apply(
-            lambda x: nk_routes_between_two_points(self.mobility_graph, self.mobility_graph_attrs,
-            p1 = x['geometry'].centroid.coords[0], p2 = stops.loc[x['nearest_stop_id']].geometry.coords[0]), 
-            result_type="expand", axis=1)
+        path_info, paths = self._get_routes(
+            selected_buildings, nearest_stops, exact_geometry or edge_flows, exact_geometry)
         house_stop_routes = selected_buildings.copy().drop(["geometry"], axis=1).join(path_info)
 
         # 30% aprox value of Public transport users
@@ -42,6 +42,76 @@ class TrafficCalculator(BaseMethod):
             columns={'population': 'route_traffic', 'id': 'building_id', "route_geometry": "geometry"})
         house_stop_routes = gpd.GeoDataFrame(house_stop_routes, crs=selected_buildings.crs)
 
-        return {"buildings": json.loads(selected_buildings.reset_index(drop=True).to_crs(4326).to_json()), 
-                "stops": json.loads(nearest_stops.reset_index(drop=True).to_crs(4326).to_json()), 
-                "routes": json.loads(house_stop_routes.reset_index(drop=True).to_crs(4326).to_json())}
\ No newline at end of file
+        result = {"buildings": json.loads(selected_buildings.reset_index(drop=True).to_crs(4326).to_json()), 
+                  "stops": json.loads(nearest_stops.reset_index(drop=True).to_crs(4326).to_json())}
+        if edge_flows:
+            # traffic of routes is summed on graph edges instead of returning a route per building
+            edges = self._get_edge_flows(paths, house_stop_routes['route_traffic'].to_numpy())
+            result.update({"routes": None, "edges": json.loads(edges.to_crs(4326).to_json())})
+        else:
+            result["routes"] = json.loads(house_stop_routes.reset_index(drop=True).to_crs(4326).to_json())
+        return result
+
+    @staticmethod
+    def _get_nearest_stops(buildings, stops):
+        # the first of equidistant stops is taken, as idxmin of distances does
+        buildings_positions, stops_positions = shapely.STRtree(stops.geometry.values).query_nearest(
+            buildings.geometry.values, all_matches=True)
+        order = np.lexsort((stops_positions, buildings_positions))
+        _, first = np.unique(buildings_positions[order], return_index=True)
+        return stops.index[stops_positions[order][first]]
+
+    def _get_routes(self, buildings, nearest_stops, return_paths=False, exact_geometry=False):
+        """
+        Routes from buildings centroids to their nearest stops. Buildings are snapped to the graph at once
+        and one shortest path tree is built per stop for all buildings that go to it.
+        """
+
+        centroids = shapely.get_coordinates(buildings.geometry.centroid.values)
+        stops_coords = shapely.get_coordinates(nearest_stops.geometry.values)
+        buildings_distance, buildings_nodes = self.snap_index.query(centroids)
+        stops_distance, stops_nodes = self.snap_index.query(stops_coords)
+        distances, paths = get_paths_to_targets(self.csr_graph, buildings_nodes, stops_nodes, return_paths)
+        route_len = (distances + buildings_distance + stops_distance).round(2)
+
+        if exact_geometry:
+            # building centroid, nodes of the path and the stop, unreachable stops are joined by straight lines
+            positions, starts, _ = paths
+            routes = np.arange(len(buildings))
+            reachable = np.flatnonzero(np.isfinite(distances))
+            lines = np.r_[routes, positions, reachable, routes]
+            parts = np.repeat([0, 1, 2, 3], [len(routes), len(positions), len(reachable), len(routes)])
+            coords = np.concatenate([centroids, self.snap_index.coords[starts], 
+                                     self.snap_index.coords[stops_nodes[reachable]], stops_coords])
+            order = np.lexsort((parts, lines))
+            route_geometry = shapely.linestrings(coords[order], indices=lines[order])
+        else:
+            route_geometry = shapely.linestrings(np.stack([centroids, stops_coords], axis=1))
+        routes = pd.DataFrame({"route_geometry": route_geometry, "route_len": np.where(np.isfinite(route_len), route_len, np.nan)}, 
+                              index=buildings.index)
+        return routes, paths
+
+    def _get_edge_flows(self, paths, route_traffic):
+        """
+        Sums traffic of routes over graph edges in both directions and returns one feature per loaded edge.
+        """
+
+        positions, starts, ends = paths
+        flows = pd.DataFrame({"u": np.minimum(starts, ends), "v": np.maximum(starts, ends), 
+                              "route_traffic": route_traffic[positions]})
+        flows = flows.groupby(["u", "v"], as_index=False)["route_traffic"].sum()
+        flows = flows[flows["route_traffic"] > 0]
+
+        # the shortest of parallel edges is the one the routes go along
+        graph = self.city_model.mode_graphs["public_transport"].nx_graph
+        labels = self.snap_index.labels
+        edges = []
+        for u, v in zip(labels[flows["u"]], labels[flows["v"]]):
+            data = graph.get_edge_data(u, v) or graph.get_edge_data(v, u)
+            edges.append(min(data.values(), key=lambda x: x["length_meter"]))
+        edges = pd.DataFrame.from_records(edges, columns=["type", "length_meter", "geometry"])
+
+        flows = flows.assign(u=labels[flows["u"]], v=labels[flows["v"]], type=edges["type"].values, 
+                             length_meter=edges["length_meter"].values)
+        return gpd.GeoDataFrame(flows.reset_index(drop=True), geometry=gpd.GeoSeries.from_wkt(edges["geometry"]).values, 
+                                crs=self.city_crs)
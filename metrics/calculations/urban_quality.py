@@ -2,14 +2,13 @@ import geopandas as gpd
 import pandas as pd
 import json
 import numpy as np
-import networkx as nx
 import os
 import io
 import requests
 
-from .utils import get_links
 from .base_method import BaseMethod
 from .city_provision import CityProvision
+from . import progress
 
 class UrbanQuality(BaseMethod):
 
@@ -45,7 +44,7 @@ class UrbanQuality(BaseMethod):
         'shopping_centers', 'cinemas', 'swimming_pools', 'saunas', 'sport_centers', 'bars', 'bakeries', 'cafes', 'restaurants',
         'fastfoods', 'visa_centers', 'bookmaker_offices', 'limousine_rental', 'spas', 'art_spaces', 'aquaparks',
         'scooter_rental', 'art_gallery', 'circus', 'sport_clubs', 'pet_market']
-        self.drive_graph = nx.Graph(((u, v, e) for u,v,e in city_model.MobilityGraph.edges(data=True) if e['type'] == 'car'))
+        self.drive_links = city_model.mode_graphs["drive"].links
 
     @staticmethod
     def _ind_ranking(data_series):
@@ -154,7 +153,7 @@ class UrbanQuality(BaseMethod):
         local_blocks = self.blocks.copy()
         local_services = self.services.copy()
         local_services = local_services[local_services['service_code'].isin(self.street_services)]
-        drive_links = get_links(self.drive_graph, self.city_crs)
+        drive_links = self.drive_links.copy()
 
         drive_links['geometry'] = drive_links.geometry.buffer(40)
         drive_links['link_id'] = drive_links.index
@@ -376,26 +375,13 @@ class UrbanQuality(BaseMethod):
 
         urban_quality = self.blocks.copy().to_crs(4326)
 
-        urban_quality['ind1'], urban_quality['data_ind1'] = self._ind1()
-        urban_quality['ind2'], urban_quality['data_ind2'] = self._ind2()
-        urban_quality['ind4'], urban_quality['data_ind4'] = self._ind4()
-        urban_quality['ind5'], urban_quality['data_ind5'] = self._ind5()
-        urban_quality['ind10'], urban_quality['data_ind10'] = self._ind10()
-        #urban_quality['ind11'], urban_quality['data_ind11'] = self._ind_11() #too long >15 min
-        #self.provision = self._collect_provision('recreational_areas')
-        #urban_quality['ind13'], urban_quality['data_ind13'] = self._ind13() #recreational areas problem
-        urban_quality['ind14'], urban_quality['data_ind14'] = self._ind14()
-        urban_quality['ind15'], urban_quality['data_ind15'] = self._ind15()
-        urban_quality['ind17'], urban_quality['data_ind17'] = self._ind17()
-        #urban_quality['ind18'], urban_quality['data_ind18'] = self._ind18() #recreational areas problem
-        #urban_quality['ind20'], urban_quality['data_ind20'] = self._ind20() #too much in RAM
-        urban_quality['ind22'], urban_quality['data_ind22'] = self._ind22()
-        urban_quality['ind23'], urban_quality['data_ind23'] = self._ind23()
-        #urban_quality['ind25'], urban_quality['data_ind25'] = self._ind25() #no crosswalks provision in database
-        self.provision = self._collect_provision('kindergartens')
-        urban_quality['ind30'], urban_quality['data_ind30'] = self._ind30()
-        #self.provision = self._collect_provision('stops')
-        #urban_quality['ind32'], urban_quality['data_ind32'] = self._ind32() #no stops provision in database
+        # ind11 is too long (>15 min), ind13 and ind18 have recreational areas problem, ind20 takes too much RAM,
+        # there are no crosswalks (ind25) and stops (ind32) provisions in database
+        indicators = ['ind1', 'ind2', 'ind4', 'ind5', 'ind10', 'ind14', 'ind15', 'ind17', 'ind22', 'ind23', 'ind30']
+        for indicator in progress.iterate(indicators, "urban quality"):
+            if indicator == 'ind30':
+                self.provision = self._collect_provision('kindergartens')
+            urban_quality[indicator], urban_quality['data_' + indicator] = getattr(self, '_' + indicator)()
 
         urban_quality['urban_quality_value'] = urban_quality.filter(regex='^ind.*').mean(axis=1).round(0)
         
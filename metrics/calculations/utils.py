@@ -19,17 +19,16 @@ def geojson_projection_management(geojson, set_crs, to_crs):
     gdf = gdf.set_crs(set_crs).to_crs(to_crs)
     return json.loads(gdf.to_json())
 
-def nk_routes_between_two_points(G_nk, nodes_data, p1, p2, exact_geometry=False):
+def nk_routes_between_two_points(G_nk, snap_index, p1, p2, exact_geometry=False):
     
-    distance, p_ = spatial.cKDTree(nodes_data).query([p1, p2])
-    p1_ = nodes_data.iloc[p_[0]].name
-    p2_ = nodes_data.iloc[p_[1]].name
+    distance, p_ = snap_index.query([p1, p2])
+    p1_, p2_ = int(p_[0]), int(p_[1])
     dijkstra = nk.distance.Dijkstra(G_nk, source=p1_, target=p2_, storePaths=True)
     dijkstra.run()
     route_len = round(dijkstra.distance(p2_) + distance.sum(), 2)
 
     if exact_geometry:
-        complete_route = [(nodes_data[n]["x"], nodes_data[n]["y"]) for n in dijkstra.getPath(p2_)]
+        complete_route = [tuple(snap_index.coords[n]) for n in dijkstra.getPath(p2_)]
         route_geometry = shapely.geometry.LineString(complete_route)
     else:
         route_geometry =  shapely.geometry.LineString([p1, p2])
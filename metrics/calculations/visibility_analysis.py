@@ -1,9 +1,19 @@
+import os
 import geopandas as gpd
+import numpy as np
 import shapely
 import json
 import shapely.wkt
 
+from concurrent.futures import ThreadPoolExecutor
 from .base_method import BaseMethod
+from .errors import ImplementationError
+
+# viewsheds of a batch are calculated in threads, shapely and numpy release the GIL,
+# every request runs in a thread of the calculation executor, so the default is small
+WORKERS = int(os.environ.get("VISIBILITY_WORKERS", 2))
+# the count grid is dense, it covers the extent of points with their view distance
+MAX_GRID_CELLS = int(os.environ.get("VISIBILITY_MAX_GRID_CELLS", 4_000_000))
 
 
 class VisibilityAnalysis(BaseMethod):
@@ -12,30 +22,148 @@ class VisibilityAnalysis(BaseMethod):
         BaseMethod.__init__(self, city_model)
         super().validation("visibility_analysis")
         self.buildings = self.city_model.Buildings.copy()
+        # spatial index of the city layer is built once and kept until the layer is updated
+        self.buildings_index = self.city_model.Buildings.sindex
+
+    def get_visibility_result(self, point, view_distance, angle_step=360 / 64):
+
+        circuit = self._get_visibility_polygon(point, view_distance, angle_step)
+        view_zone = gpd.GeoDataFrame(geometry=[circuit]).set_crs(self.city_crs).to_crs(4326)
+        return json.loads(view_zone.to_json())
+
+    def get_visibility_batch_result(self, points, view_distance, angle_step=360 / 64, output="zones", cell_size=10):
+        """
+        Viewsheds of many points. Points are grouped by tiles of the view distance size, buildings
+        within reach of a tile are selected with the spatial index once for all its points.
+
+        Returns zones of points (output='zones'), their union (output='union') or cells of the size
+        with numbers of zones they are visible from (output='count').
+        """
+
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if output == "count":
+            width, height = np.ptp(points, axis=0) + 2 * view_distance
+            cells_number = (np.ceil(width / cell_size) + 1) * (np.ceil(height / cell_size) + 1)
+            if cells_number > MAX_GRID_CELLS:
+                raise ImplementationError(
+                    f"The count grid of {int(cells_number)} cells exceeds the limit of {MAX_GRID_CELLS} cells. "
+                    "Increase cell_size or split the points.")
+        tiles, tile_rows = np.unique(np.floor(points / view_distance), axis=0, return_inverse=True)
+        tile_rows = tile_rows.ravel()
+        candidates = [
+            self.buildings.geometry.values[self.buildings_index.query(
+                shapely.box(*((tile - 1) * view_distance), *((tile + 2) * view_distance)), predicate="intersects")]
+            for tile in tiles
+            ]
+        with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+            zones = list(pool.map(
+                lambda i: self._get_visibility_polygon(points[i], view_distance, angle_step, candidates[tile_rows[i]]), 
+                range(len(points))
+                ))
+
+        if output == "union":
+            result = gpd.GeoDataFrame({"points_number": [len(points)]}, geometry=[shapely.union_all(zones)])
+        elif output == "count":
+            result = self._get_visibility_count(np.array(zones), cell_size)
+        else:
+            result = gpd.GeoDataFrame({"point_id": range(len(points))}, geometry=zones)
+        return json.loads(result.set_crs(self.city_crs).to_crs(4326).to_json())
+
+    @staticmethod
+    def _get_visibility_count(zones, cell_size):
+        # number of zones containing centres of grid cells, cells seen from no point are dropped
+        zones = zones[~shapely.is_empty(zones)]
+        if not len(zones):
+            return gpd.GeoDataFrame({"visibility_count": []}, geometry=[])
+        xmin, ymin, xmax, ymax = shapely.total_bounds(zones)
+        count = np.zeros((int(np.ceil((ymax - ymin) / cell_size)) + 1, int(np.ceil((xmax - xmin) / cell_size)) + 1), dtype=int)
+        for zone, (x0, y0, x1, y1) in zip(zones, shapely.bounds(zones)):
+            columns = np.arange(int((x0 - xmin) // cell_size), int((x1 - xmin) // cell_size) + 1)
+            rows = np.arange(int((y0 - ymin) // cell_size), int((y1 - ymin) // cell_size) + 1)
+            x, y = np.meshgrid(xmin + (columns + 0.5) * cell_size, ymin + (rows + 0.5) * cell_size)
+            count[rows[0]:rows[-1] + 1, columns[0]:columns[-1] + 1] += shapely.contains_xy(zone, x, y)
+
+        # neighbouring cells of a row with the same count are joined into one box
+        padded = np.pad(count, ((0, 0), (1, 1)), constant_values=-1)
+        rows, starts = np.nonzero(padded[:, 1:-1] != padded[:, :-2])
+        ends = np.r_[starts[1:], 0]
+        ends[np.r_[rows[1:] != rows[:-1], True]] = count.shape[1]
+        values = count[rows, starts]
+        rows, starts, ends, values = rows[values > 0], starts[values > 0], ends[values > 0], values[values > 0]
+        cells = shapely.box(xmin + starts * cell_size, ymin + rows * cell_size, 
+                            xmin + ends * cell_size, ymin + (rows + 1) * cell_size)
+        return gpd.GeoDataFrame({"visibility_count": values}, geometry=cells)
+
+    def _get_visibility_polygon(self, point, view_distance, angle_step, buildings=None):
+        """
+        Casts rays from the point with the angle step (in degrees) up to the view distance.
+        Every ray stops at the first edge of buildings within the view distance, edges are
+        searched with STRtree and intersections are calculated for all rays at once.
+        Buildings are selected from the given candidates or from the whole layer.
+        """
 
-    def get_visibility_result(self, point, view_distance):
-        
         point_buffer = shapely.geometry.Point(point).buffer(view_distance)
-        s = self.buildings.within(point_buffer)
-        buildings_in_buffer = self.buildings.loc[s[s].index].reset_index(drop=True)
-        buffer_exterior_ = list(point_buffer.exterior.coords)
-        line_geometry = [shapely.geometry.LineString([point, ext]) for ext in buffer_exterior_]
-        buffer_lines_gdf = gpd.GeoDataFrame(geometry=line_geometry)
-        united_buildings = buildings_in_buffer.unary_union
-
-        if united_buildings:
-            splited_lines = buffer_lines_gdf['geometry'].apply(lambda x: x.difference(united_buildings))
+        if buildings is None:
+            buildings_in_buffer = self.buildings.geometry.values[
+                self.buildings_index.query(point_buffer, predicate="contains")]
         else:
-            splited_lines = buffer_lines_gdf["geometry"]
+            buildings_in_buffer = buildings[shapely.contains(point_buffer, buildings)]
 
-        splited_lines_gdf = gpd.GeoDataFrame(geometry=splited_lines).explode(index_parts=True)
-        splited_lines_list = []
+        angles = np.arange(0, 360, angle_step) * np.pi / 180
+        directions = np.column_stack([np.cos(angles), np.sin(angles)]) * view_distance
+        hits = np.ones(len(directions))
 
-        for u, v in splited_lines_gdf.groupby(level=0):
-            splited_lines_list.append(v.iloc[0]['geometry'].coords[-1])
-        circuit = shapely.geometry.Polygon(splited_lines_list)
-        if united_buildings:
-            circuit = circuit.difference(united_buildings)
+        segments, entering_sign, segments_buildings = self._get_edges(buildings_in_buffer)
+        if len(segments):
+            rays = shapely.linestrings(np.stack([np.broadcast_to(point, directions.shape), directions + point], axis=1))
+            tree = shapely.STRtree(shapely.linestrings(segments.reshape(-1, 2, 2)))
+            rays_positions, segments_positions = tree.query(rays, predicate="intersects")
 
-        view_zone = gpd.GeoDataFrame(geometry=[circuit]).set_crs(self.city_crs).to_crs(4326)
-        return json.loads(view_zone.to_json())
\ No newline at end of file
+            # ray point + t * direction crosses edge start + s * (end - start)
+            start = segments[segments_positions, :2]
+            edge = segments[segments_positions, 2:] - start
+            direction = directions[rays_positions]
+            offset = start - np.asarray(point)
+            denominator = direction[:, 0] * edge[:, 1] - direction[:, 1] * edge[:, 0]
+            parallel = denominator == 0
+            denominator[parallel] = 1
+            t = (offset[:, 0] * edge[:, 1] - offset[:, 1] * edge[:, 0]) / denominator
+            s = (offset[:, 0] * direction[:, 1] - offset[:, 1] * direction[:, 0]) / denominator
+            # rays stop where they enter buildings from outside of all the other buildings,
+            # as they would at the boundary of buildings union
+            entering = denominator * entering_sign[segments_positions] < 0
+            crossed = np.flatnonzero(~parallel & entering & (t >= 0) & (t <= 1) & (np.abs(s - 0.5) <= 0.5 + 1e-9))
+            crossing = shapely.points(np.asarray(point) + direction[crossed] * t[crossed, None])
+            crossing_positions, buildings_positions = shapely.STRtree(buildings_in_buffer).query(crossing, predicate="within")
+            covered = buildings_positions != segments_buildings[segments_positions[crossed[crossing_positions]]]
+            crossed = np.delete(crossed, np.unique(crossing_positions[covered]))
+            np.minimum.at(hits, rays_positions[crossed], t[crossed])
+
+        circuit = shapely.geometry.Polygon(np.r_[point + directions * hits[:, None], [point + directions[0] * hits[0]]])
+        # only buildings touching the visible zone are cut out of it
+        cut_buildings = buildings_in_buffer[shapely.intersects(buildings_in_buffer, circuit)]
+        if len(cut_buildings):
+            circuit = circuit.difference(shapely.union_all(cut_buildings))
+        return circuit
+
+    @staticmethod
+    def _get_edges(buildings):
+        """
+        Returns (x1, y1, x2, y2) segments of buildings rings, signs of their orientation and positions
+        of their buildings. A ray crosses a segment into the building if the cross product of the ray
+        and the segment has the opposite sign.
+        """
+
+        parts, parts_buildings = shapely.get_parts(buildings, return_index=True)
+        rings, polygons = shapely.get_rings(parts, return_index=True)
+        coords, index = shapely.get_coordinates(rings, return_index=True)
+        same_ring = index[1:] == index[:-1]
+        segments = np.column_stack([coords[:-1][same_ring], coords[1:][same_ring]])
+        segments_rings = index[:-1][same_ring]
+
+        # the building is on the left of counterclockwise exterior rings and on the right of holes
+        doubled_area = np.bincount(segments_rings, segments[:, 0] * segments[:, 3] - segments[:, 2] * segments[:, 1], 
+                                   minlength=len(rings))
+        exterior = np.r_[True, polygons[1:] != polygons[:-1]] if len(rings) else np.zeros(0, dtype=bool)
+        ring_sign = np.sign(doubled_area) * np.where(exterior, 1, -1)
+        return segments, ring_sign[segments_rings], parts_buildings[polygons[segments_rings]]
@@ -1,4 +1,5 @@
 import geopandas as gpd
+import numpy as np
 import shapely
 import pandas as pd
 import math
@@ -114,69 +115,52 @@ class WeightedVoronoi(BaseMethod):
         return self_weigth, log_r
 
     @staticmethod
-    def _vertex_checker(x_coords, y_coords, growth_rules, encounter_indexes, input_geojson):
-        for i in range(len(growth_rules)):
-            if growth_rules[i] == False:
-                pass
-            else:
-                for index in encounter_indexes:
-                    if shapely.geometry.Point(x_coords[i],y_coords[i]).within(input_geojson['geometry'][index]):
-                        growth_rules[i] = False
-                        break
-        return growth_rules
-
-    @staticmethod
-    def _growth_funtion_x(x_coords, growth_rules, iteration_weight):
-        growth_x = [x_coords[i-1] + iteration_weight  *math.sin(2 * math.pi * i / 65) 
-        if growth_rules[i-1] == True else x_coords[i-1] for i in range(1, len(x_coords) + 1)]
-        return growth_x 
-    
-    @staticmethod
-    def _growth_funtion_y(y_coords, growth_rules, iteration_weight):    
-        growth_y = [y_coords[i-1] + iteration_weight * math.cos(2 * math.pi * i / 65) 
-        if growth_rules[i-1] == True else y_coords[i-1] for i in range(1, len(y_coords) + 1)]
-        return growth_y
+    def _get_encounters(polygons):
+        # pairs of sites which polygons grown to the final radius intersect
+        sites, neighbours = shapely.STRtree(polygons).query(polygons)
+        intersect = (sites != neighbours) & shapely.intersects(polygons[sites], polygons[neighbours])
+        return sites[intersect], neighbours[intersect]
 
     def get_weighted_voronoi_result(self, geojson):
 
         iter_count = 300
         geojson_crs = geojson["crs"]["properties"]["name"]
         input_geojson = gpd.GeoDataFrame.from_features(geojson['features']).set_crs(geojson_crs)
-        input_geojson['init_centroid'] = input_geojson.apply(lambda x: list(x['geometry'].coords)[0], axis = 1)
-        input_geojson['geometry'] = input_geojson.apply(lambda x: shapely.geometry.Polygon([
-            [list(x['geometry'].coords)[0][0] + x['weight'] * math.sin(2 * math.pi * i / 65),
-            list(x['geometry'].coords)[0][1] + x['weight'] * math.cos(2 * math.pi * i / 65)] 
-            for i in range(1, 65)]), axis =1)
-        input_geojson['x'] = input_geojson.apply(
-            lambda x: list(list(zip(*list(x['geometry'].exterior.coords)))[0]), axis = 1)
-        input_geojson['y'] = input_geojson.apply(
-            lambda x: list(list(zip(*list(x['geometry'].exterior.coords)))[1]), axis = 1)
-        input_geojson['self_weight'] = input_geojson.apply(
-            lambda x: self._self_weight_list_calculation(x['weight'], iter_count)[0], axis = 1)
-        input_geojson['self_radius'] = input_geojson.apply(
-            lambda x: self._self_weight_list_calculation(x['weight'], iter_count)[1], axis = 1)
-        input_geojson['vertex_growth_allow_rule'] = input_geojson.apply(
-            lambda x: [True for x in range(len(x['x']))], axis = 1)
-        temp = pd.DataFrame({'x':input_geojson.apply(
-            lambda x: self._growth_funtion_x(x['x'], x['vertex_growth_allow_rule'],x['self_radius'][-1]), axis = 1),
-                    'y':input_geojson.apply(
-                        lambda x: self._growth_funtion_y(x['y'], x['vertex_growth_allow_rule'], x['self_radius'][-1]), 
-                        axis = 1)}).apply(
-                            lambda x: shapely.geometry.Polygon(tuple(zip(x['x'], x['y']))), axis = 1)
-        input_geojson['encounter_rule_index'] = [
-            [y for y in range(len(temp)) if y != x if temp[x].intersects(temp[y])] for x in range(len(temp))]
+
+        # polygons of sites are kept as (sites, 65, 2) coordinates, the last vertex closes the ring
+        # and grows along its own direction
+        weights = input_geojson['weight'].to_numpy(dtype=float)
+        sin = np.array([math.sin(2 * math.pi * i / 65) for i in range(1, 66)])
+        cos = np.array([math.cos(2 * math.pi * i / 65) for i in range(1, 66)])
+        centres = shapely.get_coordinates(input_geojson['geometry'].values)
+        x = centres[:, [0]] + weights[:, None] * sin
+        y = centres[:, [1]] + weights[:, None] * cos
+        x[:, -1], y[:, -1] = x[:, 0], y[:, 0]
+        growth_allowed = np.ones(x.shape, dtype=bool)
+
+        self_weight, self_radius = zip(*[self._self_weight_list_calculation(weight, iter_count) for weight in weights])
+        self_weight = np.array(self_weight)
+        final_radius = np.array(self_radius)[:, -1]
+        sites, neighbours = self._get_encounters(
+            shapely.polygons(np.stack([x + final_radius[:, None] * sin, y + final_radius[:, None] * cos], axis=-1)))
+        encounters = sites * len(weights) + neighbours
+
         for i in range(iter_count):
-            input_geojson['x'] = input_geojson.apply(
-                lambda x: self._growth_funtion_x(x['x'], x['vertex_growth_allow_rule'],x['self_weight'][i]), axis = 1)
-            input_geojson['y'] = input_geojson.apply(
-                lambda x: self._growth_funtion_y(x['y'],x['vertex_growth_allow_rule'],x['self_weight'][i]), axis = 1)
-            input_geojson['geometry'] = input_geojson.apply(
-                lambda x: shapely.geometry.Polygon(tuple(zip(x['x'], x['y']))), axis = 1)   
-            input_geojson['vertex_growth_allow_rule'] = input_geojson.apply(
-                lambda x: self._vertex_checker(
-                    x['x'], x['y'], x['vertex_growth_allow_rule'], x['encounter_rule_index'], input_geojson), 
-                    axis = 1)
-        
+            x = np.where(growth_allowed, x + self_weight[:, [i]] * sin, x)
+            y = np.where(growth_allowed, y + self_weight[:, [i]] * cos, y)
+            polygons = shapely.polygons(np.stack([x, y], axis=-1))
+
+            # growing vertices stop once they get inside polygons of encountered sites,
+            # polygons which bounds contain a vertex are found with STRtree
+            vertex_sites, vertices = np.nonzero(growth_allowed)
+            vertex_x, vertex_y = x[vertex_sites, vertices], y[vertex_sites, vertices]
+            positions, candidates = shapely.STRtree(polygons).query(shapely.points(vertex_x, vertex_y))
+            encountered = np.isin(vertex_sites[positions] * len(polygons) + candidates, encounters)
+            positions, candidates = positions[encountered], candidates[encountered]
+            inside = shapely.contains_xy(polygons[candidates], vertex_x[positions], vertex_y[positions])
+            growth_allowed[vertex_sites[positions[inside]], vertices[positions[inside]]] = False
+        input_geojson['geometry'] = polygons
+
         start_points = gpd.GeoDataFrame.from_features(geojson['features'])
         x = [list(p.coords)[0][0] for p in start_points['geometry']]
         y = [list(p.coords)[0][1] for p in start_points['geometry']]
@@ -8,13 +8,19 @@ import os
 import pickle
 import rpyc
 import json
+import time
+import threading
 import geopandas as gpd
 import networkx as nx
 
 from sqlalchemy import create_engine
 from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
 from .DataValidation import DataValidation
-from .data_transform import load_graph_geometry, convert_nx2nk, get_nx2nk_idmap, get_nk_attrs, get_subgraph
+from .city_snapshot import get_snapshot_path, snapshot_exists, write_city_snapshot, load_city_snapshot
+from .data_transform import load_graph_geometry, convert_nx2csr, get_graph_version, get_nx2nk_idmap, get_nk_attrs, get_subgraph, MODE_EDGE_TYPES
+from .snap_index import SnapIndex
+from .mode_graphs import ModeGraph
 
 # TODO: SQL queries as a separate class
 # TODO provisions lengths from rpyc method
@@ -39,6 +45,7 @@ class CityInformationModel:
         self.city_id = cities_db_id
         self.cwd = cwd
         self.mode = mode
+        self.load_timings = {}
 
         if mode == "general_mode":
             self.engine = create_engine(postgres_con)
@@ -54,6 +61,19 @@ class CityInformationModel:
             return super().__new__(cls)
             
 
+    def __getattr__(self, attr_name):
+        # layers of a mapped city snapshot are read on first access, every layer is read
+        # once under its own lock and stays lazy if reading fails
+        lazy_layers = self.__dict__.get("_lazy_layers", {})
+        layer_locks = self.__dict__.get("_layer_locks", {})
+        if attr_name.startswith("_") or attr_name not in layer_locks:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{attr_name}'")
+        with layer_locks[attr_name]:
+            if attr_name not in self.__dict__:
+                self.__dict__[attr_name] = lazy_layers[attr_name]()
+                del lazy_layers[attr_name]
+        return self.__dict__[attr_name]
+
     @classmethod
     def _validate(cls, *args, **kwargs) -> bool:
         rpyc_connect = rpyc.connect(
@@ -64,41 +84,96 @@ class CityInformationModel:
         return pickle.loads(rpyc_connect.root.get_city_model_attr(kwargs["city_name"], "readiness"))
 
     def get_all_attributes(self) -> dict:
-        all_attr = self.__dict__
+        for attr_name in list(self.__dict__.get("_lazy_layers", {})):
+            getattr(self, attr_name)
+        all_attr = {k: v for k, v in self.__dict__.items() if k not in ("_lazy_layers", "_layer_locks")}
         return all_attr
 
     def set_city_layers(self) -> None:
 
         if self.mode == "general_mode":
-            self.get_city_layers_from_db()
-            self.get_supplementary_graphs()
+            snapshot_path = get_snapshot_path(self.city_name)
+            if snapshot_exists(snapshot_path):
+                print(self.city_name, "snapshot")
+                started_at = time.perf_counter()
+                self._lazy_layers = load_city_snapshot(self, snapshot_path)
+                self._layer_locks = {attr_name: threading.Lock() for attr_name in self._lazy_layers}
+                self.load_timings["snapshot"] = round(time.perf_counter() - started_at, 3)
+            else:
+                self.get_city_layers_from_db()
+                started_at = time.perf_counter()
+                self.get_supplementary_graphs()
+                self.load_timings["supplementary_graphs"] = round(time.perf_counter() - started_at, 3)
+                if snapshot_path:
+                    started_at = time.perf_counter()
+                    write_city_snapshot(self, self.attr_names, snapshot_path)
+                    self.load_timings["snapshot"] = round(time.perf_counter() - started_at, 3)
         else:
             self.set_none_layers()
         del self.attr_names
         
-    def get_city_layers_from_db(self) -> None:
-
-        rpyc_connect = rpyc.connect(
-            self.rpyc_adr, self.rpyc_port,
-            config={'allow_public_attrs': True, 
-                    "allow_pickle": True}
-                    )
-        rpyc_connect._config['sync_request_timeout'] = None
-        
-        for attr_name in self.attr_names:
-            print(self.city_name, attr_name)
-            setattr(self, attr_name, pickle.loads(
-                rpyc_connect.root.get_city_model_attr(self.city_name, attr_name)))
+    def get_city_layers_from_db(self, workers=4) -> None:
+
+        # rpyc connections are not thread-safe, so every thread fetches layers through its own one
+        local = threading.local()
+        connections = []
+
+        def get_layer(attr_name):
+            if not hasattr(local, "rpyc_connect"):
+                local.rpyc_connect = rpyc.connect(
+                    self.rpyc_adr, self.rpyc_port,
+                    config={'allow_public_attrs': True, 
+                            "allow_pickle": True}
+                            )
+                local.rpyc_connect._config['sync_request_timeout'] = None
+                connections.append(local.rpyc_connect)
+            started_at = time.perf_counter()
+            layer = pickle.loads(local.rpyc_connect.root.get_city_model_attr(self.city_name, attr_name))
+            self.load_timings[attr_name] = round(time.perf_counter() - started_at, 3)
+            print(self.city_name, attr_name, self.load_timings[attr_name])
+            return layer
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for attr_name, layer in zip(self.attr_names, pool.map(get_layer, self.attr_names)):
+                    setattr(self, attr_name, layer)
+        finally:
+            for rpyc_connect in connections:
+                rpyc_connect.close()
         
     def get_supplementary_graphs(self) -> None:
 
-        sub_edges = ["subway", "bus", "tram", "trolleybus", "walk"] # exclude drive
-        MobilitySubGraph = get_subgraph(self.MobilityGraph, "type", sub_edges)
+        MobilitySubGraph = self.get_mobility_subgraph()
+        self.mode_graphs = self.get_mode_graphs(MobilitySubGraph)
+        public_transport = self.mode_graphs["public_transport"]
         self.nk_idmap = get_nx2nk_idmap(MobilitySubGraph)
         self.nk_attrs = get_nk_attrs(MobilitySubGraph)
-        self.graph_nk_length = convert_nx2nk(MobilitySubGraph, idmap=self.nk_idmap, weight="length_meter")
-        self.graph_nk_time = convert_nx2nk(MobilitySubGraph, idmap=self.nk_idmap, weight="time_min")
-        self.MobilitySubGraph = load_graph_geometry(MobilitySubGraph)
+        self.graph_csr_length = public_transport.csr["length_meter"]
+        self.graph_csr_time = public_transport.csr["time_min"]
+        self.graph_nk_length = public_transport.get_nk("length_meter")
+        self.graph_nk_time = public_transport.get_nk("time_min")
+        self.graph_version = get_graph_version(self.graph_csr_length, self.graph_csr_time)
+        self.MobilitySubGraph = MobilitySubGraph
+
+    def get_mobility_subgraph(self):
+
+        MobilitySubGraph = get_subgraph(self.MobilityGraph, "type", MODE_EDGE_TYPES["public_transport"])
+        return load_graph_geometry(MobilitySubGraph)
+
+    def get_mode_graphs(self, MobilitySubGraph):
+
+        mode_graphs = {}
+        for mode, edge_types in MODE_EDGE_TYPES.items():
+            # public transport graph is MobilitySubGraph, so graph_nk_* and graph_csr_* share its node ids
+            if mode == "public_transport":
+                subgraph = MobilitySubGraph
+            else:
+                subgraph = get_subgraph(self.MobilityGraph, "type", edge_types)
+            mode_graphs[mode] = ModeGraph(
+                mode, convert_nx2csr(subgraph, weights=ModeGraph.weights), SnapIndex.from_graph(subgraph),
+                lambda: self.MobilityGraph, self.city_crs
+                )
+        return mode_graphs
 
     def set_none_layers(self) -> None:
         for attr_name in self.attr_names:
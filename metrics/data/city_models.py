@@ -1,6 +1,10 @@
 import os
+import time
+import threading
+import traceback
 import pandas as pd
 
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy import create_engine
 from data.CityInformationModel import CityInformationModel
 
@@ -9,15 +13,121 @@ postgres_con = "postgresql://" + os.environ["POSTGRES"]
 engine = create_engine(postgres_con)
 address, port = rpyc_server.split(":") if ":" in rpyc_server else (rpyc_server, 18861)
 
+# number of cities loaded at the same time, layers of every city are fetched concurrently as well
+CITY_LOADING_WORKERS = int(os.environ.get("CITY_LOADING_WORKERS", 4))
+
+
+class CityNotReadyError(Exception):
+    """Exception raised when a city model is requested before it is loaded.
+
+    Attributes:
+        city - code of the city
+        status - loading status of the city
+        message - explanation of the error
+    """
+    def __init__(self, city, status):
+        self.city = city
+        self.status = status
+        self.message = f"City {city} is not available yet (status: {status})."
+        super().__init__(self.message)
+
+
+class CityModels:
+    """
+    City models loaded in background.
+
+    A city is served as soon as its model is loaded, requests to the other cities
+    raise CityNotReadyError. Loading time of every city and its layers is kept for the report.
+    """
+
+    def __init__(self, cities, workers):
+        self.cities = cities
+        self.models = {}
+        self.status = {city["code"]: "queued" for city in cities}
+        self.errors = {}
+        self.timings = {city["code"]: {} for city in cities}
+        self.started = None
+        self.finished = None
+        self.ready_callbacks = []
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="city_loading")
+        self.lock = threading.Lock()
+
+    def __getitem__(self, city):
+        if city not in self.models:
+            raise CityNotReadyError(getattr(city, "value", city), self.status.get(city, "unknown"))
+        return self.models[city]
+
+    def __contains__(self, city):
+        return city in self.models
+
+    def add_ready_callback(self, callback):
+        """
+        Calls callback(city_model) for every loaded city, including the ones loaded before.
+        """
+
+        with self.lock:
+            self.ready_callbacks.append(callback)
+            models = list(self.models.values())
+        for model in models:
+            callback(model)
+
+    def start(self):
+        self.started = time.time()
+        for city in self.cities:
+            self.pool.submit(self._load, city)
+
+    def _load(self, city):
+        code = city["code"]
+        self.status[code] = "loading"
+        started_at = time.perf_counter()
+        try:
+            model = CityInformationModel(
+                city_name=code, city_crs=city["local_crs"], cities_db_id=city["id"], mode="general_mode",
+                postgres_con=postgres_con, rpyc_adr=address, rpyc_port=port
+                )
+            if model is None:
+                self.status[code] = "not_ready"
+            else:
+                self.timings[code].update(model.load_timings)
+                with self.lock:
+                    self.models[code] = model
+                    self.status[code] = "ready"
+                    callbacks = list(self.ready_callbacks)
+                for callback in callbacks:
+                    callback(model)
+        except Exception as e:
+            traceback.print_exc()
+            self.errors[code] = f"{type(e).__name__}: {e}"
+            self.status[code] = "failed"
+        finally:
+            self.timings[code]["total"] = round(time.perf_counter() - started_at, 3)
+            print(f"{code} {self.status[code]} in {self.timings[code]['total']} s")
+            with self.lock:
+                if all(s not in ("queued", "loading") for s in self.status.values()):
+                    self.finished = time.time()
+                    print("Cities loaded in", round(self.finished - self.started, 3), "s")
+
+    def get_report(self) -> dict:
+        end = self.finished or time.time()
+        return {
+            "elapsed": round(end - self.started, 3) if self.started else None,
+            "finished": self.finished is not None,
+            "cities": {
+                code: {
+                    "status": status, "error": self.errors.get(code), "timings": self.timings[code]
+                    }
+                for code, status in self.status.items()
+                }
+            }
+
+
 cities = pd.read_sql(
     """SELECT * FROM cities
-    WHERE local_crs is not null AND code is not null""", 
+    WHERE local_crs is not null AND code is not null""",
     con=engine)
 
 city_names = cities.set_index("code")["name"].to_dict()
 
 cities = cities.sort_values(["id"])[["id", "code", "local_crs"]].to_dict("records")
-city_models = {city["code"]: CityInformationModel(
-    city_name=city["code"], city_crs=city["local_crs"], cities_db_id=city["id"], mode="general_mode", 
-    postgres_con=postgres_con, rpyc_adr=address, rpyc_port=port
-    ) for city in cities}
\ No newline at end of file
+city_models = CityModels(cities, CITY_LOADING_WORKERS)
+city_models.start()
@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import shutil
+import pickle
+import uuid
+import shapely
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import networkx as nx
+import pyarrow as pa
+
+from pyarrow import feather
+from scipy import sparse
+from .snap_index import SnapIndex
+from .mode_graphs import ModeGraph
+
+# City snapshot is a directory written once per city and mapped by every worker on a host:
+# tables are uncompressed Arrow IPC files, MobilityGraph is stored as Arrow tables of nodes and
+# edges, routing graphs as CSR arrays in .npy files that are memory-mapped read-only, so their
+# pages are shared between processes. Layers are materialized on first access. Files are opened
+# when a snapshot is loaded, so a snapshot removed or written again does not break loaded cities.
+SNAPSHOT_DIR = os.environ.get("CITY_SNAPSHOT_DIR")
+# snapshots of other format versions are written again
+SNAPSHOT_VERSION = 4
+# snapshots older than the limit are stale, cities are loaded from the RPYC server and written again
+SNAPSHOT_MAX_AGE = float(os.environ.get("CITY_SNAPSHOT_MAX_AGE_HOURS", 24)) * 3600
+
+
+def get_snapshot_path(city_name):
+    return os.path.join(SNAPSHOT_DIR, city_name) if SNAPSHOT_DIR else None
+
+
+def snapshot_exists(path):
+    if path is None or not os.path.exists(os.path.join(path, "meta.json")):
+        return False
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    return meta.get("version") == SNAPSHOT_VERSION and time.time() - meta.get("created", 0) <= SNAPSHOT_MAX_AGE
+
+
+def remove_city_snapshot(path):
+    # cities loaded from the snapshot keep their opened files
+    if path is not None:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def write_city_snapshot(city_model, attr_names, path, overwrite=False):
+
+    if snapshot_exists(path) and not overwrite:
+        return
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    tmp_path = os.path.join(parent, f".{os.path.basename(path)}.{uuid.uuid4().hex}")
+    os.makedirs(tmp_path)
+
+    try:
+        meta = {"version": SNAPSHOT_VERSION, "created": time.time(), "layers": {}, 
+                "graph_version": city_model.graph_version}
+        for attr_name in attr_names:
+            meta["layers"][attr_name] = _write_layer(tmp_path, attr_name, getattr(city_model, attr_name))
+
+        for mode, mode_graph in city_model.mode_graphs.items():
+            for weight, graph in mode_graph.csr.items():
+                for array_name in ["data", "indices", "indptr"]:
+                    np.save(os.path.join(tmp_path, f"{mode}.{weight}.{array_name}.npy"), getattr(graph, array_name))
+            np.save(os.path.join(tmp_path, f"{mode}.coords.npy"), mode_graph.snap_index.coords)
+            np.save(os.path.join(tmp_path, f"{mode}.labels.npy"), mode_graph.snap_index.labels)
+        meta["modes"] = {mode: list(mode_graph.csr) for mode, mode_graph in city_model.mode_graphs.items()}
+        np.save(os.path.join(tmp_path, "nk_attrs.npy"), city_model.nk_attrs[["x", "y"]].to_numpy())
+        idmap = city_model.nk_idmap
+        np.save(os.path.join(tmp_path, "nk_idmap.npy"), np.array([list(idmap.keys()), list(idmap.values())]))
+
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+        if os.path.exists(path) and (overwrite or not snapshot_exists(path)):
+            shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp_path, path)
+    except OSError:
+        # another process has written the snapshot first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if not snapshot_exists(path):
+            raise
+
+
+def load_city_snapshot(city_model, path):
+
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+
+    def load(name):
+        return np.load(os.path.join(path, name), mmap_mode="r")
+
+    def load_csr(mode, weight):
+        data, indices, indptr = (load(f"{mode}.{weight}.{x}.npy") for x in ["data", "indices", "indptr"])
+        n = len(indptr) - 1
+        return sparse.csr_matrix((data, indices, indptr), shape=(n, n), copy=False)
+
+    city_model.mode_graphs = {
+        mode: ModeGraph(
+            mode, {weight: load_csr(mode, weight) for weight in weights},
+            SnapIndex(load(f"{mode}.coords.npy"), load(f"{mode}.labels.npy")),
+            lambda: city_model.MobilityGraph, city_model.city_crs
+            )
+        for mode, weights in meta["modes"].items()
+        }
+    public_transport = city_model.mode_graphs["public_transport"]
+    city_model.graph_csr_length = public_transport.csr["length_meter"]
+    city_model.graph_csr_time = public_transport.csr["time_min"]
+    city_model.nk_attrs = pd.DataFrame(np.asarray(load("nk_attrs.npy")), columns=["x", "y"])
+    city_model.graph_version = meta["graph_version"]
+
+    lazy_layers = {
+        attr_name: (lambda source=_open_layer(path, attr_name, kind), kind=kind: _read_layer(source, kind))
+        for attr_name, kind in meta["layers"].items()
+        }
+    nk_idmap = load("nk_idmap.npy")
+    lazy_layers["nk_idmap"] = lambda: dict(nk_idmap.T.tolist())
+    lazy_layers["graph_nk_length"] = lambda: public_transport.get_nk("length_meter")
+    lazy_layers["graph_nk_time"] = lambda: public_transport.get_nk("time_min")
+    lazy_layers["MobilitySubGraph"] = city_model.get_mobility_subgraph
+    return lazy_layers
+
+
+def _write_layer(path, attr_name, layer):
+
+    try:
+        if isinstance(layer, nx.Graph):
+            _write_graph(path, attr_name, layer)
+            return "graph"
+        elif isinstance(layer, gpd.GeoDataFrame):
+            layer.to_feather(os.path.join(path, f"{attr_name}.arrow"), compression="uncompressed")
+            return "geo"
+        elif isinstance(layer, pd.DataFrame):
+            _write_table(os.path.join(path, f"{attr_name}.arrow"), layer)
+            return "table"
+    except (pa.ArrowException, ValueError, TypeError):
+        pass
+    # layers that can not be represented by arrow tables (e.g. mixed types in a column)
+    with open(os.path.join(path, f"{attr_name}.pickle"), "wb") as f:
+        pickle.dump(layer, f)
+    return "pickle"
+
+
+def _open_layer(path, attr_name, kind):
+
+    if kind == "graph":
+        with open(os.path.join(path, f"{attr_name}.graph.json")) as f:
+            meta = json.load(f)
+        return (meta, pa.memory_map(os.path.join(path, f"{attr_name}.nodes.arrow")),
+                pa.memory_map(os.path.join(path, f"{attr_name}.edges.arrow")))
+    elif kind in ("geo", "table"):
+        return pa.memory_map(os.path.join(path, f"{attr_name}.arrow"))
+    return open(os.path.join(path, f"{attr_name}.pickle"), "rb")
+
+
+def _read_layer(source, kind):
+
+    if kind == "graph":
+        return _read_graph(*source)
+    elif kind == "geo":
+        return gpd.read_feather(source)
+    elif kind == "table":
+        return _read_table(source)
+    source.seek(0)
+    return pickle.load(source)
+
+
+def _write_table(file_path, df):
+
+    # shapely objects are stored as WKB and restored by column names saved in metadata
+    geometry_columns = [
+        col for col in df.columns
+        if df[col].dtype == object and df[col].map(lambda x: isinstance(x, shapely.Geometry)).any()
+        ]
+    df = df.assign(**{col: shapely.to_wkb(df[col].to_numpy()) for col in geometry_columns})
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    metadata = {**(table.schema.metadata or {}), b"geometry_columns": json.dumps(geometry_columns).encode()}
+    feather.write_feather(table.replace_schema_metadata(metadata), file_path, compression="uncompressed")
+
+
+def _read_table(source):
+
+    table = feather.read_table(source)
+    df = table.to_pandas()
+    for col in json.loads(table.schema.metadata.get(b"geometry_columns", b"[]")):
+        df[col] = shapely.from_wkb(df[col].to_numpy())
+    return df
+
+
+def _write_graph(path, attr_name, G_nx):
+
+    nodes = pd.DataFrame.from_dict(dict(G_nx.nodes(data=True)), orient="index")
+    edges = pd.DataFrame([
+        {"_u": u, "_v": v, "_key": k, **d} for u, v, k, d in G_nx.edges(keys=True, data=True)
+        ] if G_nx.is_multigraph() else [{"_u": u, "_v": v, **d} for u, v, d in G_nx.edges(data=True)])
+    _write_table(os.path.join(path, f"{attr_name}.nodes.arrow"), nodes)
+    _write_table(os.path.join(path, f"{attr_name}.edges.arrow"), edges)
+    with open(os.path.join(path, f"{attr_name}.graph.json"), "w") as f:
+        json.dump({"directed": G_nx.is_directed(), "multigraph": G_nx.is_multigraph(), "graph": G_nx.graph},
+                  f, default=str)
+
+
+def _read_graph(meta, nodes_source, edges_source):
+
+    G_nx = {
+        (True, True): nx.MultiDiGraph, (True, False): nx.DiGraph,
+        (False, True): nx.MultiGraph, (False, False): nx.Graph
+        }[(meta["directed"], meta["multigraph"])](**meta["graph"])
+
+    def records(df):
+        # missing attributes are restored as absent keys, not as NaN values
+        return [{k: v for k, v in r.items() if v is not None and v == v} for r in df.to_dict("records")]
+
+    nodes = _read_table(nodes_source)
+    G_nx.add_nodes_from(zip(nodes.index.tolist(), records(nodes)))
+    edges = _read_table(edges_source)
+    ends = [edges.pop(col).tolist() for col in ["_u", "_v", "_key"] if col in edges.columns]
+    G_nx.add_edges_from(zip(*ends, records(edges)))
+    return G_nx
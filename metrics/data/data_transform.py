@@ -1,8 +1,19 @@
+import hashlib
 import shapely
 import networkit as nk
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 
+from scipy import sparse
+
+# edge types of the mobility graph used by every travel mode
+MODE_EDGE_TYPES = {
+    "public_transport": ["subway", "bus", "tram", "trolleybus", "walk"],
+    "walk": ["walk"],
+    "drive": ["car"]
+    }
+
 def load_graph_geometry(G_nx, node=True, edge=False):
 
     if edge:
@@ -33,34 +44,79 @@ def get_nk_attrs(G_nx):
         )
     return pd.DataFrame(attrs.values(), index=attrs.keys())
 
-def convert_nx2nk(G_nx, idmap=None, weight=None):
+def get_nx2nk_edges(G_nx, idmap=None, weights=()):
 
+    # endpoints and weights of all edges in one pass, missing weights are set to 1
     if not idmap:
         idmap = get_nx2nk_idmap(G_nx)
-    n = max(idmap.values()) + 1
-    edges = list(G_nx.edges())
+    u, v, w = [], [], [[] for _ in weights]
+    for u_, v_, d in G_nx.edges(data=True):
+        u.append(idmap[u_])
+        v.append(idmap[v_])
+        for values, weight in zip(w, weights):
+            values.append(d.get(weight, 1))
+
+    u, v = np.array(u, dtype=np.int64), np.array(v, dtype=np.int64)
+    w = {weight: np.round(np.array(values, dtype=np.float64), 1) for weight, values in zip(weights, w)}
+    return u, v, w
+
+def convert_edges2csr(u, v, w, n, directed=True):
+
+    if not directed:
+        u, v, w = np.r_[u, v], np.r_[v, u], np.r_[w, w]
+
+    # keep the lightest of parallel edges instead of summing them up
+    order = np.lexsort((w, v, u))
+    u, v, w = u[order], v[order], w[order]
+    first = np.r_[True, (np.diff(u) != 0) | (np.diff(v) != 0)] if len(u) else np.zeros(0, dtype=bool)
+    u, v, w = u[first], v[first], w[first]
+    indptr = np.r_[0, np.cumsum(np.bincount(u, minlength=n))]
+
+    return sparse.csr_matrix((w, v, indptr), shape=(n, n))
+
+def convert_nx2csr(G_nx, idmap=None, weights=("length_meter", "time_min")):
+
+    # all weight graphs are built from one traversal of the networkx graph
+    if not idmap:
+        idmap = get_nx2nk_idmap(G_nx)
+    n = max(idmap.values()) + 1 if idmap else 0
+    u, v, w = get_nx2nk_edges(G_nx, idmap, weights)
+    return {weight: convert_edges2csr(u, v, w[weight], n, G_nx.is_directed()) for weight in weights}
+
+def convert_nx2nk(G_nx, idmap=None, weight=None):
 
+    if not idmap:
+        idmap = get_nx2nk_idmap(G_nx)
     if weight:
-        G_nk = nk.Graph(n, directed=G_nx.is_directed(), weighted=True)
-        for u_, v_ in edges:
-                u, v = idmap[u_], idmap[v_]
-                d = dict(G_nx[u_][v_])
-                if len(d) > 1:
-                    for d_ in d.values():
-                            v__ = G_nk.addNodes(2)
-                            u__ = v__ - 1
-                            w = round(d_[weight], 1) if weight in d_ else 1
-                            G_nk.addEdge(u, v, w)
-                            G_nk.addEdge(u_, u__, 0)
-                            G_nk.addEdge(v_, v__, 0)
-                else:
-                    d_ = list(d.values())[0]
-                    w = round(d_[weight], 1) if weight in d_ else 1
-                    G_nk.addEdge(u, v, w)
-    else:
-        G_nk = nk.Graph(n, directed=G_nx.is_directed())
-        for u_, v_ in edges:
-                u, v = idmap[u_], idmap[v_]
-                G_nk.addEdge(u, v)
-
-    return G_nk
\ No newline at end of file
+        return convert_csr2nk(convert_nx2csr(G_nx, idmap, [weight])[weight])
+
+    n = max(idmap.values()) + 1 if idmap else 0
+    u, v, _ = get_nx2nk_edges(G_nx, idmap)
+    G_nk = nk.GraphFromCoo((u, v), n, weighted=False, directed=G_nx.is_directed())
+    G_nk.removeMultiEdges()
+    return G_nk
+
+def convert_nk2csr(G_nk):
+
+    n = G_nk.upperNodeIdBound()
+    edges = np.array(list(G_nk.iterEdgesWeights()), dtype=np.float64).reshape(-1, 3)
+    u, v = edges[:, 0].astype(np.int64), edges[:, 1].astype(np.int64)
+    return convert_edges2csr(u, v, edges[:, 2], n, G_nk.isDirected())
+
+
+def get_graph_version(*csr_graphs):
+
+    digest = hashlib.sha1()
+    for graph in csr_graphs:
+        for array in (graph.data, graph.indices, graph.indptr):
+            digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+def convert_csr2nk(csr_graph):
+
+    coo = csr_graph.tocoo()
+    return nk.GraphFromCoo(
+        (coo.data.astype(np.float64), (coo.row.astype(np.int64), coo.col.astype(np.int64))),
+        csr_graph.shape[0], weighted=True, directed=True
+        )
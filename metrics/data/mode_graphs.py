@@ -0,0 +1,79 @@
+import threading
+import networkx as nx
+import pandas as pd
+import geopandas as gpd
+
+from .data_transform import MODE_EDGE_TYPES, get_subgraph, convert_csr2nk
+
+
+class ModeGraph:
+    """
+    Read-only routing graphs of one travel mode built once per city.
+
+    Nodes are numbered by positions in the mode subgraph of MobilityGraph, the same ids are
+    used by csr and networkit graphs, snap index and nodes table. Networkit graphs, nodes table,
+    networkx subgraph view and links are built on first use and shared by all requests, so they
+    must not be modified.
+    """
+
+    weights = ["length_meter", "time_min"]
+
+    def __init__(self, mode, csr_graphs, snap_index, get_mobility_graph, crs):
+        self.mode = mode
+        self.crs = crs
+        self.csr = csr_graphs
+        self.snap_index = snap_index
+        for csr_graph in csr_graphs.values():
+            for array in (csr_graph.data, csr_graph.indices, csr_graph.indptr):
+                array.flags.writeable = False
+        self._get_mobility_graph = get_mobility_graph
+        self._cache = {}
+        self._lock = threading.RLock()
+
+    def _cached(self, name, build):
+        if name not in self._cache:
+            with self._lock:
+                if name not in self._cache:
+                    self._cache[name] = build()
+        return self._cache[name]
+
+    def get_nk(self, weight):
+        return self._cached(f"nk_{weight}", lambda: convert_csr2nk(self.csr[weight]))
+
+    @property
+    def nx_graph(self):
+        """
+        Subgraph view of MobilityGraph with edges of the mode.
+        """
+
+        return self._cached("nx_graph", lambda: get_subgraph(
+            self._get_mobility_graph(), "type", MODE_EDGE_TYPES[self.mode]
+            ))
+
+    @property
+    def nodes(self):
+        """
+        GeoDataFrame of node attributes indexed by node ids.
+        """
+
+        def build():
+            labels = self.snap_index.labels.tolist()
+            mobility_graph = self._get_mobility_graph()
+            nodes = pd.DataFrame.from_records([mobility_graph.nodes[u] for u in labels])
+            nodes = nodes.drop(columns="geometry", errors="ignore")
+            nodes["nodeID"] = labels
+            coords = self.snap_index.coords
+            return gpd.GeoDataFrame(nodes, geometry=gpd.points_from_xy(coords[:, 0], coords[:, 1]), crs=self.crs)
+        return self._cached("nodes", build)
+
+    @property
+    def links(self):
+        """
+        GeoDataFrame of undirected links with one edge between a pair of nodes.
+        """
+
+        def build():
+            links = nx.to_pandas_edgelist(nx.Graph(self.nx_graph))
+            links["geometry"] = gpd.GeoSeries.from_wkt(links["geometry"])
+            return gpd.GeoDataFrame(links, geometry="geometry", crs=self.crs)
+        return self._cached("links", build)
@@ -0,0 +1,38 @@
+import numpy as np
+import shapely
+
+from scipy import spatial
+
+
+class SnapIndex:
+    """
+    Nearest graph node search for one travel mode.
+
+    Node ids returned by queries are positions of nodes in the mode graph (networkit ids),
+    labels holds their networkx ids and coords their coordinates in the city crs.
+    """
+
+    def __init__(self, coords, labels):
+        self.coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        self.labels = np.asarray(labels)
+        self.tree = spatial.cKDTree(self.coords)
+
+    @classmethod
+    def from_graph(cls, G_nx):
+        coords = [(d["x"], d["y"]) for _, d in G_nx.nodes(data=True)]
+        return cls(coords, list(G_nx.nodes()))
+
+    def query(self, points):
+        """
+        Returns distances to the nearest nodes and ids of the nodes for an array of (x, y) points.
+        """
+
+        return self.tree.query(np.asarray(points, dtype=np.float64).reshape(-1, 2))
+
+    def nearest(self, geometry):
+        """
+        The same as query for an array or GeoSeries of geometries, which are snapped by their centroids.
+        """
+
+        centroids = shapely.centroid(np.asarray(geometry))
+        return self.query(np.column_stack([shapely.get_x(centroids), shapely.get_y(centroids)]))
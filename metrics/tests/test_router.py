@@ -1,3 +1,4 @@
+import copy
 import pytest
 
 from tests.conf import testing_settings
@@ -27,16 +28,20 @@ ADMINISTRATIVE_UNITS = [
 class TestTrafficsCalculation:
     URL = f"http://{testing_settings.APP_ADDRESS_FOR_TESTING}/pedastrian_walk_traffics"
 
+    @pytest.mark.parametrize("edge_flows", [False, True])
     @pytest.mark.parametrize("city, geojson", [
         (enums.CitiesEnum.SAINT_PETERSBURG, CitiesPolygonForTrafficsCalculation.SAINT_PETERSBURG_INSIDE_GEOJSON),
         (enums.CitiesEnum.KRASNODAR, CitiesPolygonForTrafficsCalculation.KRASNODAR_INSIDE_GEOJSON),
         (enums.CitiesEnum.SEVASTOPOL, CitiesPolygonForTrafficsCalculation.SEVASTOPOL_INSIDE_GEOJSON),
     ])
-    def test_pedastrian_walk_traffics_calculation(self, client, city, geojson):
+    def test_pedastrian_walk_traffics_calculation(self, client, city, geojson, edge_flows):
         url = self.URL + "/pedastrian_walk_traffics_calculation"
-        resp = client.post(url, json={"city": city, "geojson": geojson})
+        resp = client.post(url, json={"city": city, "geojson": geojson, "edge_flows": edge_flows})
 
         assert resp.status_code == 200
+        if edge_flows:
+            assert resp.json()["edges"] is not None
+            assert resp.json()["routes"] is None
 
     @pytest.mark.parametrize("city, geojson", [
         (enums.CitiesEnum.SAINT_PETERSBURG, CitiesPolygonForTrafficsCalculation.SAINT_PETERSBURG_OUTSIDE_GEOJSON),
@@ -73,6 +78,34 @@ class TestVisibilityAnalysis:
         resp = client.get(url, params=params)
         assert resp.status_code == 200
 
+    @pytest.mark.parametrize("output", ["zones", "union", "count"])
+    @pytest.mark.parametrize("city, x_from, y_from", VIEWPOINTS)
+    def test_visibility_analysis_batch(self, client, city, x_from, y_from, output):
+        url = self.URL + "/visibility_analysis_batch"
+        data = {
+            "city": city,
+            "points": [[x_from, y_from], [x_from + 0.001, y_from + 0.001]],
+            "view_distance": 700,
+            "output": output,
+        }
+
+        resp = client.post(url, json=data)
+        assert resp.status_code == 200
+
+    @pytest.mark.parametrize("city, x_from, y_from", VIEWPOINTS)
+    def test_visibility_analysis_batch_grid_limit(self, client, city, x_from, y_from):
+        url = self.URL + "/visibility_analysis_batch"
+        data = {
+            "city": city,
+            "points": [[x_from, y_from], [x_from + 0.2, y_from + 0.2]],
+            "view_distance": 700,
+            "output": "count",
+            "cell_size": 1,
+        }
+
+        resp = client.post(url, json=data)
+        assert resp.status_code == 422
+
 
 class TestWeightedVoronoi:
     URL = f"http://{testing_settings.APP_ADDRESS_FOR_TESTING}/voronoi"
@@ -385,7 +418,8 @@ class TestDiversity:
 class TestProvision:
     URL = f"http://{testing_settings.APP_ADDRESS_FOR_TESTING}/provision"
 
-    def test_get_provision(self, client):
+    @pytest.mark.parametrize("calculation_type", ["gravity", "gravity_vectorized", "linear_vectorized"])
+    def test_get_provision(self, client, calculation_type):
         url = self.URL + "/get_provision"
 
         data = {
@@ -393,6 +427,7 @@ class TestProvision:
             "service_types": ["kindergartens"],
             "valuation_type": "normative",
             "year": 2022,
+            "calculation_type": calculation_type,
         }
 
         resp = client.post(url, json=data)
@@ -420,6 +455,25 @@ class TestProvision:
         resp = client.post(url, json=data)
         assert resp.status_code == 200
 
+    def test_recalculate_provisions_incremental(self, client):
+        url = self.URL + "/recalculate_provisions"
+        user_changes_services = copy.deepcopy(provision_geojson_examples.provisions_tests_kinders)
+        user_changes_services["features"][0]["properties"]["capacity"] += 100
+
+        data = {
+            "city": enums.CitiesEnum.SAINT_PETERSBURG,
+            "service_types": ["kindergartens"],
+            "valuation_type": "normative",
+            "year": 2022,
+            "calculation_type": "gravity_vectorized",
+            "incremental": True,
+            "user_changes_services": user_changes_services,
+            "user_provisions": provision_geojson_examples.provisions_tests_kinders_provisions,
+        }
+
+        resp = client.post(url, json=data)
+        assert resp.status_code == 200
+
 
 class TestCollocationMatrix:
     URL = f"http://{testing_settings.APP_ADDRESS_FOR_TESTING}/collocation_matrix"
@@ -469,4 +523,53 @@ class TestBlocksAccessibility:
         }
 
         resp = client.get(url, params=params)
-        assert resp.status_code == 200
\ No newline at end of file
+        assert resp.status_code == 200
+
+class TestCitiesLoading:
+    URL = f"http://{testing_settings.APP_ADDRESS_FOR_TESTING}/cities"
+
+    def test_get_cities_loading(self, client):
+        """ Тестирование отчета о загрузке городов. """
+        url = self.URL + "/loading"
+
+        resp = client.get(url)
+        assert resp.status_code == 200
+        assert set(resp.json()["cities"]) >= {city.value for city in enums.CitiesEnum}
+
+
+class TestExecution:
+    URL = f"http://{testing_settings.APP_ADDRESS_FOR_TESTING}/execution"
+
+    def test_get_execution_metrics(self, client):
+        """ Тестирование метрик очередей вычислений. """
+        url = self.URL + "/metrics"
+
+        resp = client.get(url)
+        assert resp.status_code == 200
+        assert "endpoints" in resp.json()
+
+
+class TestJobs:
+    URL = f"http://{testing_settings.APP_ADDRESS_FOR_TESTING}/jobs"
+
+    def test_provision_job(self, client):
+        """ Тестирование фоновых задач обеспеченности. """
+        data = {
+            "city": enums.CitiesEnum.SAINT_PETERSBURG,
+            "service_types": ["kindergartens"],
+            "valuation_type": "normative",
+            "year": 2022,
+        }
+
+        resp = client.post(self.URL + "/provision/get_provision", json=data)
+        assert resp.status_code == 200
+        job = resp.json()
+        assert client.post(self.URL + "/provision/get_provision", json=data).json()["job_id"] == job["job_id"]
+
+        resp = client.get(self.URL + f"/{job['job_id']}")
+        assert resp.status_code == 200
+        assert resp.json()["status"] in ("queued", "running", "done")
+
+    def test_unknown_job(self, client):
+        resp = client.get(self.URL + "/" + "0" * 32)
+        assert resp.status_code == 404